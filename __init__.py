@@ -1,8 +1,15 @@
-from .nodes import OnDemandLoraLoader, OnDemandUNETLoader, OnDemandCheckpointLoader, OnDemandVAELoader, OnDemandCLIPLoader, OnDemandGGUFLoader, OnDemandControlNetLoader, OnDemandDualCLIPLoader, OnDemandCLIPVisionLoader
+import time
+
+# Share of the ComfyUI boot time spent importing this package
+_import_started = time.perf_counter()
+
+from .nodes import OnDemandLoraLoader, OnDemandLoraStack, OnDemandUNETLoader, OnDemandCheckpointLoader, OnDemandVAELoader, OnDemandCLIPLoader, OnDemandGGUFLoader, OnDemandControlNetLoader, OnDemandDualCLIPLoader, OnDemandCLIPVisionLoader
 from .lora_node import OnDemandCivitaiLikedLoraLoader
+from . import routes
 
 NODE_CLASS_MAPPINGS = {
     "OnDemandLoraLoader": OnDemandLoraLoader,
+    "OnDemandLoraStack": OnDemandLoraStack,
     "OnDemandUNETLoader": OnDemandUNETLoader,
     "OnDemandCheckpointLoader": OnDemandCheckpointLoader,
     "OnDemandVAELoader": OnDemandVAELoader,
@@ -16,6 +23,7 @@ NODE_CLASS_MAPPINGS = {
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "OnDemandLoraLoader": "OnDemand Lora Loader",
+    "OnDemandLoraStack": "OnDemand Lora Stack",
     "OnDemandUNETLoader": "OnDemand UNET Loader",
     "OnDemandCheckpointLoader": "OnDemand Checkpoint Loader",
     "OnDemandVAELoader": "OnDemand VAE Loader",
@@ -31,6 +39,13 @@ WEB_DIRECTORY = "./js"
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS', "WEB_DIRECTORY"]
 
+from .utils import logger
+from .metrics import STARTUP_SECONDS
+
+STARTUP_TIME = time.perf_counter() - _import_started
+STARTUP_SECONDS.set(STARTUP_TIME)
+logger.info(f"Nodes loaded in {STARTUP_TIME * 1000:.0f} ms")
+
 # Module metadata
 __version__ = "1.0.13"
 __author__ = "francarl"
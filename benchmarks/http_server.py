@@ -0,0 +1,167 @@
+"""
+Local stand-in for Civitai/HuggingFace serving synthetic files of any size, generated on the fly.
+
+Files are requested as /files/<size in bytes>/<filename>, with optional query parameters:
+
+    ranges=0          do not advertise nor honour Range requests
+    latency=0.05      seconds to wait before answering each request
+    rate=50           bandwidth cap of each connection, in MB/s
+    redirect=1        answer with a 302 to the same file (as Civitai and HuggingFace do)
+    fail_status=2     answer 503 to the first N requests of the file
+    drop_after=0.5    close each connection once after sending this fraction of its body
+    key=abc           separates the failure counters of the runs sharing a file
+
+    python benchmarks/http_server.py --port 8765
+"""
+import time
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MB = 1024 ** 2
+# The content repeats this block, shifted by the offset, so any range can be generated without storing the file
+BLOCK = b"".join(hashlib.sha256(i.to_bytes(4, "little")).digest() for i in range(MB // 32))
+WRITE_SIZE = 256 * 1024
+
+
+def synthetic_bytes(start, end):
+    """
+    Returns the bytes [start, end) of every synthetic file.
+    """
+    chunks = []
+    position = start
+    while position < end:
+        offset = position % len(BLOCK)
+        chunk = BLOCK[offset:offset + end - position]
+        chunks.append(chunk)
+        position += len(chunk)
+    return b"".join(chunks)
+
+
+class _Failures:
+    """
+    Counts the injected failures already served, so that each one happens a fixed number of times.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, limit):
+        with self.lock:
+            count = self.counts.get(key, 0)
+            if count >= limit:
+                return False
+            self.counts[key] = count + 1
+            return True
+
+
+class SyntheticFileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = _Failures()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve(self, send_body):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if len(parts) < 3 or parts[0] not in ("files", "redirected") or not parts[1].isdigit():
+            return self._send_empty(404)
+        size, filename = int(parts[1]), "/".join(parts[2:])
+        key = params.get("key", "") + url.path
+
+        time.sleep(float(params.get("latency", 0)))
+        if parts[0] == "files" and params.get("redirect") == "1":
+            return self._send_empty(302, [("Location", "/redirected/" + "/".join(parts[1:]) + "?" + url.query)])
+        if self.failures.take(("status", key), int(params.get("fail_status", 0))):
+            return self._send_empty(503, [("Retry-After", "0")])
+
+        ranges = params.get("ranges", "1") != "0"
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if ranges and range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+            status = 206
+
+        self.send_response(status)
+        if ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("ETag", f'"{size}"')
+        self.end_headers()
+        if send_body:
+            self._send_body(start, end + 1, params, key)
+
+    def _send_body(self, start, end, params, key):
+        rate = float(params.get("rate", 0)) * MB
+        drop_after = float(params.get("drop_after", 0))
+        # Once per segment: the reconnection asks for the rest of the segment, which has the same end
+        drop_at = start + int((end - start) * drop_after) if drop_after and self.failures.take(("drop", key, end), 1) else None
+        sent_since = time.monotonic()
+        position = start
+        try:
+            while position < end:
+                chunk_end = min(position + WRITE_SIZE, end)
+                if drop_at is not None and chunk_end >= drop_at:
+                    self.wfile.write(synthetic_bytes(position, drop_at))
+                    self.close_connection = True
+                    return
+                self.wfile.write(synthetic_bytes(position, chunk_end))
+                position = chunk_end
+                if rate:
+                    # Sleep until the bytes sent so far match the bandwidth cap
+                    delay = (position - start) / rate - (time.monotonic() - sent_since)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (ConnectionError, OSError):
+            self.close_connection = True
+
+
+class SyntheticFileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def start_server(port=0):
+    """
+    Starts the server in a background thread.
+
+    Returns:
+        SyntheticFileServer: The running server, its port is server.server_address[1].
+    """
+    server = SyntheticFileServer(("127.0.0.1", port), SyntheticFileHandler)
+    threading.Thread(target=server.serve_forever, name="synthetic-http", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves synthetic model files for the download benchmarks.")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = SyntheticFileServer(("127.0.0.1", args.port), SyntheticFileHandler)
+    print(f"Serving synthetic files on http://127.0.0.1:{args.port}/files/<size>/<filename>")
+    server.serve_forever()
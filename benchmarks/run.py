@@ -0,0 +1,241 @@
+"""
+Download engine benchmarks, run offline against the synthetic server of http_server.py.
+
+Each scenario downloads a synthetic file with _download_model in a fresh subprocess, so that
+the settings read from the environment at import time apply and the CPU time and peak RSS
+are those of the download alone. Results are written as JSON, and compared to a previous
+run with --baseline to catch throughput regressions.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --quick --filter "chunks-*" --baseline benchmarks/results/before.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import fnmatch
+import argparse
+import platform
+import tempfile
+import importlib
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+from http_server import start_server, synthetic_bytes, MB
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PACKAGE_NAME = "ondemand_loaders"
+PACKAGE_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+# Throughput drop, relative to the baseline, reported as a regression
+DEFAULT_TOLERANCE = 0.15
+
+
+def _scenario(name, query="", chunks=0, connections=8, resume=False):
+    return {"name": name, "query": query, "chunks": chunks, "connections": connections, "resume": resume}
+
+
+SCENARIOS = [
+    # Block size of the write loop, automatic (0) or forced with download_chunks
+    _scenario("chunks-auto-1conn", connections=1),
+    _scenario("chunks-64k-1conn", chunks=64, connections=1),
+    _scenario("chunks-1m-1conn", chunks=1024, connections=1),
+    _scenario("chunks-8m-1conn", chunks=8192, connections=1),
+    _scenario("chunks-auto-8conn", connections=8),
+    _scenario("chunks-64k-8conn", chunks=64, connections=8),
+    _scenario("chunks-1m-8conn", chunks=1024, connections=8),
+    _scenario("chunks-8m-8conn", chunks=8192, connections=8),
+    # Servers without Range support fall back to a single stream
+    _scenario("single-stream", query="ranges=0"),
+    # Civitai and HuggingFace redirect every download to a CDN
+    _scenario("redirect-latency", query="redirect=1&latency=0.05"),
+    # Segmented downloads against a per-connection bandwidth cap
+    _scenario("capped-1conn", query="rate=50", connections=1),
+    _scenario("capped-8conn", query="rate=50", connections=8),
+    # Every segment is dropped halfway once and reconnects
+    _scenario("reconnect", query="drop_after=0.5"),
+    # The first attempt fails halfway, the measured one resumes from the .part file
+    _scenario("resume", query="drop_after=0.5", resume=True),
+    # 503 answers retried by the HTTP session
+    _scenario("http-retry", query="fail_status=2"),
+]
+
+
+def _load_downloader():
+    # Same bootstrap as cli.py: the sibling modules without the package __init__, which imports ComfyUI
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.downloader")
+
+
+def _usage():
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return usage.ru_utime + usage.ru_stime, peak_rss
+
+
+def _check_content(model_filepath, size):
+    """
+    Compares a few ranges of the downloaded file with the synthetic content.
+    """
+    with open(model_filepath, 'rb') as f:
+        for offset in (0, size // 3, size // 2, max(0, size - MB)):
+            f.seek(offset)
+            if f.read(MB) != synthetic_bytes(offset, min(offset + MB, size)):
+                return f"content differs at byte {offset}"
+    return None
+
+
+def _run_worker(params):
+    """
+    Downloads one file in this process and returns the measurements.
+    """
+    downloader = _load_downloader()
+    destination_dir = os.path.join(params["models_dir"], "loras")
+    url, size = params["url"], params["size"]
+
+    if params["resume"]:
+        # Give up at the first dropped connection, leaving the .part file behind
+        stall_retries, downloader.STALL_RETRIES = downloader.STALL_RETRIES, 0
+        if downloader._download_model(url, params["name"], destination_dir, None, params["chunks"]):
+            return {"error": "the interrupted attempt did not fail"}
+        downloader.STALL_RETRIES = stall_retries
+
+    metrics = sys.modules[f"{PACKAGE_NAME}.metrics"]
+    downloaded_before = sum(metrics.DOWNLOADED_BYTES.values.values())
+    cpu_start, _ = _usage()
+    start = time.perf_counter()
+    model_filepath = downloader._download_model(url, params["name"], destination_dir, None, params["chunks"])
+    seconds = time.perf_counter() - start
+    cpu_end, peak_rss = _usage()
+    # Less than the file size when the download resumed
+    downloaded = sum(metrics.DOWNLOADED_BYTES.values.values()) - downloaded_before
+
+    if not model_filepath or os.path.getsize(model_filepath) != size:
+        return {"error": "download failed"}
+    error = _check_content(model_filepath, size)
+    if error:
+        return {"error": error}
+    return {
+        "seconds": round(seconds, 3),
+        "throughput_mbps": round(size / MB / seconds, 2),
+        "downloaded_mb": round(downloaded / MB, 1),
+        "cpu_seconds": round(cpu_end - cpu_start, 3) if cpu_start is not None else None,
+        "peak_rss_mb": round(peak_rss / MB, 1) if peak_rss is not None else None,
+    }
+
+
+def _run_scenario(scenario, base_url, size, run_key):
+    query = "&".join(filter(None, [scenario["query"], f"key={run_key}-{scenario['name']}"]))
+    with tempfile.TemporaryDirectory(prefix="ondemand-bench-") as models_dir:
+        params = {
+            "url": f"{base_url}/files/{size}/{scenario['name']}.safetensors?{query}",
+            "name": scenario["name"],
+            "size": size,
+            "chunks": scenario["chunks"],
+            "resume": scenario["resume"],
+            "models_dir": models_dir,
+        }
+        env = dict(os.environ,
+                   ONDEMAND_LOADERS_DOWNLOAD_CONNECTIONS=str(scenario["connections"]),
+                   ONDEMAND_LOADERS_MIN_SEGMENT_MB="1",
+                   ONDEMAND_LOADERS_STATE_DIR=os.path.join(models_dir, ".ondemand_loaders"),
+                   TQDM_DISABLE="1")
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(params)],
+                                   env=env, capture_output=True, text=True)
+    try:
+        # The measurements are the last line, after the log of the download
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        result = {"error": f"worker exited with {completed.returncode}: {completed.stderr.strip()[-500:]}"}
+    return dict(scenario, **result)
+
+
+def _compare(results, baseline, tolerance):
+    """
+    Returns the scenarios whose throughput dropped by more than `tolerance` since the baseline.
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if not before or not before.get("throughput_mbps"):
+            continue
+        if "error" in result:
+            regressions.append(f"{result['name']}: {result['error']}")
+            continue
+        change = result["throughput_mbps"] / before["throughput_mbps"] - 1
+        if change < -tolerance:
+            regressions.append(f"{result['name']}: {before['throughput_mbps']} -> {result['throughput_mbps']} MB/s ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks _download_model against a local synthetic HTTP server.")
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of the downloaded files in MB (default: 1024).")
+    parser.add_argument("--quick", action="store_true", help="Download 64 MB files, for a smoke run.")
+    parser.add_argument("--filter", action="append", help="Only run the scenarios whose name matches this glob. Can be repeated.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/<timestamp>.json).")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare the throughput with.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Throughput drop reported as a regression (default: {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(_run_worker(json.loads(args.worker))))
+        return 0
+
+    size = (64 if args.quick else args.size_mb) * MB
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.filter or any(fnmatch.fnmatchcase(scenario["name"], pattern) for pattern in args.filter)]
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    run_key = str(int(time.time()))
+
+    results = []
+    for scenario in scenarios:
+        result = _run_scenario(scenario, base_url, size, run_key)
+        results.append(result)
+        if "error" in result:
+            print(f"{scenario['name']:<20} FAILED: {result['error']}")
+        else:
+            print(f"{scenario['name']:<20} {result['throughput_mbps']:>9.1f} MB/s  {result['seconds']:>8.2f} s  "
+                  f"cpu {result['cpu_seconds']} s  peak rss {result['peak_rss_mb']} MB")
+    server.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            "created_at": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "size_mb": size // MB,
+            "results": results,
+        }, f, indent=4)
+    print(f"Results written to '{output}'")
+
+    failed = any("error" in result for result in results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = _compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
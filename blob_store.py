@@ -0,0 +1,134 @@
+import os
+
+from .utils import logger, _env_int, _get_state_dir
+from .integrity import HASH_SUFFIX, _normalize_sha256, _file_digest, _write_cached_digest, _remove_cached_digest, _verify_file
+
+# Share identical files between model folders through a content-addressed store, set to 0 to disable
+DEDUP_ENABLED = _env_int('ONDEMAND_LOADERS_DEDUP', 1) != 0
+
+
+def _get_upstream_sha256(response):
+    """
+    Returns the SHA-256 published by the provider for a download, if any.
+    HuggingFace exposes the LFS oid in the X-Linked-Etag header of the redirect to its CDN.
+    """
+    for r in list(response.history) + [response]:
+        sha256 = _normalize_sha256(r.headers.get('X-Linked-Etag'))
+        if sha256:
+            return sha256
+    return None
+
+
+def _get_blob_dir(destination_dir):
+    models_dir = os.path.dirname(os.path.abspath(destination_dir))
+    return os.path.join(_get_state_dir(models_dir), "blobs", "sha256")
+
+
+def _get_blob_path(destination_dir, sha256):
+    return os.path.join(_get_blob_dir(destination_dir), sha256[:2], sha256)
+
+
+def _link_file(source, destination):
+    """
+    Atomically makes destination a hardlink to source.
+
+    Returns:
+        bool: False if the filesystem does not support hardlinks between the two paths.
+    """
+    tmp_destination = destination + ".link"
+    try:
+        # Renaming a link over another name of the same file is a no-op that would leave both names behind
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            return True
+        if os.path.exists(tmp_destination):
+            os.remove(tmp_destination)
+        os.link(source, tmp_destination)
+        os.replace(tmp_destination, destination)
+        return True
+    except OSError as e:
+        logger.warning(f"Unable to hardlink '{destination}' to '{source}': {e}")
+        try:
+            os.remove(tmp_destination)
+        except OSError:
+            pass
+        return False
+
+
+def _link_from_store(sha256, model_filepath):
+    """
+    Materializes model_filepath from the store if a file with the same content was already downloaded.
+
+    Returns:
+        bool: True if the file is now in place without downloading it.
+    """
+    if not DEDUP_ENABLED or not sha256:
+        return False
+    blob_path = _get_blob_path(os.path.dirname(model_filepath), sha256)
+    if not os.path.exists(blob_path):
+        return False
+    # Model files share their content with the blob, one modified in place alters it as well
+    if not _verify_file(blob_path, sha256):
+        _remove_blob(blob_path)
+        return False
+    if _link_file(blob_path, model_filepath):
+        _write_cached_digest(model_filepath, sha256)
+        logger.info(f"Linked '{model_filepath}' to an identical file already downloaded ({sha256[:12]})")
+        return True
+    return False
+
+
+def _add_to_store(model_filepath, sha256=None):
+    """
+    Registers a downloaded file in the store. If a file with the same content already exists,
+    model_filepath is replaced by a hardlink to it and the duplicate bytes are freed.
+
+    Args:
+        model_filepath (str): The downloaded file.
+        sha256 (str): Digest of the file, computed from it when missing.
+
+    Returns:
+        str: The SHA-256 of the file, or None if the store is disabled.
+    """
+    if not DEDUP_ENABLED:
+        return None
+
+    sha256 = sha256 or _file_digest(model_filepath)
+    blob_path = _get_blob_path(os.path.dirname(model_filepath), sha256)
+    try:
+        if os.path.exists(blob_path):
+            if not os.path.samefile(blob_path, model_filepath):
+                if _link_file(blob_path, model_filepath):
+                    _write_cached_digest(model_filepath, sha256)
+                    logger.info(f"'{model_filepath}' is identical to an already downloaded file, sharing its storage")
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.link(model_filepath, blob_path)
+            _write_cached_digest(blob_path, sha256)
+    except OSError as e:
+        logger.warning(f"Unable to add '{model_filepath}' to the deduplication store: {e}")
+    return sha256
+
+
+def _remove_blob(blob_path):
+    try:
+        os.remove(blob_path)
+    except OSError:
+        pass
+    _remove_cached_digest(blob_path)
+
+
+def _gc_blobs(destination_dir):
+    """
+    Removes the blobs no longer linked from any model folder.
+    """
+    blob_dir = _get_blob_dir(destination_dir)
+    for root, _, filenames in os.walk(blob_dir):
+        for filename in filenames:
+            if filename.endswith(HASH_SUFFIX):
+                continue
+            blob_path = os.path.join(root, filename)
+            try:
+                if os.stat(blob_path).st_nlink <= 1:
+                    _remove_blob(blob_path)
+            except OSError:
+                pass
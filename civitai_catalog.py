@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import logger, _env_float, _get_state_dir
+from .http_client import _http_get
+
+# Age after which the cached catalog is revalidated in the background, in minutes
+CATALOG_TTL = _env_float('ONDEMAND_LOADERS_CIVITAI_CATALOG_TTL_MINUTES', 60) * 60
+# Delay before retrying after a failed refresh, in seconds
+CATALOG_RETRY_INTERVAL = 60
+# Largest page size accepted by the Civitai API
+PAGE_SIZE = 100
+# Pages fetched at the same time when the API reports the total number of pages
+PAGE_WORKERS = 4
+
+
+def _get_auth_headers():
+    apikey = os.environ.get('CIVITAI_TOKEN')
+    return {"Authorization": f"Bearer {apikey}"} if apikey else None
+
+
+class CivitaiCatalog:
+    """
+    A list of Civitai models (e.g. the liked LoRAs) persisted on disk, so that it is available
+    instantly at startup. It is refreshed in a background thread once older than CATALOG_TTL,
+    following every page. A catalog that fits in a single page is revalidated with If-None-Match
+    when the API returned an ETag, the ETag of the first page says nothing about the next ones.
+
+    `build` turns the raw API items into the structure served by get().
+    """
+
+    def __init__(self, name, api_url, build, models_dir):
+        self.name = name
+        self.api_url = api_url
+        self.build = build
+        self.models_dir = models_dir
+        self.data = None
+        self.etag = None
+        self.fetched_at = 0.0
+        self.last_attempt = 0.0
+        self.loaded_key = None
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+
+    def _cache_path(self):
+        # Each token has its own favorites, the token itself is never written to disk
+        token_hash = hashlib.sha256((os.environ.get('CIVITAI_TOKEN') or '').encode()).hexdigest()[:12]
+        return os.path.join(_get_state_dir(self.models_dir), f"civitai_{self.name}_{token_hash}.json")
+
+    def _load(self):
+        """
+        Loads the catalog saved by a previous run, once per token.
+        """
+        cache_path = self._cache_path()
+        if self.loaded_key == cache_path:
+            return
+        self.loaded_key = cache_path
+        self.data, self.etag, self.fetched_at = None, None, 0.0
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            self.data = cached["data"]
+            self.etag = cached.get("etag")
+            self.fetched_at = cached.get("fetched_at", 0.0)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        cache_path = self._cache_path()
+        try:
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"data": self.data, "etag": self.etag, "fetched_at": self.fetched_at}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Unable to save the Civitai {self.name} catalog: {e}")
+
+    def get(self, wait=False):
+        """
+        Returns the catalog without waiting for the network, starting a background refresh if it is stale.
+
+        Args:
+            wait (bool): Wait for the refresh when the catalog was never fetched or a refresh is running.
+
+        Returns:
+            The structure built from the API items, or None if not available yet.
+        """
+        with self.lock:
+            self._load()
+            now = time.time()
+            stale = now - self.fetched_at > CATALOG_TTL and now - self.last_attempt > CATALOG_RETRY_INTERVAL
+            if stale and (self.refresh_thread is None or not self.refresh_thread.is_alive()):
+                self.last_attempt = now
+                self.refresh_thread = threading.Thread(target=self._refresh, name=f"civitai-{self.name}", daemon=True)
+                self.refresh_thread.start()
+            refresh_thread = self.refresh_thread
+
+        if wait and refresh_thread is not None:
+            refresh_thread.join()
+        return self.data
+
+    def refresh(self, wait=True):
+        """
+        Refreshes the catalog whatever its age, joining a refresh already running instead of starting another.
+        At most one refresh is started per CATALOG_RETRY_INTERVAL, e.g. when several prompts select a name that is not liked.
+
+        Args:
+            wait (bool): Wait for the refresh, False to only start it in the background.
+
+        Returns:
+            The structure built from the API items, or None if not available yet.
+        """
+        with self.lock:
+            self._load()
+            now = time.time()
+            running = self.refresh_thread is not None and self.refresh_thread.is_alive()
+            if not running and now - self.last_attempt > CATALOG_RETRY_INTERVAL:
+                self.last_attempt = now
+                self.refresh_thread = threading.Thread(target=self._refresh, name=f"civitai-{self.name}", daemon=True)
+                self.refresh_thread.start()
+            refresh_thread = self.refresh_thread
+
+        if wait and refresh_thread is not None:
+            refresh_thread.join()
+        return self.data
+
+    def _refresh(self):
+        headers = _get_auth_headers()
+        try:
+            revalidate = dict(headers or {})
+            if self.etag and self.data is not None:
+                revalidate["If-None-Match"] = self.etag
+            response = _http_get(self.api_url, headers=revalidate, params={"limit": PAGE_SIZE})
+            if response.status_code == 304:
+                logger.info(f"Civitai {self.name} catalog is up to date")
+                with self.lock:
+                    self.fetched_at = time.time()
+                    self._save()
+                return
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+            first_page = response.json()
+
+            items = list(first_page.get("items", []))
+            pages = 1
+            for page in self._fetch_next_pages(first_page.get("metadata") or {}, headers):
+                items.extend(page.get("items", []))
+                pages += 1
+            if pages > 1:
+                # A 304 of the first page would not cover a like or unlike on the next ones
+                etag = None
+
+            data = self.build(items)
+            with self.lock:
+                self.data, self.etag, self.fetched_at = data, etag, time.time()
+                self._save()
+            logger.info(f"Fetched {len(items)} models of the Civitai {self.name} catalog")
+        except Exception as e:
+            logger.error(f"Error in retreving data from Civitai API: {e}")
+
+    def _fetch_next_pages(self, metadata, headers):
+        """
+        Yields the pages following the first one. Numbered pages are fetched concurrently,
+        cursor pages have to be followed one after the other.
+        """
+        total_pages = metadata.get("totalPages")
+        if metadata.get("currentPage") == 1 and isinstance(total_pages, int) and total_pages > 1:
+            def fetch_page(page):
+                response = _http_get(self.api_url, headers=headers, params={"limit": PAGE_SIZE, "page": page})
+                response.raise_for_status()
+                return response.json()
+
+            with ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix="civitai-page") as executor:
+                yield from executor.map(fetch_page, range(2, total_pages + 1))
+            return
+
+        cursor = metadata.get("nextCursor")
+        while cursor:
+            response = _http_get(self.api_url, headers=headers, params={"limit": PAGE_SIZE, "cursor": cursor})
+            response.raise_for_status()
+            page = response.json()
+            yield page
+            next_cursor = (page.get("metadata") or {}).get("nextCursor")
+            cursor = next_cursor if next_cursor != cursor else None
@@ -0,0 +1,180 @@
+"""
+Headless download of the models of config.json, e.g. to bake them into a container image
+or to warm a new node before ComfyUI starts. ComfyUI itself is not imported.
+
+    python custom_nodes/ComfyUI-OnDemand-Loaders/cli.py sync --models-dir models
+    python custom_nodes/ComfyUI-OnDemand-Loaders/cli.py sync --section loras --name "Flux*" --check
+"""
+import os
+import sys
+import json
+import time
+import types
+import fnmatch
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script: load the sibling modules as a package without its __init__, which imports ComfyUI
+    PACKAGE_NAME = "ondemand_loaders"
+    _package = types.ModuleType(PACKAGE_NAME)
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[PACKAGE_NAME] = _package
+    __package__ = PACKAGE_NAME
+
+from .utils import logger, _get_state_dir
+from .config import load_config, _get_config_sha256, SECTION_FOLDERS
+from .http_client import _get_api_key_for_url, _primary_url
+from .model_index import _resolve_from_index
+from .integrity import _file_digest, _hash_file, _read_cached_digest
+from .downloader import _download_model, _download_manager, DEFAULT_DOWNLOAD_CHUNKS
+from .download_manager import PRIORITY_SYNC
+
+# ComfyUI/custom_nodes/<this folder>/../../models
+DEFAULT_MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "models")
+MANIFEST_FILENAME = "manifest.json"
+
+
+def _select_entries(config, sections=None, names=None):
+    """
+    Returns the (section, entry) pairs of the configuration to sync, filtered by section and name globs.
+    """
+    selected = []
+    for section, entries in config.items():
+        if not isinstance(entries, list) or (sections and section not in sections):
+            continue
+        if section not in SECTION_FOLDERS:
+            logger.warning(f"Skipping unknown config section '{section}'")
+            continue
+        for entry in entries:
+            if not isinstance(entry, dict) or not entry.get("url"):
+                continue
+            if names and not any(fnmatch.fnmatchcase(entry.get("name", ""), pattern) for pattern in names):
+                continue
+            selected.append((section, entry))
+    return selected
+
+
+def _sync_entry(section, entry, models_dir, download_chunks):
+    model_name = entry.get("name")
+    destination_dir = os.path.join(models_dir, SECTION_FOLDERS[section])
+    api_key = _get_api_key_for_url(entry["url"], None)
+    return _download_model(entry["url"], model_name, destination_dir, api_key, download_chunks, _get_config_sha256(entry), PRIORITY_SYNC)
+
+
+def _check_entry(section, entry, models_dir, rehash):
+    """
+    Returns the local file of an entry and an error message, without any network access.
+    """
+    destination_dir = os.path.join(models_dir, SECTION_FOLDERS[section])
+    if entry["url"] == 'offline':
+        model_filepath = os.path.join(destination_dir, entry.get("name"))
+        model_filepath = model_filepath if os.path.exists(model_filepath) else None
+    else:
+        model_filepath = _resolve_from_index(_primary_url(entry["url"]), destination_dir)
+    if not model_filepath:
+        return None, "missing"
+
+    expected_sha256 = _get_config_sha256(entry)
+    cached_sha256 = _read_cached_digest(model_filepath)
+    sha256 = _hash_file(model_filepath) if rehash else _file_digest(model_filepath)
+    if expected_sha256 and sha256 != expected_sha256:
+        return model_filepath, f"SHA-256 is {sha256}, expected {expected_sha256}"
+    if rehash and cached_sha256 and sha256 != cached_sha256:
+        return model_filepath, f"SHA-256 is {sha256}, recorded {cached_sha256}"
+    return model_filepath, None
+
+
+def _manifest_record(section, entry, models_dir, model_filepath, error):
+    record = {
+        "section": section,
+        "name": entry.get("name"),
+        "url": entry["url"],
+        "status": "error" if error else "ok",
+    }
+    if error:
+        record["error"] = error
+    if model_filepath and os.path.exists(model_filepath):
+        record["path"] = os.path.relpath(model_filepath, models_dir)
+        record["size"] = os.path.getsize(model_filepath)
+        record["sha256"] = _file_digest(model_filepath)
+    return record
+
+
+def sync(models_dir, sections=None, names=None, jobs=4, check=False, rehash=False, manifest_path=None,
+         download_chunks=DEFAULT_DOWNLOAD_CHUNKS):
+    """
+    Downloads (or only checks) the configured models and writes a manifest of the resolved files.
+
+    Args:
+        models_dir (str): The ComfyUI models directory.
+        sections (list): Config sections to sync, all of them if empty.
+        names (list): Glob patterns of the model names to sync, all of them if empty.
+        jobs (int): Number of models downloaded at the same time.
+        check (bool): Only verify that the models are present and intact, without downloading.
+        rehash (bool): Hash the files again instead of trusting their cached digests.
+        manifest_path (str): Where to write the manifest, defaults to the state directory.
+        download_chunks (int): Fixed read block size in KB, 0 to size the blocks from the measured throughput.
+
+    Returns:
+        list: One manifest record per selected model.
+    """
+    entries = _select_entries(load_config(), sections, names)
+    logger.info(f"{'Checking' if check else 'Syncing'} {len(entries)} models into '{models_dir}'")
+
+    def process(item):
+        section, entry = item
+        try:
+            if check:
+                model_filepath, error = _check_entry(section, entry, models_dir, rehash)
+            else:
+                model_filepath = _sync_entry(section, entry, models_dir, download_chunks)
+                error = None if model_filepath else "download failed"
+            return _manifest_record(section, entry, models_dir, model_filepath, error)
+        except Exception as e:
+            return _manifest_record(section, entry, models_dir, None, str(e))
+
+    # Bulk downloads never bypass the cap, so at most `jobs` models transfer at once
+    _download_manager.max_active = jobs
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="ondemand-sync") as executor:
+        records = list(executor.map(process, entries))
+
+    manifest_path = manifest_path or os.path.join(_get_state_dir(models_dir), MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump({"created_at": time.time(), "models_dir": os.path.abspath(models_dir), "files": records}, f, indent=4)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    logger.info(f"Manifest written to '{manifest_path}'")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description="Downloads the models of the OnDemand Loaders config without starting ComfyUI.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Download the configured models and write a manifest of the resolved files.")
+    sync_parser.add_argument("--models-dir", default=os.environ.get('ONDEMAND_LOADERS_MODELS_DIR') or DEFAULT_MODELS_DIR,
+                             help="ComfyUI models directory (default: the models folder of this ComfyUI installation).")
+    sync_parser.add_argument("--config", help="Path of config.json (default: ONDEMAND_LOADERS_CONFIG_PATH or the one next to this file).")
+    sync_parser.add_argument("--section", action="append", help="Only sync this config section, e.g. loras. Can be repeated.")
+    sync_parser.add_argument("--name", action="append", help="Only sync the models whose name matches this glob. Can be repeated.")
+    sync_parser.add_argument("--jobs", type=int, default=4, help="Number of models downloaded at the same time (default: 4).")
+    sync_parser.add_argument("--check", action="store_true", help="Only verify that the models are present and intact.")
+    sync_parser.add_argument("--rehash", action="store_true", help="Hash the files again instead of trusting the cached .sha256 digests.")
+    sync_parser.add_argument("--manifest", help="Where to write the manifest (default: <models dir>/.ondemand_loaders/manifest.json).")
+    sync_parser.add_argument("--download-chunks", type=int, default=DEFAULT_DOWNLOAD_CHUNKS, help="Fixed read block size in KB (default: 0, sized from the measured throughput).")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        if not os.path.exists(args.config):
+            parser.error(f"config file '{args.config}' not found")
+        os.environ['ONDEMAND_LOADERS_CONFIG_PATH'] = args.config
+
+    records = sync(args.models_dir, args.section, args.name, args.jobs, args.check, args.rehash, args.manifest, args.download_chunks)
+    failures = [record for record in records if record["status"] != "ok"]
+    for record in failures:
+        logger.error(f"{record['section']}/{record['name']}: {record['error']}")
+    logger.info(f"{len(records) - len(failures)} of {len(records)} models ok")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import json
+import threading
+
+from .utils import logger
+from .integrity import _normalize_sha256
+
+# Models folder of each config section, as used by the loaders
+SECTION_FOLDERS = {
+    "loras": "loras",
+    "diffusion_models": "diffusion_models",
+    "checkpoints": "checkpoints",
+    "vae_models": "vae",
+    "clip_models": "text_encoders",
+    "clip_vision": "clip_vision",
+    "gguf_models": "unet",
+    "controlnet_models": "controlnet",
+}
+
+# Parsed configuration, reloaded only when the file path, mtime or size change
+_config_cache = {"key": None, "config": None, "index": None, "names": None}
+_config_lock = threading.Lock()
+
+
+def _get_config_path(config_filename):
+    config_path_env = os.environ.get('ONDEMAND_LOADERS_CONFIG_PATH')
+    if config_path_env and os.path.exists(config_path_env):
+        return config_path_env
+    current_dir = os.path.dirname(__file__)
+    return os.path.join(current_dir, config_filename)
+
+
+def _read_config(config_path):
+    config_filename = os.path.basename(config_path)
+
+    default_config = { 
+        "loras": [
+            {
+                "name": "Lora n1",
+                "url": "not_valid_url",
+            },
+            {
+                "name": "Lora n2",
+                "url": "not_valid_url"
+            }
+        ]
+    }
+
+    try:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        logger.info(f"Successfully loaded configuration from {config_filename}")
+
+        # add None to all lists
+        for key in config:
+            if isinstance(config[key], list):
+                none_entry = {"name": "None", "url": None}
+                if none_entry not in config[key]:
+                    config[key].insert(0, none_entry)
+
+        return config
+    except FileNotFoundError:
+        logger.warning(f"Configuration file '{config_path}' not found. Using default fallback configuration.")
+        return default_config
+    except json.JSONDecodeError:
+        logger.error(f"Error decoding JSON from '{config_path}'. Using default fallback configuration.")
+        return default_config
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while loading '{config_path}': {e}. Using default fallback.")
+        return default_config
+
+
+def _load_cached_config(config_filename="config.json"):
+    """
+    Returns the cached configuration, re-parsing the file only when it changed on disk.
+    """
+    config_path = _get_config_path(config_filename)
+    try:
+        stat = os.stat(config_path)
+        cache_key = (config_path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        cache_key = (config_path, None, None)
+
+    with _config_lock:
+        if _config_cache["key"] != cache_key:
+            config = _read_config(config_path)
+            index = {}
+            names = {}
+            for section, entries in config.items():
+                if isinstance(entries, list):
+                    index[section] = {entry.get("name"): entry for entry in entries if isinstance(entry, dict)}
+                    names[section] = list(index[section])
+            _config_cache.update(key=cache_key, config=config, index=index, names=names)
+        return _config_cache
+
+
+# Function to load configuration 
+def load_config(config_filename="config.json"):
+    return _load_cached_config(config_filename)["config"]
+
+
+def _get_model_names(model_type_key):
+    """
+    Returns the model names of a config section, as shown in the node dropdowns.
+    """
+    return _load_cached_config()["names"].get(model_type_key, [])
+
+
+def _get_config_version():
+    """
+    Returns an object that stays the same until the configuration file is reloaded.
+    """
+    return _load_cached_config()["key"]
+
+
+def _get_config_entries(model_type_key):
+    """
+    Returns the entries of a config section, including the None entry.
+    """
+    return list(_load_cached_config()["index"].get(model_type_key, {}).values())
+
+
+def _get_config_entry(model_name, model_type_key):
+    """
+    Returns the config entry of a model by name in O(1), or None if it is not configured.
+    """
+    return _load_cached_config()["index"].get(model_type_key, {}).get(model_name)
+
+
+def _get_config_sha256(model):
+    """
+    Returns the expected SHA-256 of a config entry, from its optional "sha256" or "hash" field.
+    """
+    if not model:
+        return None
+    value = model.get("sha256") or model.get("hash")
+    sha256 = _normalize_sha256(value)
+    if value and not sha256:
+        logger.warning(f"Ignoring invalid SHA-256 '{value}' of '{model.get('name')}'")
+    return sha256
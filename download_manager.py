@@ -0,0 +1,535 @@
+import os
+import json
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from .utils import logger, _env_int, _env_float
+
+MB = 1024 ** 2
+
+# Job states, a job only ends as completed, failed or cancelled
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Minimum delay between two progress events of a job, in seconds
+PROGRESS_INTERVAL = 0.5
+# Weight of the latest measure in the smoothed transfer rate
+RATE_SMOOTHING = 0.3
+# Finished jobs still listed by the manager
+FINISHED_JOBS_KEPT = 100
+
+# Priority classes, queued jobs with a higher priority start first
+PRIORITY_SYNC = 0
+PRIORITY_PREFETCH = 10
+# Models needed by the executing node start first, and the one it waits for is not held back by the global cap
+PRIORITY_NODE = 20
+
+# Models downloaded at the same time by the process, and from the same host (0 for no host cap).
+# ONDEMAND_LOADERS_PREFETCH_WORKERS is the deprecated name of the process cap, from when only prefetches were capped
+MAX_DOWNLOADS = _env_int('ONDEMAND_LOADERS_MAX_DOWNLOADS', _env_int('ONDEMAND_LOADERS_PREFETCH_WORKERS', 4))
+MAX_DOWNLOADS_PER_HOST = _env_int('ONDEMAND_LOADERS_MAX_DOWNLOADS_PER_HOST', 0)
+# Bandwidth limits in MB/s, overall and for each host (0 for unlimited)
+BANDWIDTH_LIMIT = _env_float('ONDEMAND_LOADERS_BANDWIDTH_LIMIT_MBPS', 0)
+HOST_BANDWIDTH_LIMIT = _env_float('ONDEMAND_LOADERS_HOST_BANDWIDTH_LIMIT_MBPS', 0)
+# Seconds of transfer a token bucket lets through at full speed after being idle
+BANDWIDTH_BURST = 1.0
+
+
+def _load_host_limits():
+    """
+    Reads the per host overrides of ONDEMAND_LOADERS_HOST_LIMITS, a JSON object such as
+    {"civitai.com": {"downloads": 2, "mbps": 20}}. A host also matches its subdomains.
+    """
+    value = os.environ.get('ONDEMAND_LOADERS_HOST_LIMITS')
+    if not value:
+        return {}
+    try:
+        limits = json.loads(value)
+        return {host.lower(): (int(limit.get("downloads", MAX_DOWNLOADS_PER_HOST)), float(limit.get("mbps", HOST_BANDWIDTH_LIMIT)))
+                for host, limit in limits.items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Invalid value for ONDEMAND_LOADERS_HOST_LIMITS, ignoring it: {e}")
+        return {}
+
+
+HOST_LIMITS = _load_host_limits()
+
+
+def _get_host_limits(host):
+    """
+    Returns the (concurrent downloads, MB/s) limits of a host, 0 meaning unlimited.
+    """
+    host = (host or "").lower()
+    for limited_host, limits in HOST_LIMITS.items():
+        if host == limited_host or host.endswith("." + limited_host):
+            return limits
+    return MAX_DOWNLOADS_PER_HOST, HOST_BANDWIDTH_LIMIT
+
+
+class _TokenBucket:
+    """
+    Bandwidth limiter shared by the threads of several downloads. Tokens may go negative,
+    so concurrent consumers wait their turn instead of racing for the refill.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = rate * BANDWIDTH_BURST
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, count):
+        """
+        Returns how long the caller has to sleep before using `count` more bytes, in seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class DownloadCancelled(Exception):
+    """
+    Raised in the downloading thread when its job is paused or cancelled, and to the callers
+    waiting on a cancelled job.
+    """
+
+
+class DownloadJob:
+    """
+    A model download handled by the DownloadManager. The downloader reports its progress
+    with set_total() and progress(), which raise DownloadCancelled once the job is paused or cancelled.
+    """
+
+    def __init__(self, manager, key, name, run, priority, prompt_id=None, node_id=None, host=None):
+        self.manager = manager
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.name = name
+        self.host = host
+        self.run = run
+        self.priority = priority
+        self.prompt_ids = {prompt_id} if prompt_id else set()
+        self.node_ids = {str(node_id)} if node_id is not None else set()
+        self.state = QUEUED
+        self.stop = None
+        self.error = None
+        self.filepath = None
+        self.total_bytes = 0
+        self.bytes_done = 0
+        self.rate = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = Future()
+        self.lock = threading.Lock()
+        self._last_event = 0.0
+        self._rate_time = None
+        self._rate_bytes = 0
+
+    @property
+    def eta(self):
+        if not self.rate or not self.total_bytes:
+            return None
+        return max(0.0, (self.total_bytes - self.bytes_done) / self.rate)
+
+    def set_total(self, total_bytes, bytes_done=0):
+        """
+        Called when the transfer (re)starts, with the size of the file and the bytes already staged.
+        """
+        with self.lock:
+            self.total_bytes = total_bytes
+            self.bytes_done = bytes_done
+            self._rate_time = time.monotonic()
+            self._rate_bytes = bytes_done
+        self._check_stop()
+        self.manager._emit(self)
+
+    def progress(self, count):
+        """
+        Called from the downloading threads for every block written, sleeps to honour the bandwidth limits.
+        """
+        self._check_stop()
+        self.manager._throttle(self, count)
+        now = time.monotonic()
+        with self.lock:
+            self.bytes_done += count
+            if now - self._last_event < PROGRESS_INTERVAL:
+                return
+            self._last_event = now
+            if self._rate_time is not None and now > self._rate_time:
+                rate = (self.bytes_done - self._rate_bytes) / (now - self._rate_time)
+                self.rate = rate if self.rate is None else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate
+            self._rate_time, self._rate_bytes = now, self.bytes_done
+        self.manager._emit(self)
+
+    def _check_stop(self):
+        if self.stop is not None:
+            raise DownloadCancelled(f"Download of '{self.name}' {'paused' if self.stop == PAUSED else 'cancelled'}")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "host": self.host,
+            "state": self.state,
+            "priority": self.priority,
+            "bytes_done": self.bytes_done,
+            "total_bytes": self.total_bytes,
+            "rate": self.rate,
+            "eta": self.eta,
+            "error": self.error,
+            "filepath": self.filepath,
+            "prompt_ids": sorted(self.prompt_ids),
+            "node_ids": sorted(self.node_ids),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class DownloadManager:
+    """
+    Queue of the model downloads of the process, run by a pool of worker threads in priority order
+    (higher first). A download requested again while queued or running joins the existing job.
+
+    At most max_active jobs run at the same time, and at most the cap of their host (see
+    _get_host_limits) from a single host. Jobs with PRIORITY_NODE start first, and the waiting
+    thread of a node runs the one it needs even when max_active jobs are running, but never
+    beyond the cap of its host. Every transfer also goes through the overall and per host token buckets.
+
+    Listeners registered with add_listener() are called with every job update (state changes and
+    throttled progress), from the thread making the update.
+    """
+
+    def __init__(self, max_active, bandwidth_limit=0):
+        self.max_active = max_active
+        self.jobs = {}
+        self.active = {}
+        self.running = 0
+        self.running_by_host = {}
+        self.queue = []
+        self.bucket = _TokenBucket(bandwidth_limit * MB) if bandwidth_limit > 0 else None
+        self.host_buckets = {}
+        self.sequence = itertools.count()
+        self.listeners = []
+        self.context_provider = None
+        self.threads = []
+        self.condition = threading.Condition()
+        self.busy = threading.Event()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def set_context_provider(self, provider):
+        """
+        provider() returns the (prompt id, node id) a download requested without them is attributed to.
+        """
+        self.context_provider = provider
+
+    def _emit(self, job):
+        event = job.to_dict()
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"Download event listener failed: {e}")
+
+    def _throttle(self, job, count):
+        delay = self.bucket.consume(count) if self.bucket is not None else 0.0
+        host_bucket = self.host_buckets.get(job.host, False)
+        if host_bucket is False:
+            rate = _get_host_limits(job.host)[1]
+            host_bucket = self.host_buckets.setdefault(job.host, _TokenBucket(rate * MB) if rate > 0 else None)
+        if host_bucket is not None:
+            delay = max(delay, host_bucket.consume(count))
+        if delay > 0:
+            time.sleep(delay)
+
+    def _can_start(self, job, waited=False):
+        """
+        Returns True if the caps let a job start. `waited` is set for a job started by the thread
+        waiting on it, which only the host cap holds back when a node needs it.
+        """
+        if self.running >= self.max_active and not (waited and job.priority >= PRIORITY_NODE):
+            return False
+        host_cap = _get_host_limits(job.host)[0]
+        return host_cap <= 0 or self.running_by_host.get(job.host, 0) < host_cap
+
+    def _mark_running(self, job):
+        job.state = RUNNING
+        self.running += 1
+        self.running_by_host[job.host] = self.running_by_host.get(job.host, 0) + 1
+
+    def _start_workers(self):
+        while len(self.threads) < self.max_active:
+            thread = threading.Thread(target=self._work, name=f"ondemand-download-{len(self.threads)}", daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def _enqueue(self, job):
+        heapq.heappush(self.queue, (-job.priority, next(self.sequence), job))
+        self.condition.notify()
+
+    def submit(self, key, name, run, priority=PRIORITY_PREFETCH, prompt_id=None, node_id=None, host=None):
+        """
+        Queues a download, or joins the job already queued or running for the same key,
+        raising its priority if needed.
+
+        Args:
+            key: Identifies the downloaded file, e.g. (url, destination directory).
+            name (str): The model name shown in the job list.
+            run (callable): run(job) downloads the file and returns its path, or None on failure.
+            priority (int): Queued jobs with a higher priority start first, see the PRIORITY_ classes.
+            host (str): The host the file is downloaded from, for the per host limits.
+
+        Returns:
+            (DownloadJob, bool): The job and whether it was created by this call.
+        """
+        if prompt_id is None and node_id is None and self.context_provider is not None:
+            prompt_id, node_id = self.context_provider()
+
+        with self.condition:
+            job = self.active.get(key)
+            created = job is None
+            if created:
+                job = DownloadJob(self, key, name, run, priority, prompt_id, node_id, host)
+                self.jobs[job.id] = job
+                self.active[key] = job
+                self.busy.set()
+                self._start_workers()
+                self._enqueue(job)
+            else:
+                if prompt_id:
+                    job.prompt_ids.add(prompt_id)
+                if node_id is not None:
+                    job.node_ids.add(str(node_id))
+                if priority > job.priority:
+                    job.priority = priority
+                    if job.state == QUEUED:
+                        self._enqueue(job)
+        self._emit(job)
+        return job, created
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next_job()
+            self._execute(job)
+
+    def _next_job(self):
+        """
+        Pops the first queued job allowed to start, the others keep their place in the queue.
+        """
+        skipped = []
+        found = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            priority, _, job = entry
+            # Entries of reprioritized, paused or cancelled jobs are left in the heap and dropped here
+            if job.state != QUEUED or -priority != job.priority:
+                continue
+            if self._can_start(job):
+                self._mark_running(job)
+                found = job
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        return found
+
+    def _execute(self, job):
+        self._emit(job)
+        try:
+            self._run(job)
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.running_by_host[job.host] -= 1
+                # A slot was freed, jobs held back by a cap may start now
+                self.condition.notify_all()
+
+    def _run(self, job):
+        try:
+            filepath = job.run(job)
+            self._finish(job, COMPLETED if filepath else FAILED, filepath)
+        except DownloadCancelled:
+            with self.condition:
+                if job.stop == PAUSED:
+                    # Resumed from its staged bytes by resume()
+                    job.state, job.stop, job.rate = PAUSED, None, None
+                    paused = True
+                else:
+                    paused = False
+            if paused:
+                logger.info(f"Download of '{job.name}' paused")
+                self._emit(job)
+            else:
+                self._finish(job, CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job, state, filepath=None):
+        with self.condition:
+            job.state, job.filepath, job.finished_at, job.rate = state, filepath, time.time(), None
+            if state == CANCELLED:
+                logger.info(f"Download of '{job.name}' cancelled")
+            if self.active.get(job.key) is job:
+                del self.active[job.key]
+            # Wakes up the threads waiting for a queued job to start, see wait()
+            self.condition.notify_all()
+            if not self.active:
+                self.busy.clear()
+            finished = [j for j in self.jobs.values() if j.state in FINISHED_STATES]
+            for old_job in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+                del self.jobs[old_job.id]
+        job.future.set_result(filepath)
+        self._emit(job)
+
+    def wait(self, job):
+        """
+        Waits for a job, running it in the calling thread as soon as the caps allow it if no
+        worker has started it yet, so that a loader never waits behind the queue for the model it needs.
+
+        Returns:
+            str: The path of the downloaded file, or None if the download failed.
+
+        Raises:
+            DownloadCancelled: The job was cancelled.
+        """
+        return self.wait_all([job])[0]
+
+    def wait_all(self, jobs):
+        """
+        Waits for several jobs needed at once, e.g. the files of a multi-file loader. The jobs that no
+        worker has started yet are all started as soon as the caps allow it, in helper threads and the
+        calling thread, so that they download concurrently instead of one after the other.
+
+        Returns:
+            list: The paths of the downloaded files in the same order, None for the failed ones.
+
+        Raises:
+            DownloadCancelled: One of the jobs was cancelled.
+        """
+        queued = list(jobs)
+        while queued:
+            with self.condition:
+                started = []
+                for job in queued:
+                    if job.state == QUEUED and self._can_start(job, waited=True):
+                        self._mark_running(job)
+                        started.append(job)
+                queued = [job for job in queued if job.state == QUEUED]
+                if queued and not started:
+                    # Woken up whenever a job finishes, which may free a slot of the host
+                    self.condition.wait()
+                    continue
+            # The last job to start runs in the calling thread, once the others are dispatched
+            last = started.pop() if started and not queued else None
+            for job in started:
+                threading.Thread(target=self._execute, args=(job,), name="ondemand-download-waited", daemon=True).start()
+            if last is not None:
+                self._execute(last)
+
+        filepaths = [job.future.result() for job in jobs]
+        for job in jobs:
+            if job.state == CANCELLED:
+                raise DownloadCancelled(f"Download of '{job.name}' cancelled")
+        return filepaths
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        with self.condition:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def count_by_state(self):
+        """
+        Returns the number of listed jobs of each state, as {(state,): count}.
+        """
+        with self.condition:
+            counts = {(state,): 0 for state in (QUEUED, RUNNING, PAUSED) + FINISHED_STATES}
+            for job in self.jobs.values():
+                counts[(job.state,)] += 1
+            return counts
+
+    def pause(self, job_id):
+        """
+        Stops a queued or running job, keeping its staged bytes. Returns False if it is not pausable.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (QUEUED, RUNNING) or job.stop is not None:
+                return False
+            if job.state == QUEUED:
+                job.state = PAUSED
+            else:
+                # The downloading thread stops at its next block
+                job.stop = PAUSED
+        self._emit(job)
+        return True
+
+    def resume(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != PAUSED:
+                return False
+            job.state = QUEUED
+            self._enqueue(job)
+        self._emit(job)
+        return True
+
+    def cancel(self, job_id):
+        """
+        Cancels a job that did not finish yet. The callers waiting on it get DownloadCancelled.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            if job.state == RUNNING:
+                job.stop = CANCELLED
+                return True
+        self._finish(job, CANCELLED)
+        return True
+
+    def set_priority(self, job_id, priority):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            job.priority = priority
+            if job.state == QUEUED:
+                self._enqueue(job)
+        self._emit(job)
+        return True
+
+    def cancel_prompt(self, prompt_id):
+        """
+        Cancels the unfinished jobs requested by a prompt, unless other prompts also need them.
+
+        Returns:
+            int: The number of cancelled jobs.
+        """
+        if not prompt_id:
+            return 0
+        with self.condition:
+            jobs = [job for job in self.active.values() if prompt_id in job.prompt_ids]
+            for job in jobs:
+                job.prompt_ids.discard(prompt_id)
+        return sum(1 for job in jobs if not job.prompt_ids and self.cancel(job.id))
@@ -0,0 +1,1028 @@
+import os
+import re
+import json
+import errno
+import time
+import shutil
+import threading
+import requests
+import urllib3
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from tqdm import tqdm
+
+from .utils import logger, LOG_PREFIX, _env_int
+from .file_lock import FileLock
+from .http_client import _http_get, _http_head, _headers_for_url, _primary_url, TRANSFER_ERRORS
+from .model_index import _index_record, _resolve_from_index
+from .model_cache import _ensure_cache_space, _register_model, _touch_model
+from .blob_store import _add_to_store, _get_upstream_sha256, _link_from_store
+from .integrity import _StreamingDigest, _verify_file, _write_cached_digest
+from .metrics import _TransferMeter, CACHE_REQUESTS, RESOLVE_SECONDS, DOWNLOAD_SECONDS, RETRIES, DOWNLOAD_JOBS
+from .mirrors import _Mirror, _rank_mirrors, _mirror_probes, MIRROR_SPREAD
+from .shards import _is_sharded_url, _split_urls, _index_shard_urls, _merged_extension, _merge_shards, INDEX_SUFFIX
+from .download_manager import DownloadManager, DownloadCancelled, PAUSED, PROGRESS_INTERVAL, MAX_DOWNLOADS, BANDWIDTH_LIMIT, PRIORITY_NODE, PRIORITY_PREFETCH
+
+# Number of parallel connections used for a segmented (ranged) download
+DOWNLOAD_CONNECTIONS = _env_int('ONDEMAND_LOADERS_DOWNLOAD_CONNECTIONS', 8)
+# Files smaller than two segments are fetched over a single stream
+MIN_SEGMENT_SIZE = _env_int('ONDEMAND_LOADERS_MIN_SEGMENT_MB', 32) * 1024 * 1024
+
+# Downloads are staged next to the destination and renamed into place once complete
+PART_SUFFIX = ".part"
+# Advisory lock held by the process downloading a file
+LOCK_SUFFIX = ".lock"
+# Shards of a multi-file model are staged in this folder next to the merged file
+SHARDS_SUFFIX = ".shards"
+# Shards of a model downloaded at the same time, each one over its own parallel connections
+MAX_PARALLEL_SHARDS = 4
+# Minimum delay between two writes of the resume sidecar, in seconds
+PART_STATE_SAVE_INTERVAL = 1.0
+# Consecutive reconnections without progress before a segment is considered failed
+STALL_RETRIES = _env_int('ONDEMAND_LOADERS_STALL_RETRIES', 5)
+# Block size override in KB used when no node input is available, 0 sizes the blocks from the measured throughput
+DEFAULT_DOWNLOAD_CHUNKS = 0
+# download_chunks values up to the former maximum of the node input predate the adaptive block size,
+# saved workflows still carrying them use the automatic size
+LEGACY_DOWNLOAD_CHUNKS = 12
+# Bounds of the adaptive block size, and how long a block should take to arrive at the measured throughput
+MIN_BLOCK_SIZE = 64 * 1024
+INITIAL_BLOCK_SIZE = 256 * 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+BLOCK_TARGET_SECONDS = 0.1
+# Reserve the disk space of a download before it starts (posix_fallocate, where available)
+PREALLOCATE = _env_int('ONDEMAND_LOADERS_PREALLOCATE', 1)
+
+# Queue of the downloads of this process, jobs are keyed by (url, destination directory)
+_download_manager = DownloadManager(MAX_DOWNLOADS, BANDWIDTH_LIMIT)
+DOWNLOAD_JOBS.callback = _download_manager.count_by_state
+
+
+class RangeNotSupportedError(IOError):
+    """
+    Raised when a server answers a ranged request with the full body.
+    """
+
+
+def _get_filename_from_response(response, model_url):
+    """
+    Extracts the model filename from the Content-Disposition header, falling back to the URL.
+    """
+    model_filename = None
+    content_disposition = response.headers.get('Content-Disposition')
+    if content_disposition:
+        filename_match = re.search(r'filename="?([^"]+)"?', content_disposition)
+        if filename_match:
+            model_filename = filename_match.group(1).strip()
+
+    if not model_filename:
+        # Fallback to extracting filename from URL if Content-Disposition is missing or malformed
+        model_filename = os.path.basename(model_url)
+
+    return model_filename
+
+
+def _supports_ranges(response):
+    """
+    Returns True if the server advertised byte range support for an uncompressed body of known size.
+    """
+    if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return False
+    if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return False
+    return int(response.headers.get('content-length', 0)) > 0
+
+
+def _split_ranges(total_size, connections):
+    """
+    Splits total_size bytes into at most `connections` contiguous (start, end) inclusive byte ranges.
+    """
+    segments = max(1, min(connections, total_size // MIN_SEGMENT_SIZE))
+    segment_size = -(-total_size // segments)
+    return [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+
+
+def _part_paths(model_filepath):
+    """
+    Returns the staging file path and the resume sidecar path for a model file.
+    """
+    part_filepath = model_filepath + PART_SUFFIX
+    return part_filepath, part_filepath + ".json"
+
+
+def _remove_part_files(model_filepath):
+    for path in _part_paths(model_filepath):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _PartState:
+    """
+    Progress of a staged download, persisted in a JSON sidecar so that an interrupted
+    transfer can be resumed with ranged requests.
+
+    Each segment is a [start, end, position] list, `position` being the next byte to fetch.
+    """
+
+    def __init__(self, meta_filepath, url, size, etag, segments):
+        self.meta_filepath = meta_filepath
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+
+    @classmethod
+    def load(cls, meta_filepath, part_filepath, url, size, etag):
+        """
+        Loads the sidecar of a previous attempt, or returns None if it does not match the remote file.
+        """
+        try:
+            with open(meta_filepath, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get("url") != url or data.get("size") != size:
+            return None
+        if etag and data.get("etag") and data.get("etag") != etag:
+            return None
+        if not os.path.exists(part_filepath) or os.path.getsize(part_filepath) != size:
+            return None
+
+        segments = data.get("segments") or []
+        if not all(isinstance(s, list) and len(s) == 3 for s in segments):
+            return None
+        return cls(meta_filepath, url, size, etag, segments)
+
+    @property
+    def bytes_done(self):
+        return sum(position - start for start, _, position in self.segments)
+
+    def save(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_save < PART_STATE_SAVE_INTERVAL:
+                return
+            self.last_save = now
+            data = {
+                "url": self.url,
+                "size": self.size,
+                "etag": self.etag,
+                "segments": [list(segment) for segment in self.segments],
+            }
+            tmp_filepath = self.meta_filepath + ".tmp"
+            with open(tmp_filepath, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_filepath, self.meta_filepath)
+
+
+def _preallocate(f, size):
+    """
+    Sizes a staging file and reserves its disk space, so that a full disk fails the download
+    before the transfer instead of in the middle of it, and the file is not fragmented.
+    """
+    f.truncate(size)
+    if not PREALLOCATE or not size or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        # Filesystems without fallocate support keep the sparse file
+
+
+def _write_block(f, data):
+    # Unbuffered files may write less than asked
+    while data:
+        data = data[f.write(data):]
+
+
+class _BlockReader:
+    """
+    Reads a response body into a reusable buffer, yielding memoryviews of it instead of allocating
+    a bytes object per block. Identity-encoded bodies are read with urllib3's readinto, so that the
+    connection goes back to the pool once the body is consumed; the block size follows the measured throughput (BLOCK_TARGET_SECONDS worth of data,
+    between MIN_BLOCK_SIZE and MAX_BLOCK_SIZE) unless download_chunks fixes it.
+    """
+
+    def __init__(self, response, download_chunks=None):
+        self.response = response
+        self.fixed = download_chunks > LEGACY_DOWNLOAD_CHUNKS if isinstance(download_chunks, int) else False
+        self.size = download_chunks * 1024 if self.fixed else INITIAL_BLOCK_SIZE
+        self.buffer = bytearray(self.size)
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def _resize(self, count):
+        self.window_bytes += count
+        now = time.monotonic()
+        if self.fixed or now - self.window_start < PROGRESS_INTERVAL:
+            return
+        target = self.window_bytes / (now - self.window_start) * BLOCK_TARGET_SECONDS
+        size = MIN_BLOCK_SIZE
+        while size * 2 <= min(target, MAX_BLOCK_SIZE):
+            size *= 2
+        self.size = size
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+        self.window_start, self.window_bytes = now, 0
+
+    def __iter__(self):
+        raw = self.response.raw
+        if self.response.headers.get('Content-Encoding', 'identity').lower() != 'identity' or not hasattr(raw, "readinto"):
+            # Compressed bodies are decoded by urllib3
+            yield from self.response.iter_content(self.size)
+            return
+        # Read through urllib3 so that it sees the end of the body and returns the connection to the pool
+        raw.decode_content = False
+        while True:
+            view = memoryview(self.buffer)[:self.size]
+            try:
+                count = raw.readinto(view)
+            except urllib3.exceptions.HTTPError as e:
+                # Reported like the errors of iter_content
+                raise requests.exceptions.ConnectionError(e)
+            if not count:
+                return
+            yield view[:count]
+            self._resize(count)
+
+
+class _ProgressReporter:
+    """
+    Reports the bytes written by a transfer: to the job on every block, as it enforces the bandwidth
+    limits and stop requests, and to the shared progress bar at most every PROGRESS_INTERVAL.
+    """
+
+    def __init__(self, progress_bar, job=None):
+        self.progress_bar = progress_bar
+        self.job = job
+        self.pending = 0
+        self.last_update = time.monotonic()
+
+    def add(self, count):
+        if self.job:
+            self.job.progress(count)
+        self.pending += count
+        now = time.monotonic()
+        if now - self.last_update >= PROGRESS_INTERVAL:
+            self.flush()
+            self.last_update = now
+
+    def flush(self):
+        if self.pending:
+            self.progress_bar.update(self.pending)
+            self.pending = 0
+
+
+class _SegmentSources:
+    """
+    The mirrors a ranged download reads from, as (url, headers, mirror url) tuples, fastest first.
+    Segments start on the fastest mirror, or round-robin on the first `spread` ones, and continue from
+    another mirror with a Range request when theirs fails.
+    """
+
+    def __init__(self, sources, spread=1):
+        self.sources = sources
+        self.spread = max(1, min(spread, len(sources)))
+        self.down = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def assign(self, index):
+        return self.sources[index % self.spread]
+
+    def failover(self, source, error):
+        """
+        Marks the mirror of `source` as failed and returns the source to continue from,
+        or None when there is no other mirror left.
+        """
+        if len(self.sources) < 2:
+            return None
+        mirror_url = source[2]
+        with self.lock:
+            if mirror_url not in self.down:
+                self.down.add(mirror_url)
+                _mirror_probes.mark_down(mirror_url, error)
+            return next((candidate for candidate in self.sources if candidate[2] not in self.down), None)
+
+
+def _open_range(url, headers, start, end):
+    """
+    Opens a streaming request for the byte range [start, end] of url.
+    """
+    headers = dict(headers)
+    headers['Range'] = f"bytes={start}-{end}"
+    response = _http_get(url, headers=headers, stream=True)
+    response.raise_for_status()
+    if response.status_code != 206:
+        response.close()
+        raise RangeNotSupportedError(f"Server ignored range request for bytes {start}-{end} (status {response.status_code})")
+    return response
+
+
+def _download_segment(sources, source, part_filepath, segment, download_chunks, state, digest, progress_bar, job=None, response=None):
+    """
+    Downloads the remaining bytes of `segment` from `source`, one of `sources`, and writes them at the
+    same offset of part_filepath. An already opened response positioned at the segment start can be
+    passed to avoid a new request.
+
+    If the connection drops or stalls longer than the read timeout, a new ranged request
+    is issued from the last byte written, up to STALL_RETRIES times in a row without progress.
+    When the download has other mirrors, the segment continues from one of them instead.
+    """
+    start, end, _ = segment
+    url, headers, _ = source
+    host = urlparse(url).hostname
+    attempt = 0
+    while segment[2] <= end:
+        position = segment[2]
+        meter = _TransferMeter(host)
+        progress = _ProgressReporter(progress_bar, job)
+        try:
+            if response is None:
+                response = _open_range(url, headers, position, end)
+            with response:
+                # Unbuffered, so that the digest can read this range back from the file once reported
+                with open(part_filepath, 'r+b', buffering=0) as f:
+                    f.seek(position)
+                    for data in _BlockReader(response, download_chunks):
+                        data = data[:end + 1 - segment[2]]
+                        write_start = time.perf_counter()
+                        _write_block(f, data)
+                        meter.add(len(data), time.perf_counter() - write_start)
+                        segment[2] += len(data)
+                        digest.update(segment[2] - len(data), data)
+                        progress.add(len(data))
+                        state.save()
+                        if segment[2] > end:
+                            break
+            if segment[2] > end:
+                return
+            error = "connection closed early"
+        except TRANSFER_ERRORS as e:
+            error = e
+        except (requests.exceptions.HTTPError, RangeNotSupportedError) as e:
+            # Retrying the same server does not help, another mirror might
+            error = e
+        finally:
+            meter.flush()
+            progress.flush()
+        response = None
+
+        next_source = sources.failover(source, error)
+        if next_source is not None and next_source is not source:
+            logger.warning(f"Transfer from '{host}' failed at byte {segment[2]} ({error}), continuing from mirror '{next_source[2]}'")
+            RETRIES.inc(host=host, reason="failover")
+            source = next_source
+            url, headers, _ = source
+            host = urlparse(url).hostname
+            attempt = 0
+            continue
+        if isinstance(error, (requests.exceptions.HTTPError, RangeNotSupportedError)):
+            raise error
+
+        attempt = 1 if segment[2] > position else attempt + 1
+        if attempt > STALL_RETRIES:
+            raise IOError(f"Incomplete segment {start}-{end}: received {segment[2] - start} of {end - start + 1} bytes ({error})")
+        logger.warning(f"Transfer interrupted at byte {segment[2]} ({error}), reconnecting ({attempt}/{STALL_RETRIES})")
+        RETRIES.inc(host=host, reason="reconnect")
+        time.sleep(min(2 ** (attempt - 1), 30))
+
+
+def _download_segmented(sources, model_name, part_filepath, state, digest, download_chunks, job=None, response=None):
+    """
+    Downloads the missing segments of `state` into part_filepath using concurrent ranged requests
+    to `sources` (a _SegmentSources), feeding `digest` as the contiguous prefix of the file grows.
+
+    Returns:
+        bool: True if every segment was downloaded, False otherwise. Progress is kept in the
+        sidecar either way, so a failed transfer can be resumed later.
+    """
+    pending = [segment for segment in state.segments if segment[2] <= segment[1]]
+    if len(pending) > 1:
+        mirrors = min(sources.spread, len(pending))
+        logger.info(f"Downloading '{model_name}' using {len(pending)} parallel connections" + (f" to {mirrors} mirrors" if mirrors > 1 else ""))
+
+    # The initial response can only be reused to fetch the first segment from byte zero
+    if response is not None and not (pending and pending[0][0] == 0 and pending[0][2] == 0):
+        response.close()
+        response = None
+
+    with tqdm(total=state.size, initial=state.bytes_done, unit='iB', unit_scale=True, desc=f"{LOG_PREFIX} Downloading {model_name}") as progress_bar:
+        with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="ondemand-segment") as executor:
+            futures = [
+                executor.submit(_download_segment, sources, sources.assign(i), part_filepath, segment, download_chunks, state, digest,
+                                progress_bar, job, response if i == 0 else None)
+                for i, segment in enumerate(pending)
+            ]
+            errors = [future.exception() for future in futures]
+
+    state.save(force=True)
+    errors = [e for e in errors if e is not None]
+    for e in errors:
+        if isinstance(e, DownloadCancelled):
+            raise e
+    if errors:
+        if any(isinstance(e, RangeNotSupportedError) for e in errors):
+            raise RangeNotSupportedError(str(errors[0]))
+        logger.warning(f"Download of '{model_name}' interrupted at {state.bytes_done}/{state.size} bytes: {errors[0]}")
+        return False
+    return True
+
+
+def _download_single_stream(response, model_name, part_filepath, total_size, download_chunks, digest, job=None):
+    """
+    Writes the body of an already opened streaming response to part_filepath.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    written = 0
+    meter = _TransferMeter(urlparse(response.url).hostname)
+    with tqdm(total=total_size, unit='iB', unit_scale=True, desc=f"{LOG_PREFIX} Downloading {model_name}") as progress_bar:
+        progress = _ProgressReporter(progress_bar, job)
+        with open(part_filepath, 'wb', buffering=0) as f:
+            try:
+                _preallocate(f, total_size)
+                for data in _BlockReader(response, download_chunks):
+                    progress.add(len(data))
+                    write_start = time.perf_counter()
+                    _write_block(f, data)
+                    meter.add(len(data), time.perf_counter() - write_start)
+                    digest.update(written, data)
+                    written += len(data)
+            finally:
+                meter.flush()
+                progress.flush()
+    return written
+
+
+def _stage_download(response, model_url, model_name, model_filepath, headers, download_chunks, job=None, mirrors=None):
+    """
+    Downloads the body of `response` into the staging file of model_filepath, resuming a
+    previous attempt when possible. The response is closed when done.
+    Progress is reported to `job`, which raises DownloadCancelled when it is paused or cancelled.
+
+    `response` answers model_url requested with headers, unless `mirrors` is given: then it answers
+    the first of these _Mirror tuples, the others take over its segments when it fails, and model_url
+    is only the key of the resumable state.
+
+    Returns:
+        (int, str): The size and SHA-256 of the complete staged file, or None if the transfer
+        was interrupted and left resumable. Other errors are raised.
+    """
+    part_filepath, meta_filepath = _part_paths(model_filepath)
+    total_size = int(response.headers.get('content-length', 0))
+    mirrors = mirrors or [_Mirror(model_url, headers or {}, None, None)]
+    source = mirrors[0]
+    # Every mirror has its own ETag, the resumed bytes of another one are checked by the final SHA-256
+    etag = response.headers.get('ETag') if len(mirrors) == 1 else None
+
+    if _supports_ranges(response):
+        with response:
+            state = _PartState.load(meta_filepath, part_filepath, model_url, total_size, etag)
+            if state is not None:
+                logger.info(f"Resuming download of '{model_name}' from {state.bytes_done}/{total_size} bytes")
+            else:
+                logger.info(f"Downloading '{model_name}' from '{source.url}' to '{model_filepath}'")
+                # Preallocate the staging file so every segment can be written at its own offset
+                with open(part_filepath, 'wb') as f:
+                    _preallocate(f, total_size)
+                segments = [[start, end, start] for start, end in _split_ranges(total_size, DOWNLOAD_CONNECTIONS)]
+                state = _PartState(meta_filepath, model_url, total_size, etag, segments)
+                state.save(force=True)
+
+            if job:
+                job.set_total(total_size, state.bytes_done)
+            # Mirrors serving another file (e.g. an older version) are left out
+            others = [mirror for mirror in mirrors[1:] if mirror.size in (None, total_size)]
+            sources = _SegmentSources(
+                [(response.url, _headers_for_url(response.url, source.url, source.headers), source.url)]
+                + [(mirror.url, mirror.headers, mirror.url) for mirror in others],
+                1 + sum(mirror.seconds is not None for mirror in others) if MIRROR_SPREAD else 1)
+            digest = _StreamingDigest(part_filepath, state.segments)
+            try:
+                if not _download_segmented(sources, model_name, part_filepath, state, digest, download_chunks, job, response):
+                    return None
+                actual_size = os.path.getsize(part_filepath)
+                if actual_size != total_size:
+                    raise IOError(f"staged file is {actual_size} bytes, expected {total_size}")
+                return actual_size, digest.hexdigest()
+            except RangeNotSupportedError as e:
+                logger.info(f"{e}. Falling back to single stream download for '{model_name}'")
+                _remove_part_files(model_filepath)
+
+            # The initial response was consumed by the failed ranged attempt, start over
+            response = _http_get(source.url, headers=source.headers, stream=True)
+            response.raise_for_status()
+    else:
+        logger.info(f"Downloading '{model_name}' from '{source.url}' to '{model_filepath}'")
+
+    if job:
+        job.set_total(total_size)
+    digest = _StreamingDigest(part_filepath)
+    try:
+        with response:
+            written = _download_single_stream(response, model_name, part_filepath, total_size, download_chunks, digest, job)
+        if total_size and written != total_size:
+            raise IOError(f"received {written} of {total_size} bytes")
+    except Exception:
+        # Without a sidecar the transfer cannot be resumed, do not leave a preallocated file behind
+        _remove_part_files(model_filepath)
+        raise
+    return written, digest.hexdigest()
+
+
+class _ShardProgress:
+    """
+    Reports the progress of every shard of a model to its single job, as one shared total.
+    Each shard gets its own view through shard(i), which stands for the job in _stage_download.
+    """
+
+    def __init__(self, job, sizes):
+        self.job = job
+        self.totals = list(sizes)
+        self.done = [0] * len(sizes)
+        self.lock = threading.Lock()
+
+    def shard(self, i):
+        return _ShardProgressView(self, i) if self.job else None
+
+    def set_total(self, i, total_bytes, bytes_done=0):
+        with self.lock:
+            self.totals[i] = total_bytes
+            self.done[i] = bytes_done
+            total, done = sum(self.totals), sum(self.done)
+        if self.job:
+            self.job.set_total(total, done)
+
+    def progress(self, i, count):
+        with self.lock:
+            self.done[i] += count
+        if self.job:
+            self.job.progress(count)
+
+
+class _ShardProgressView:
+
+    def __init__(self, parent, i):
+        self.parent = parent
+        self.i = i
+
+    def set_total(self, total_bytes, bytes_done=0):
+        self.parent.set_total(self.i, total_bytes, bytes_done)
+
+    def progress(self, count):
+        self.parent.progress(self.i, count)
+
+
+def _list_shards(model_url, headers):
+    """
+    Returns the URLs of the files of a sharded model, reading its index if model_url points at one.
+    """
+    if not urlparse(model_url).path.endswith(INDEX_SUFFIX):
+        return _split_urls(model_url)
+    response = _http_get(model_url, headers=headers)
+    response.raise_for_status()
+    return _index_shard_urls(model_url, response.json())
+
+
+def _download_shard(shard_url, shard_name, shards_dir, headers, download_chunks, job):
+    """
+    Downloads one shard into the staging folder, resuming it if interrupted.
+
+    Returns:
+        str: The path of the complete shard, or None if its transfer was interrupted.
+    """
+    shard_filepath = os.path.join(shards_dir, os.path.basename(urlparse(shard_url).path))
+    if os.path.exists(shard_filepath):
+        # Shards are renamed into place once complete
+        if job:
+            size = os.path.getsize(shard_filepath)
+            job.set_total(size, size)
+        return shard_filepath
+
+    response = _http_get(shard_url, headers=headers, stream=True)
+    response.raise_for_status()
+    staged = _stage_download(response, shard_url, shard_name, shard_filepath, headers, download_chunks, job)
+    if staged is None:
+        return None
+    part_filepath, _ = _part_paths(shard_filepath)
+    os.replace(part_filepath, shard_filepath)
+    _remove_part_files(shard_filepath)
+    return shard_filepath
+
+
+def _download_shards(shard_urls, model_name, shards_dir, headers, download_chunks, job):
+    """
+    Downloads the shards of a model concurrently, with their progress reported to `job` as a single total.
+
+    Returns:
+        list: The paths of the shards, or None if any of them is missing.
+    """
+    sizes = []
+    for shard_url in shard_urls:
+        response = _http_head(shard_url, headers=headers)
+        response.raise_for_status()
+        sizes.append(int(response.headers.get('content-length', 0)))
+    progress = _ShardProgress(job, sizes)
+    if job:
+        job.set_total(sum(sizes))
+    logger.info(f"Downloading '{model_name}' as {len(shard_urls)} shards ({sum(sizes)} bytes)")
+
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_SHARDS, len(shard_urls)), thread_name_prefix="ondemand-shard") as executor:
+        futures = [
+            executor.submit(_download_shard, shard_url, f"{model_name} ({i + 1}/{len(shard_urls)})", shards_dir,
+                            headers, download_chunks, progress.shard(i))
+            for i, shard_url in enumerate(shard_urls)
+        ]
+        errors = [future.exception() for future in futures]
+
+    for e in errors:
+        if isinstance(e, DownloadCancelled):
+            raise e
+    errors = [e for e in errors if e is not None]
+    if errors:
+        raise errors[0]
+    shard_paths = [future.result() for future in futures]
+    return shard_paths if all(shard_paths) else None
+
+
+def _fetch_sharded_model(model_url, source, model_name, destination_dir, download_chunks, sha256, job, observe_resolve):
+    """
+    Downloads a model published as several files (see shards.py) and merges them into a single file,
+    named after the model. The shards are staged in a `<filename>.shards` folder, so that an interrupted
+    download resumes, and the merged file only appears once every shard is complete.
+    The shards are listed and downloaded from `source`, the fastest mirror of the entry keyed by model_url.
+    """
+    model_type = os.path.basename(os.path.normpath(destination_dir))
+    headers = source.headers
+    try:
+        shard_urls = _list_shards(source.url, headers)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Unable to list the shards of '{model_name}' from '{source.url}': {e}")
+        return None
+
+    extension = _merged_extension(model_url)
+    model_filename = re.sub(r'[\\/:*?"<>|]+', '_', model_name).strip() + extension
+    model_filepath = os.path.join(destination_dir, model_filename)
+    shards_dir = model_filepath + SHARDS_SUFFIX
+
+    lock = FileLock(model_filepath + LOCK_SUFFIX)
+    if not lock.acquire(blocking=False):
+        logger.info(f"'{model_filename}' is being downloaded by another process, waiting for it to finish")
+        lock.acquire()
+    download_start = None
+    try:
+        if os.path.exists(model_filepath) and _verify_file(model_filepath, sha256):
+            logger.info(f"File '{model_filename}' for '{model_name}' already exists. Skipping download.")
+            _index_record(model_url, destination_dir, model_filename, os.path.getsize(model_filepath))
+            observe_resolve("hit")
+            return model_filepath
+        if _link_from_store(sha256, model_filepath):
+            _register_model(model_filepath)
+            _index_record(model_url, destination_dir, model_filename, os.path.getsize(model_filepath))
+            observe_resolve("linked")
+            return model_filepath
+
+        observe_resolve("miss")
+        os.makedirs(shards_dir, exist_ok=True)
+        download_start = time.perf_counter()
+        shard_paths = _download_shards(shard_urls, model_name, shards_dir, headers, download_chunks, job)
+        if shard_paths is None:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="failed")
+            return None
+
+        # Room for the merged file, the shards are deleted right after
+        _ensure_cache_space(destination_dir, sum(os.path.getsize(shard_path) for shard_path in shard_paths))
+        logger.info(f"Merging the {len(shard_paths)} shards of '{model_name}' into '{model_filepath}'")
+        part_filepath, _ = _part_paths(model_filepath)
+        actual_size, actual_sha256 = _merge_shards(shard_paths, part_filepath, extension)
+        if sha256 and actual_sha256 != sha256:
+            logger.error(f"Merged '{model_name}' is corrupted: SHA-256 is {actual_sha256}, expected {sha256}")
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="corrupted")
+            _remove_part_files(model_filepath)
+            shutil.rmtree(shards_dir, ignore_errors=True)
+            return None
+
+        os.replace(part_filepath, model_filepath)
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        _write_cached_digest(model_filepath, actual_sha256)
+        _add_to_store(model_filepath, actual_sha256)
+        _register_model(model_filepath)
+        _index_record(model_url, destination_dir, model_filename, actual_size)
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="completed")
+        logger.info(f"Successfully downloaded '{model_name}' filename {model_filename}.")
+        return model_filepath
+    except DownloadCancelled:
+        if download_start is not None:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="cancelled")
+        if job.stop != PAUSED:
+            shutil.rmtree(shards_dir, ignore_errors=True)
+        raise
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during download of '{model_name}': {e}")
+        _remove_part_files(model_filepath)
+        if download_start is not None:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="failed")
+        return None
+    finally:
+        lock.release()
+
+
+def _fetch_model(model_url, model_name, destination_dir, api_key, download_chunks, sha256=None, job=None):
+    """
+    Resolves and downloads a model in the calling thread, see _download_model.
+    """
+    if model_url == 'offline':
+        logger.info(f"'{model_name}' is marked as offline. Assuming local file exists and skipping download.")
+        # The user expects the model to exist, so we return the assumed path.
+        return os.path.join(destination_dir, model_name)
+
+    # Entries listing several mirrors are indexed under their first URL
+    urls, model_url = model_url, _primary_url(model_url)
+    model_type = os.path.basename(os.path.normpath(destination_dir))
+    resolve_start = time.perf_counter()
+
+    def observe_resolve(result):
+        CACHE_REQUESTS.inc(model_type=model_type, result=result)
+        RESOLVE_SECONDS.observe(time.perf_counter() - resolve_start, model_type=model_type)
+
+    # Files resolved by a previous run are served from the index without touching the network
+    model_filepath = _resolve_from_index(model_url, destination_dir)
+    if model_filepath:
+        if _verify_file(model_filepath, sha256):
+            logger.info(f"File '{os.path.basename(model_filepath)}' for '{model_name}' found in download index. Skipping download.")
+            observe_resolve("hit")
+            return model_filepath
+        logger.warning(f"Downloading '{model_name}' again")
+
+    os.makedirs(destination_dir, exist_ok=True)
+
+    headers = None
+    if api_key:
+        logger.info(f"Using provided API key")
+        headers = {
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    mirrors = _rank_mirrors(urls, headers)
+    if _is_sharded_url(model_url):
+        return _fetch_sharded_model(model_url, mirrors[0], model_name, destination_dir, download_chunks, sha256, job, observe_resolve)
+
+    response = None
+    for mirror in mirrors:
+        try:
+            response = _http_get(mirror.url, headers=mirror.headers, stream=True)
+            response.raise_for_status()  # Raise an exception for bad status codes
+            break
+        except requests.exceptions.RequestException as e:
+            if response is not None:
+                response.close()
+                response = None
+            log = logger.warning if mirror is not mirrors[-1] else logger.error
+            log(f"Error making request for '{model_name}' from '{mirror.url}': {e}")
+            if len(mirrors) > 1:
+                _mirror_probes.mark_down(mirror.url, e)
+    if response is None:
+        return None
+    # The mirror that answered serves the download, the others back it up
+    mirrors = [mirror] + [other for other in mirrors if other is not mirror]
+
+    model_filename = _get_filename_from_response(response, mirror.url)
+    model_filepath = os.path.join(destination_dir, model_filename)
+    etag = response.headers.get('ETag')
+
+    if os.path.exists(model_filepath) and _verify_file(model_filepath, sha256):
+        response.close()
+        logger.info(f"File '{model_filename}' already exists at '{model_filepath}'. Skipping download.")
+        _index_record(model_url, destination_dir, model_filename, os.path.getsize(model_filepath), etag)
+        observe_resolve("hit")
+        return model_filepath
+
+    # Other workers sharing the models directory wait for the first one and reuse its file
+    lock = FileLock(model_filepath + LOCK_SUFFIX)
+    waited = False
+    download_start = None
+    if not lock.acquire(blocking=False):
+        response.close()
+        logger.info(f"'{model_filename}' is being downloaded by another process, waiting for it to finish")
+        lock.acquire()
+        waited = True
+
+    try:
+        if os.path.exists(model_filepath) and _verify_file(model_filepath, sha256):
+            logger.info(f"File '{model_filename}' was downloaded by another process. Skipping download.")
+            _index_record(model_url, destination_dir, model_filename, os.path.getsize(model_filepath), etag)
+            observe_resolve("hit")
+            return model_filepath
+
+        # A corrupted file is only replaced once a verified copy is ready
+        for attempt in range(2):
+            if waited or attempt:
+                # The previous response went stale or was consumed, the other process may also have left a resumable .part
+                response.close()
+                response = _http_get(mirror.url, headers=mirror.headers, stream=True)
+                response.raise_for_status()
+
+            # Content already downloaded under another name or for another model type is linked, not downloaded again
+            expected_sha256 = sha256 or _get_upstream_sha256(response)
+            if _link_from_store(expected_sha256, model_filepath):
+                response.close()
+                _register_model(model_filepath)
+                _index_record(model_url, destination_dir, model_filename, os.path.getsize(model_filepath), etag)
+                observe_resolve("linked")
+                return model_filepath
+
+            if not attempt:
+                observe_resolve("miss")
+            _ensure_cache_space(destination_dir, int(response.headers.get('content-length', 0)))
+            download_start = time.perf_counter()
+            staged = _stage_download(response, model_url, model_name, model_filepath, None, download_chunks, job, mirrors)
+            if staged is None:
+                DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="failed")
+                return None
+            actual_size, actual_sha256 = staged
+
+            if expected_sha256 and actual_sha256 != expected_sha256:
+                logger.error(f"Downloaded '{model_name}' is corrupted: SHA-256 is {actual_sha256}, expected {expected_sha256}")
+                DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="corrupted")
+                RETRIES.inc(host=urlparse(mirror.url).hostname, reason="corrupted")
+                _remove_part_files(model_filepath)
+                continue
+
+            part_filepath, _ = _part_paths(model_filepath)
+            os.replace(part_filepath, model_filepath)
+            _remove_part_files(model_filepath)
+            _write_cached_digest(model_filepath, actual_sha256)
+            _add_to_store(model_filepath, actual_sha256)
+            _register_model(model_filepath)
+            _index_record(model_url, destination_dir, model_filename, actual_size, etag)
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="completed")
+            logger.info(f"Successfully downloaded '{model_name}' filename {model_filename}.")
+            return model_filepath
+
+        logger.error(f"Giving up on '{model_name}' after {attempt + 1} corrupted downloads")
+        return None
+    except DownloadCancelled:
+        if download_start is not None:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="cancelled")
+        if job.stop != PAUSED:
+            # A paused download keeps its staged bytes to resume from them
+            _remove_part_files(model_filepath)
+        raise
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during download of '{model_name}': {e}")
+        if download_start is not None:
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - download_start, model_type=model_type, outcome="failed")
+        return None
+    finally:
+        response.close()
+        lock.release()
+
+
+def _resolve_cached(model_url, model_name, destination_dir, sha256=None):
+    """
+    Returns the file of a model found in the download index and matching sha256, or None.
+    """
+    resolve_start = time.perf_counter()
+    model_filepath = _resolve_from_index(_primary_url(model_url), destination_dir)
+    if not model_filepath or not _verify_file(model_filepath, sha256):
+        return None
+    logger.info(f"File '{os.path.basename(model_filepath)}' for '{model_name}' found in download index. Skipping download.")
+    model_type = os.path.basename(os.path.normpath(destination_dir))
+    CACHE_REQUESTS.inc(model_type=model_type, result="hit")
+    RESOLVE_SECONDS.observe(time.perf_counter() - resolve_start, model_type=model_type)
+    return model_filepath
+
+
+def _download_model(model_url, model_name, destination_dir, api_key, download_chunks, sha256=None, priority=PRIORITY_NODE):
+    """
+    Handles the download of a model from a given URL to a specified directory.
+
+    URLs resolved by a previous run are looked up in a persistent index first, so cached
+    models are returned from a single stat call without any network request.
+    Otherwise the file is staged as `<filename>.part` and only renamed into place once its size checks out.
+    When the server supports byte ranges, large files are split into segments fetched concurrently,
+    and the progress is recorded in a `<filename>.part.json` sidecar so that an interrupted
+    download resumes where it stopped instead of restarting from byte zero.
+    Downloads are jobs of the download manager, which reports their progress to its listeners
+    and lets them be paused, cancelled or reprioritized. Concurrent calls for the same model share
+    a single job: later callers wait for the one already queued or running (e.g. a background
+    prefetch), and a job still queued is run in the calling thread. Across processes sharing the models
+    directory, a `<filename>.lock` file makes other workers wait and reuse the finished file.
+    When a cache quota is configured, least recently used downloads are evicted to make room.
+    The SHA-256 of the file is computed while it is written and checked against the sha256
+    argument or the digest published by the provider; a corrupted download is fetched again
+    and a corrupted local file is replaced. Verified digests are cached in `<filename>.sha256`.
+    Downloaded files are hardlinked into a content-addressed store, so a file whose SHA-256 is
+    already known (from the provider or the sha256 argument) is linked instead of downloaded again.
+    A list of mirrors is probed and downloaded from the fastest one that answers, its segments
+    continuing from another mirror if it fails; the model is keyed by the first URL of the list.
+
+    Args:
+        model_url (str or list): The URL of the model to download, or a list of mirrors of it.
+        model_name (str): The name of the model (for logging purposes).
+        destination_dir (str): The directory where the model should be saved.
+        api_key (str): API key for authentication, if required.
+        download_chunks (int): Fixed read block size in KB, 0 to size the blocks from the measured throughput.
+        sha256 (str): The expected SHA-256 of the file, if known.
+        priority (int): The scheduling class of the download, by default the one of a model needed right away.
+
+    Returns:
+        str: The full path to the downloaded model file, or None if an error occurred.
+
+    Raises:
+        DownloadCancelled: The download was cancelled.
+    """
+    # Offline and already indexed models are returned without a job, so that cached resolves
+    # stay a single index lookup and do not show up in the download queue
+    if model_url == 'offline':
+        return _fetch_model(model_url, model_name, destination_dir, api_key, download_chunks, sha256)
+    model_filepath = _resolve_cached(model_url, model_name, destination_dir, sha256)
+    if model_filepath:
+        _touch_model(model_filepath)
+        return model_filepath
+
+    for _ in range(2):
+        job, created = _submit_download(model_url, model_name, destination_dir, api_key, download_chunks, sha256, priority)
+        if not created:
+            logger.info(f"Waiting for the download of '{model_name}' already in progress")
+        model_filepath = _download_manager.wait(job)
+
+        if model_filepath:
+            _touch_model(model_filepath)
+            return model_filepath
+        if created:
+            return None
+        # The other download failed, give it one more try
+    return None
+
+
+def _submit_download(model_url, model_name, destination_dir, api_key, download_chunks, sha256=None, priority=PRIORITY_PREFETCH,
+                     prompt_id=None, node_id=None):
+    """
+    Queues a download in the download manager, or joins the job already queued or running
+    for the same (url, destination) pair.
+
+    Returns:
+        (DownloadJob, bool): The job and whether it was created by this call.
+    """
+    key = (_primary_url(model_url), os.path.abspath(destination_dir))
+    # The manager calls run(job), which becomes the job argument of _fetch_model
+    run = partial(_fetch_model, model_url, model_name, destination_dir, api_key, download_chunks, sha256)
+    return _download_manager.submit(key, model_name, run, priority, prompt_id, node_id, urlparse(key[0]).hostname)
+
+
+def _prefetch_model(model_url, model_name, destination_dir, api_key, download_chunks=DEFAULT_DOWNLOAD_CHUNKS, sha256=None,
+                    prompt_id=None, node_id=None, priority=PRIORITY_PREFETCH):
+    """
+    Queues the download of a model in the background, so that the loader only has to wait for it.
+
+    Returns:
+        DownloadJob: The queued download, or None if the model is offline or already on disk.
+    """
+    if not model_url or model_url == 'offline':
+        return None
+
+    if _resolve_from_index(_primary_url(model_url), destination_dir):
+        return None
+
+    job, created = _submit_download(model_url, model_name, destination_dir, api_key, download_chunks, sha256,
+                                    priority, prompt_id, node_id)
+    if created:
+        logger.info(f"Downloading '{model_name}' in the background")
+    return job
+
+
+def _download_models(downloads):
+    """
+    Downloads several models concurrently through the download manager, so that
+    multi-file loaders wait roughly as long as their largest file takes.
+
+    Args:
+        downloads (list): (model_url, model_name, destination_dir, api_key, download_chunks, sha256) tuples.
+
+    Returns:
+        list: The full paths of the downloaded files in the same order, None for the failed ones.
+    """
+    # The loader needs every file right away
+    jobs = [_prefetch_model(*download, priority=PRIORITY_NODE) for download in downloads]
+    # Every file is started before the calling thread runs any of them
+    filepaths = iter(_download_manager.wait_all([job for job in jobs if job is not None]))
+
+    model_filepaths = []
+    for download, job in zip(downloads, jobs):
+        model_filepath = next(filepaths) if job is not None else None
+        # Offline and already indexed models have no job, failed ones get a second attempt
+        model_filepaths.append(model_filepath or _download_model(*download))
+    return model_filepaths
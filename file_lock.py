@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Delay between two attempts to take a lock held by another process, in seconds
+LOCK_POLL_INTERVAL = 1.0
+
+# POSIX record locks are per process, so threads of this process also serialize on a threading.Lock
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _try_lock_fd(fd):
+    try:
+        if fcntl is not None:
+            # lockf (POSIX record locks) is also honoured by NFS servers, unlike flock on older kernels
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """
+    Advisory lock on a file path, exclusive across the threads of this process and across
+    processes sharing the same filesystem. The lock file is removed when released.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        with _thread_locks_guard:
+            self.thread_lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    def acquire(self, blocking=True):
+        """
+        Takes the lock, waiting for other holders if blocking is True.
+
+        Returns:
+            bool: True if the lock was acquired.
+        """
+        if not self.thread_lock.acquire(blocking):
+            return False
+        try:
+            while True:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                if not _try_lock_fd(fd):
+                    os.close(fd)
+                    if not blocking:
+                        self.thread_lock.release()
+                        return False
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    continue
+
+                # The previous holder removes the file on release: make sure we locked the current one
+                try:
+                    current = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    self.fd = fd
+                    return True
+                _unlock_fd(fd)
+                os.close(fd)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        _unlock_fd(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,131 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+from .utils import _env_int
+from .metrics import TIME_TO_FIRST_BYTE, RETRIES
+
+# (connect, read) timeouts in seconds; the read timeout also bounds how long a stalled transfer can hang
+CONNECT_TIMEOUT = _env_int('ONDEMAND_LOADERS_CONNECT_TIMEOUT', 10)
+READ_TIMEOUT = _env_int('ONDEMAND_LOADERS_READ_TIMEOUT', 60)
+# Retries for failed connections and 429/5xx answers, with exponential backoff honouring Retry-After
+HTTP_RETRIES = _env_int('ONDEMAND_LOADERS_HTTP_RETRIES', 5)
+# Connections kept alive per host, enough for every segment of a parallel download
+POOL_SIZE = _env_int('ONDEMAND_LOADERS_POOL_SIZE', 16)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Errors raised while reading a response body when the connection drops or stalls
+TRANSFER_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session():
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=1,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_session(url):
+    """
+    Returns the pooled keep-alive session used for requests to the host of url.
+    """
+    parsed = urlparse(url)
+    host = f"{parsed.scheme}://{parsed.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _create_session()
+        return session
+
+
+def _http_get(url, headers=None, stream=False, timeout=None, **kwargs):
+    """
+    GET through the shared session of the target host, with default timeouts and retries.
+    """
+    response = _get_session(url).get(
+        url,
+        headers=headers,
+        stream=stream,
+        timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT),
+        **kwargs,
+    )
+    host = urlparse(response.url).hostname
+    if stream:
+        # Downloads are streamed, elapsed stops when the headers are received (including redirects)
+        TIME_TO_FIRST_BYTE.observe(sum(r.elapsed.total_seconds() for r in response.history + [response]), host=host)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        RETRIES.inc(len(retries.history), host=host, reason="http")
+    return response
+
+
+def _mirror_urls(model_url):
+    """
+    Returns the URLs of a config entry, whose url is either a single URL or a list of mirrors.
+    """
+    if isinstance(model_url, (list, tuple)):
+        return [url for url in model_url if url]
+    return [model_url]
+
+
+def _primary_url(model_url):
+    """
+    Returns the first URL of a config entry. Downloads, index entries and API keys are keyed by it,
+    so that adding mirrors to an entry does not download its model again.
+    """
+    urls = _mirror_urls(model_url)
+    return urls[0] if urls else None
+
+
+def _headers_for_url(url, model_url, headers):
+    """
+    Only forwards the authorization headers when the (redirected) URL is on the same host as the original one.
+    """
+    if headers and urlparse(url).netloc == urlparse(model_url).netloc:
+        return dict(headers)
+    return {}
+
+
+def _http_head(url, headers=None, timeout=None):
+    """
+    HEAD through the shared session of the target host, following redirects (e.g. to a CDN).
+    """
+    return _get_session(url).head(url, headers=headers, allow_redirects=True, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+def _get_api_key_for_url(model_url, api_key_param):
+    """
+    Determines the API key to use based on the model_url.
+    It checks for a provided api_key_param first, then environment variables.
+    For a list of mirrors, the key is the one of the first URL.
+    """
+    model_url = _primary_url(model_url) or ""
+    if model_url.startswith("https://civitai.com"):
+        return api_key_param or os.environ.get('CIVITAI_TOKEN')
+    elif model_url.startswith("https://huggingface.co"):
+        return api_key_param or os.environ.get('HUGGINGFACE_TOKEN')
+    else:
+        return api_key_param # Return provided key if URL doesn't match known platforms
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from .utils import logger
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Digest of a model file, stored next to it and trusted as long as its size and mtime are unchanged
+HASH_SUFFIX = ".sha256"
+
+
+def _normalize_sha256(value):
+    """
+    Returns a lowercase hex SHA-256 digest, or None if value is not one (e.g. a quoted ETag of another kind).
+    Accepts the "sha256:<digest>" notation.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip().strip('"').lower()
+    if value.startswith("sha256:"):
+        value = value[len("sha256:"):]
+    return value if SHA256_PATTERN.match(value) else None
+
+
+def _hash_file(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _read_cached_digest(filepath):
+    """
+    Returns the digest cached for filepath, or None if missing or the file changed since.
+    """
+    try:
+        stat = os.stat(filepath)
+        with open(filepath + HASH_SUFFIX, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("size") != stat.st_size or data.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return _normalize_sha256(data.get("sha256"))
+
+
+def _write_cached_digest(filepath, sha256):
+    try:
+        stat = os.stat(filepath)
+        tmp_filepath = filepath + HASH_SUFFIX + ".tmp"
+        with open(tmp_filepath, 'w') as f:
+            json.dump({"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, f)
+        os.replace(tmp_filepath, filepath + HASH_SUFFIX)
+    except OSError as e:
+        logger.warning(f"Unable to cache the digest of '{filepath}': {e}")
+
+
+def _remove_cached_digest(filepath):
+    try:
+        os.remove(filepath + HASH_SUFFIX)
+    except OSError:
+        pass
+
+
+def _file_digest(filepath):
+    """
+    Returns the SHA-256 of a file, hashing it only if no up to date digest is cached next to it.
+    """
+    sha256 = _read_cached_digest(filepath)
+    if sha256 is None:
+        logger.info(f"Computing the SHA-256 of '{filepath}'")
+        sha256 = _hash_file(filepath)
+        _write_cached_digest(filepath, sha256)
+    return sha256
+
+
+def _verify_file(filepath, expected_sha256):
+    """
+    Checks a file against its expected SHA-256. Files without an expected digest are trusted.
+
+    Returns:
+        bool: False if the content does not match.
+    """
+    if not expected_sha256:
+        return True
+    sha256 = _file_digest(filepath)
+    if sha256 != expected_sha256:
+        logger.error(f"'{filepath}' is corrupted: SHA-256 is {sha256}, expected {expected_sha256}")
+        return False
+    return True
+
+
+class _StreamingDigest:
+    """
+    SHA-256 of a file computed while it is being downloaded, so that verifying it does not
+    need a second pass over a multi-GB file.
+
+    Data written at the hashed position is hashed directly from the downloaded chunks. With
+    segmented downloads, the bytes written ahead by the other segments are read back from the
+    staging file (still in the page cache) as soon as the contiguous prefix reaches them.
+    Writers must flush their data before reporting it.
+    """
+
+    def __init__(self, filepath, segments=None):
+        self.filepath = filepath
+        # Live [start, end, position] segments of the download, None for a sequential write
+        self.segments = segments
+        self.sha256 = hashlib.sha256()
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def _written_up_to(self):
+        if self.segments is None:
+            return self.position
+        for start, end, position in self.segments:
+            if start <= self.position <= end:
+                return position
+        return self.position
+
+    def _catch_up(self):
+        limit = self._written_up_to()
+        if limit <= self.position:
+            return
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.position)
+            while self.position < limit:
+                block = f.read(min(HASH_BLOCK_SIZE, limit - self.position))
+                if not block:
+                    break
+                self.sha256.update(block)
+                self.position += len(block)
+                limit = max(limit, self._written_up_to())
+
+    def update(self, offset, data):
+        """
+        Reports data written at offset. Never blocks the caller on another thread's hashing.
+        """
+        if not self.lock.acquire(blocking=False):
+            # The thread holding the lock, or hexdigest(), will read this data back from the file
+            return
+        try:
+            if offset == self.position:
+                self.sha256.update(data)
+                self.position += len(data)
+            elif self.segments is not None:
+                self._catch_up()
+        finally:
+            self.lock.release()
+
+    def hexdigest(self):
+        """
+        Hashes whatever is left once the download is complete and returns the digest.
+        """
+        with self.lock:
+            self._catch_up()
+            return self.sha256.hexdigest()
@@ -18,6 +18,8 @@ export class SearchableCombo {
         this.ITEM_HEIGHT = 28; // Height per item in pixels (padding + line-height)
         this.DEFAULT_MAX_HEIGHT = 300; // Default max-height of itemsContainer
         this.EXPANDED_BOTTOM_MARGIN = 0; // Bottom margin when expanded
+        this.SEARCH_PAGE_SIZE = 50; // Results fetched per request in remote search mode
+        this.SEARCH_DEBOUNCE_MS = 150; // Delay after the last keystroke before querying the server
         
         // Load custom preset icon
         this.customPresetIcon = null;
@@ -42,6 +44,8 @@ export class SearchableCombo {
      * @param {boolean} options.allowCustomValues - Whether to allow custom values via Enter key (default: false)
      * @param {boolean} options.initialExpanded - Initial expanded state (default: false)
      * @param {Function} options.onExpandedChange - Callback when expanded state changes
+     * @param {Function} options.search - Optional async (query, offset, limit) => { items, total } used
+     *                                     to search the server page by page instead of filtering `items`
      */
     show(items, options = {}) {
         // Always ensure we're fully cleaned up before showing
@@ -57,6 +61,11 @@ export class SearchableCombo {
         this.isActive = true;
         this.selectedIndex = -1;
         this.isExpanded = options.initialExpanded || false;
+        this.search = options.search || null;
+        this.total = this.items.length;
+        this.searchSeq = 0;
+        this.searchTimer = null;
+        this.loadingMore = false;
 
         // Create overlay
         this.overlay = document.createElement('div');
@@ -180,6 +189,7 @@ export class SearchableCombo {
         // Create items container
         this.itemsContainer = document.createElement('div');
         this.itemsContainer.className = 'ondemand-loaders-searchable-dropdown-items';
+        this.itemsContainer.addEventListener('scroll', () => this.handleScroll());
         this.container.appendChild(this.itemsContainer);
 
         // Add expand button
@@ -201,6 +211,9 @@ export class SearchableCombo {
 
         // Render items
         this.renderItems();
+        if (this.search) {
+            this.loadResults(false);
+        }
         
         // Apply initial expanded state if needed
         if (this.isExpanded) {
@@ -319,6 +332,12 @@ export class SearchableCombo {
      * Filters items based on search input
      */
     filterItems() {
+        if (this.search) {
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.loadResults(false), this.SEARCH_DEBOUNCE_MS);
+            return;
+        }
+
         const searchTerm = this.searchInput.value.toLowerCase().trim();
         
         if (!searchTerm) {
@@ -334,6 +353,52 @@ export class SearchableCombo {
         this.renderItems();
     }
 
+    /**
+     * Fetches the first page of results for the current search term, or the next page when appending
+     */
+    async loadResults(append) {
+        if (!this.search || !this.isActive) return;
+
+        const seq = append ? this.searchSeq : ++this.searchSeq;
+        const query = this.searchInput.value.trim();
+        const offset = append ? this.filteredItems.length : 0;
+        this.loadingMore = append;
+
+        try {
+            const { items, total } = await this.search(query, offset, this.SEARCH_PAGE_SIZE);
+            // Ignore answers to outdated queries
+            if (seq !== this.searchSeq || !this.isActive) return;
+
+            this.filteredItems = append ? this.filteredItems.concat(items) : items;
+            this.total = total;
+            if (!append) {
+                this.selectedIndex = -1;
+            }
+
+            const scrollTop = this.itemsContainer.scrollTop;
+            this.renderItems();
+            this.itemsContainer.scrollTop = append ? scrollTop : 0;
+        } catch (e) {
+            console.error("[ComfyUI-OnDemand-Loaders] Search failed", e);
+        } finally {
+            if (seq === this.searchSeq) {
+                this.loadingMore = false;
+            }
+        }
+    }
+
+    /**
+     * Loads the next page of results when the list is scrolled to its end
+     */
+    handleScroll() {
+        if (!this.search || this.loadingMore || this.filteredItems.length >= this.total) return;
+
+        const container = this.itemsContainer;
+        if (container.scrollTop + container.clientHeight >= container.scrollHeight - this.ITEM_HEIGHT * 5) {
+            this.loadResults(true);
+        }
+    }
+
     /**
      * Updates visual selection highlighting
      */
@@ -354,7 +419,7 @@ export class SearchableCombo {
      * Updates the count indicator at the bottom
      */
     updateCountIndicator() {
-        const total = this.items.length;
+        const total = this.search ? this.total : this.items.length;
         const shown = this.filteredItems.length;
         
         if (shown === total) {
@@ -568,6 +633,7 @@ export class SearchableCombo {
      * Hides and cleans up the dropdown
      */
     hide() {
+        clearTimeout(this.searchTimer);
         if (this.container && this.container.parentNode) {
             document.body.removeChild(this.container);
         }
@@ -584,6 +650,8 @@ export class SearchableCombo {
         this.filteredItems = [];
         this.selectedIndex = -1;
         this.callback = null;
+        this.search = null;
+        this.total = 0;
     }
 
     /**
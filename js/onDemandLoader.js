@@ -3,24 +3,51 @@ import { api } from "/scripts/api.js";
 import { ComfyWidgets } from "/scripts/widgets.js";
 import { SearchableCombo } from "./SearchableCombo.js";
 
+async function fetchLoraInfo(loras) {
+	// One request for any number of nodes, keyed by node id
+	const response = await api.fetchApi("/on_demand_loader/lora_info", {
+		method: "POST",
+		body: JSON.stringify({ loras }),
+		headers: {
+			"Content-Type": "application/json",
+		},
+	});
+	if (response.status !== 200) {
+		throw new Error(`lora_info returned ${response.status}`);
+	}
+	return (await response.json()).loras;
+}
+
 async function onLoraChanged(node, lora_name) {
-    try {
-        const response = await api.fetchApi("/on_demand_loader/lora_changed", {
-            method: "POST",
-            body: JSON.stringify({ lora_name }),
-            headers: {
-                "Content-Type": "application/json",
-            },
-        });
-        if (response.status !== 200) {
-            console.error(`[ComfyUI-OnDemand-Loaders] Failed to notify backend of lora change: ${response.status}`);
-        } else {
-			const loraInfo = await response.json();
-			addOrUpdateLoraInfoWidgets(node, loraInfo);
+	try {
+		const loras = await fetchLoraInfo({ [node.id]: lora_name });
+		addOrUpdateLoraInfoWidgets(node, loras[node.id] || { name: "None" });
+	} catch (e) {
+		console.error("[ComfyUI-OnDemand-Loaders] Failed to get lora info", e);
+	}
+}
+
+async function hydrateLoraNodes(nodes) {
+	const loras = {};
+	for (const node of nodes) {
+		const loraNameWidget = node.widgets?.find((w) => w.name === "lora_name");
+		if (loraNameWidget && loraNameWidget.value !== "None") {
+			loras[node.id] = loraNameWidget.value;
 		}
-    } catch (e) {
-        console.error("[ComfyUI-OnDemand-Loaders] Failed to notify backend of lora change", e);
-    }
+	}
+	if (Object.keys(loras).length === 0) {
+		return;
+	}
+	try {
+		const found = await fetchLoraInfo(loras);
+		for (const node of nodes) {
+			if (node.id in found) {
+				addOrUpdateLoraInfoWidgets(node, found[node.id] || { name: "None" });
+			}
+		}
+	} catch (e) {
+		console.error("[ComfyUI-OnDemand-Loaders] Failed to get lora info", e);
+	}
 }
 
 function addOrUpdateLoraInfoWidgets(node, loraInfo) {
@@ -77,10 +104,170 @@ function addOrUpdateWidget(node, widgetName, value, type = "STRING", multiline =
 }
 
 
+async function searchModels(source, query, offset, limit) {
+	const params = new URLSearchParams({ source, q: query, offset, limit });
+	const response = await api.fetchApi(`/on_demand_loader/search?${params}`);
+	if (response.status !== 200) {
+		throw new Error(`search returned ${response.status}`);
+	}
+	return await response.json();
+}
+
+function getSearchSources(nodeData) {
+	const sources = {};
+	for (const inputs of [nodeData.input?.required, nodeData.input?.optional]) {
+		for (const [name, spec] of Object.entries(inputs || {})) {
+			const source = Array.isArray(spec) ? spec[1]?.search_source : undefined;
+			if (source) {
+				sources[name] = source;
+			}
+		}
+	}
+	return sources;
+}
+
+function attachSearchableCombo(node, widget, source, onSelected) {
+	widget.searchableCombo = new SearchableCombo();
+
+	widget.onClick = (e) => {
+		widget.searchableCombo.show(widget.options.values, {
+			event: e.e,
+			title: 'Select Model',
+			currentMode: 'list',
+			initialExpanded: false,
+			search: (query, offset, limit) => searchModels(source, query, offset, limit),
+			callback: (selectedItem) => {
+				widget.value = selectedItem;
+				onSelected?.(selectedItem);
+			}
+		});
+	};
+}
+
+const DOWNLOAD_EVENT = "on_demand_loader.download";
+const FINISHED_STATES = ["completed", "failed", "cancelled"];
+// Delay before the progress bar of a finished download disappears, in ms
+const FINISHED_DOWNLOAD_DISPLAY_MS = 3000;
+const DOWNLOAD_BAR_HEIGHT = 16;
+
+// Latest state of the downloads of each node, keyed by node id then job id
+const nodeDownloads = new Map();
+
+function onDownloadEvent({ detail: job }) {
+	for (const nodeId of job.node_ids) {
+		if (!nodeDownloads.has(nodeId)) {
+			nodeDownloads.set(nodeId, new Map());
+		}
+		nodeDownloads.get(nodeId).set(job.id, job);
+		if (FINISHED_STATES.includes(job.state)) {
+			setTimeout(() => {
+				const jobs = nodeDownloads.get(nodeId);
+				if (jobs?.get(job.id) === job) {
+					jobs.delete(job.id);
+					app.graph?.setDirtyCanvas(true, false);
+				}
+			}, FINISHED_DOWNLOAD_DISPLAY_MS);
+		}
+	}
+	app.graph?.setDirtyCanvas(true, false);
+}
+
+function formatBytes(bytes) {
+	const units = ["B", "KB", "MB", "GB", "TB"];
+	let i = 0;
+	while (bytes >= 1024 && i < units.length - 1) {
+		bytes /= 1024;
+		i++;
+	}
+	return `${bytes.toFixed(i > 1 ? 1 : 0)} ${units[i]}`;
+}
+
+function formatDownload(job) {
+	const percent = job.total_bytes ? Math.floor((100 * job.bytes_done) / job.total_bytes) : 0;
+	if (job.state !== "running") {
+		return `${job.state} ${job.state === "completed" ? "" : `${percent}%`}`.trim();
+	}
+	let text = `${percent}% of ${formatBytes(job.total_bytes)}`;
+	if (job.rate) {
+		text += ` · ${formatBytes(job.rate)}/s`;
+	}
+	if (job.eta != null) {
+		text += ` · ${Math.ceil(job.eta)}s left`;
+	}
+	return text;
+}
+
+function drawDownloads(node, ctx) {
+	const jobs = [...(nodeDownloads.get(String(node.id))?.values() || [])];
+	if (jobs.length === 0 || node.flags?.collapsed) {
+		return;
+	}
+	let y = node.size[1] - DOWNLOAD_BAR_HEIGHT * jobs.length;
+	for (const job of jobs) {
+		const progress = job.state === "completed" ? 1 : job.total_bytes ? job.bytes_done / job.total_bytes : 0;
+		ctx.fillStyle = "#222";
+		ctx.fillRect(0, y, node.size[0], DOWNLOAD_BAR_HEIGHT);
+		ctx.fillStyle = job.state === "failed" || job.state === "cancelled" ? "#a33" : job.state === "paused" ? "#a83" : "#3a6";
+		ctx.fillRect(0, y, node.size[0] * progress, DOWNLOAD_BAR_HEIGHT);
+		ctx.fillStyle = "#fff";
+		ctx.font = "11px sans-serif";
+		ctx.textAlign = "left";
+		ctx.fillText(`${job.name}: ${formatDownload(job)}`, 4, y + DOWNLOAD_BAR_HEIGHT - 4, node.size[0] - 8);
+		y += DOWNLOAD_BAR_HEIGHT;
+	}
+}
+
+async function controlDownload(jobId, action) {
+	const response = await api.fetchApi(`/on_demand_loader/downloads/${jobId}/${action}`, { method: "POST" });
+	if (response.status !== 200) {
+		console.error(`[ComfyUI-OnDemand-Loaders] Unable to ${action} download ${jobId}: ${response.status}`);
+	}
+}
+
+function getDownloadMenuOptions(node) {
+	const options = [];
+	for (const job of nodeDownloads.get(String(node.id))?.values() || []) {
+		if (FINISHED_STATES.includes(job.state)) {
+			continue;
+		}
+		if (job.state === "paused") {
+			options.push({ content: `Resume download of ${job.name}`, callback: () => controlDownload(job.id, "resume") });
+		} else {
+			options.push({ content: `Pause download of ${job.name}`, callback: () => controlDownload(job.id, "pause") });
+		}
+		options.push({ content: `Cancel download of ${job.name}`, callback: () => controlDownload(job.id, "cancel") });
+	}
+	return options;
+}
+
+function addDownloadProgress(nodeType) {
+	const onDrawForeground = nodeType.prototype.onDrawForeground;
+	nodeType.prototype.onDrawForeground = function (ctx) {
+		const result = onDrawForeground?.apply(this, arguments);
+		drawDownloads(this, ctx);
+		return result;
+	};
+
+	const getExtraMenuOptions = nodeType.prototype.getExtraMenuOptions;
+	nodeType.prototype.getExtraMenuOptions = function (_, options) {
+		const result = getExtraMenuOptions?.apply(this, arguments);
+		const downloadOptions = getDownloadMenuOptions(this);
+		if (downloadOptions.length > 0) {
+			options.push(null, ...downloadOptions);
+		}
+		return result;
+	};
+}
 
 app.registerExtension({
 	name: "comfy.francarl.onDemandLoader",
 	async beforeRegisterNodeDef(nodeType, nodeData, app) {
+		const searchSources = getSearchSources(nodeData);
+
+		if (nodeData.name.startsWith("OnDemand")) {
+			addDownloadProgress(nodeType);
+		}
+
 		if (nodeData.name === "OnDemandCivitaiLikedLoraLoader") {
 			const onNodeCreated = nodeType.prototype.onNodeCreated;
 			nodeType.prototype.onNodeCreated = function () {
@@ -94,25 +281,9 @@ app.registerExtension({
 						onLoraChanged(this, value);
 					};
 
-					loraNameWidget.searchableCombo = new SearchableCombo();
-
-					loraNameWidget.onClick = (e) => {
-						console.log("[ComfyUI-OnDemand-Loaders] Lora Name:", loraNameWidget.value);
-
-						loraNameWidget.searchableCombo.show(loraNameWidget.options.values, {
-							event: e.e,
-							title: 'Select Preset',
-							currentMode: 'list',
-							initialExpanded: false,
-							onExpandedChange: (isExpanded) => {
-								console.log('[ComfyUI-OnDemand-Loaders] SearchableCombo expanded:', isExpanded);
-							},
-							callback: (selectedItem) => {
-								loraNameWidget.value = selectedItem;
-								onLoraChanged(this, selectedItem);
-							}
-						});
-					};
+					attachSearchableCombo(this, loraNameWidget, searchSources.lora_name || "civitai_liked_loras", (selectedItem) => {
+						onLoraChanged(this, selectedItem);
+					});
 				}
 				
 				this.addWidget("button", "ℹ️ Lora Info", "", () => {
@@ -120,9 +291,28 @@ app.registerExtension({
 				}, { serialize: false });
 				
 			};
+		} else if (Object.keys(searchSources).length > 0) {
+			// Model lists of the config-based nodes are searched on the server, they may be too large to embed
+			const onNodeCreated = nodeType.prototype.onNodeCreated;
+			nodeType.prototype.onNodeCreated = function () {
+				onNodeCreated?.apply(this, arguments);
+
+				for (const [name, source] of Object.entries(searchSources)) {
+					const widget = this.widgets?.find((w) => w.name === name);
+					if (widget) {
+						attachSearchableCombo(this, widget, source, widget.callback);
+					}
+				}
+			};
 		}
 	},
+	async afterConfigureGraph() {
+		// Fills the info widgets of every liked lora node of the loaded workflow at once
+		const nodes = (app.graph?._nodes || []).filter((node) => node.type === "OnDemandCivitaiLikedLoraLoader");
+		await hydrateLoraNodes(nodes);
+	},
 	async setup() {
+		api.addEventListener(DOWNLOAD_EVENT, onDownloadEvent);
         window.showSelectedLoraInfo = async (node, widget) => {
             onLoraChanged(node, widget.value);
         };
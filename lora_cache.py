@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+
+from .utils import logger, _env_float
+from .metrics import LORA_CACHE_REQUESTS, LORA_CACHE_BYTES
+
+MB = 1024 ** 2
+
+# RAM kept for parsed LoRA weights shared by every LoRA node of the process, 0 to disable the cache
+LORA_CACHE_BUDGET = int(_env_float('ONDEMAND_LOADERS_LORA_CACHE_MB', 2048) * MB)
+
+
+def _state_dict_size(state_dict):
+    """
+    Returns the bytes held by the tensors of a state dict.
+    """
+    return sum(tensor.nelement() * tensor.element_size() for tensor in state_dict.values() if hasattr(tensor, "element_size"))
+
+
+class LoraCache:
+    """
+    Size-bounded LRU cache of parsed LoRA state dicts, keyed by file path, modification time and size,
+    so that a file replaced on disk is read again.
+
+    LoraLoader only remembers the last LoRA of each node instance, and the loaders create a new
+    instance for every execution; this cache survives both and is shared across nodes.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _evict(self, key):
+        _, size = self.entries.pop(key)
+        self.size -= size
+
+    def get(self, lora_filepath, load):
+        """
+        Returns the state dict of a LoRA file, calling load(lora_filepath) to parse it on a miss.
+        """
+        lora_filepath = os.path.abspath(lora_filepath)
+        stat = os.stat(lora_filepath)
+        key = (lora_filepath, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                LORA_CACHE_REQUESTS.inc(result="hit")
+                return entry[0]
+            self.misses += 1
+        LORA_CACHE_REQUESTS.inc(result="miss")
+
+        state_dict = load(lora_filepath)
+        size = _state_dict_size(state_dict)
+        if size > self.budget:
+            return state_dict
+
+        with self.lock:
+            # Older versions of the file are never requested again
+            for stale in [k for k in self.entries if k[0] == lora_filepath]:
+                self._evict(stale)
+            self.entries[key] = (state_dict, size)
+            self.size += size
+            while self.size > self.budget:
+                evicted = next(iter(self.entries))
+                self._evict(evicted)
+                self.evictions += 1
+                logger.debug(f"Evicted LoRA '{os.path.basename(evicted[0])}' from the LoRA cache")
+        return state_dict
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_lora_cache = LoraCache(LORA_CACHE_BUDGET)
+LORA_CACHE_BYTES.callback = lambda: {(): _lora_cache.size}
@@ -8,34 +8,21 @@ import logging
 from tqdm import tqdm
 import folder_paths
 from pathlib import Path
-from nodes import LoraLoader
 import server
 from aiohttp import web
 import json
 
-from .nodes import _get_api_key_for_url, _download_model, logger
+from .nodes import _get_api_key_for_url, _download_model, _timed_load, _load_lora, logger, PREFETCH_INPUTS, DOWNLOAD_CHUNKS_TOOLTIP
+from .civitai_catalog import CivitaiCatalog
+from .model_cache import _pin_model
+from .search_index import _register_search_source, _inline_names
 
 API_URL = "https://civitai.com/api/v1/models?types=LORA&favorites=true&nsfw=true"
 LORA_CONFIG = None
-SELECTED_LORA = None
+# Name and model id lookups of LORA_CONFIG, rebuilt when the catalog is refreshed
+_lora_index = {"config": None, "by_name": {}, "by_id": {}}
 
 
-def _fetch_data_from_api(url):
-    try:
-        apikey = os.environ.get('CIVITAI_TOKEN');
-        headers = {
-            "Authorization": f"Bearer {apikey}"
-        } if apikey else None
-
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  
-        
-        return response.json()
-    
-    except Exception as e:
-        logger.error("Error in retreving data from Civitai API: {e}", e)
-        return None
-
 def _transform_data_to_loras_structure(data):
     loras_list = []
     
@@ -51,6 +38,7 @@ def _transform_data_to_loras_structure(data):
             version_files = version.get("files", [])
             
             download_url = None
+            sha256 = None
             is_model_type = False
             
             if version_files:
@@ -60,6 +48,7 @@ def _transform_data_to_loras_structure(data):
                     download_url = version.get("downloadUrl")
                     trigger_words = version.get("trainedWords")
                     base_model = version.get("baseModel")
+                    sha256 = (first_file.get("hashes") or {}).get("SHA256")
 
             if is_model_type and download_url:
                 new_name = f"{main_model_name} - {version_name}"
@@ -71,51 +60,115 @@ def _transform_data_to_loras_structure(data):
                     "trigger_words": trigger_words,
                     "url": download_url,
                     "id": model_id,
-                    "base_model": base_model
+                    "base_model": base_model,
+                    "sha256": sha256.lower() if sha256 else None
                 })
 
     return {
         "loras": loras_list
     }
 
-def _get_lora_config():
+def _build_lora_config(items):
+    lora_config = _transform_data_to_loras_structure({"items": items})
+    none_entry = {"name": "None", "url": None}
+    lora_config['loras'].insert(0, none_entry)
+    return lora_config
+
+_lora_catalog = CivitaiCatalog("liked_loras", API_URL, _build_lora_config, folder_paths.models_dir)
+# Loads the saved list and starts its refresh in the background, without delaying the server startup
+_lora_catalog.get()
+
+def _get_lora_config(wait=False):
+    """
+    Returns the liked LoRAs saved on disk, refreshed from Civitai in the background.
+    """
     global LORA_CONFIG
-    if LORA_CONFIG is not None:
-        return LORA_CONFIG
-
-    raw_data = _fetch_data_from_api(API_URL)
-    if raw_data:
-        lora_config = _transform_data_to_loras_structure(raw_data)
-        none_entry = {"name": "None", "url": None}
-        lora_config['loras'].insert(0, none_entry)
+    lora_config = _lora_catalog.get(wait)
+    if lora_config is not None:
         LORA_CONFIG = lora_config
-        return LORA_CONFIG
-    
-    return None
+    return LORA_CONFIG
+
+def _get_lora_index():
+    global _lora_index
+    lora_config = LORA_CONFIG
+    if _lora_index["config"] is not lora_config:
+        by_name = {}
+        by_id = {}
+        for lora in (lora_config or {}).get("loras", []):
+            by_name.setdefault(lora["name"], lora)
+            if lora.get("id") is not None:
+                by_id.setdefault(str(lora["id"]), []).append(lora)
+        _lora_index = {"config": lora_config, "by_name": by_name, "by_id": by_id}
+    return _lora_index
+
+def _get_lora(lora_name):
+    """
+    Returns the entry of a liked LoRA in O(1), if the Civitai list was already fetched.
+    """
+    return _get_lora_index()["by_name"].get(lora_name)
+
+def _find_lora(lora_name, wait=True):
+    """
+    Returns the entry of a liked LoRA, refreshing the Civitai list if the name is missing,
+    e.g. liked after the list was last fetched.
+
+    Args:
+        wait (bool): Wait for the refresh, False to only start it in the background and return None.
+    """
+    lora_model = _get_lora(lora_name)
+    if not lora_model:
+        _lora_catalog.refresh(wait)
+        _get_lora_config()
+        lora_model = _get_lora(lora_name)
+    return lora_model
+
+def _get_loras_by_model_id(model_id):
+    """
+    Returns the entries of every liked version of a Civitai model.
+    """
+    return _get_lora_index()["by_id"].get(str(model_id), [])
+
+def _resolve_lora(lora_name):
+    """
+    Returns the download URL and published SHA-256 of a liked LoRA, if the Civitai list was already fetched.
+    """
+    lora_model = _get_lora(lora_name)
+    return (lora_model["url"], lora_model.get("sha256")) if lora_model else (None, None)
+
+PREFETCH_INPUTS["OnDemandCivitaiLikedLoraLoader"] = [("lora_name", _resolve_lora, "loras")]
+_register_search_source("civitai_liked_loras", _get_lora_config, lambda: LORA_CONFIG.get("loras") if LORA_CONFIG else None)
 
 class OnDemandCivitaiLikedLoraLoader:
 
     @classmethod
     def INPUT_TYPES(cls):
-        loras = { "loras": [] }
-        global LORA_CONFIG
-        LORA_CONFIG = _get_lora_config()
-        if LORA_CONFIG:
-            loras = [lora["name"] for lora in LORA_CONFIG.get("loras", []) ]
+        # Never waits for Civitai, the list is completed by the background refresh
+        loras = ["None"]
+        lora_config = _get_lora_config()
+        if lora_config:
+            loras = [lora["name"] for lora in lora_config.get("loras", []) ]
        
         return {
             "required": {
                 "model": ("MODEL",),
-                "lora_name": (loras,),
+                "lora_name": (_inline_names(loras), {"search_source": "civitai_liked_loras"}),
                 "strength_model": ("FLOAT", {"default": 1.0, "min": -10.0, "max": 10.0, "step": 0.01}),
                 "strength_clip": ("FLOAT", {"default": 1.0, "min": -10.0, "max": 10.0, "step": 0.01}),
             },
             "optional": {
                 "clip": ("CLIP", ),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, lora_name=None):
+        # Runs on the server event loop, never waits for Civitai: a name missing from the loaded list may have been
+        # liked since it was fetched, the list is refreshed in the background and the node looks the name up again
+        if isinstance(lora_name, str) and _get_lora_config():
+            _find_lora(lora_name, wait=False)
+        return True
+
     RETURN_TYPES = ("MODEL", "CLIP")
     RETURN_NAMES = ("model", "clip")
     FUNCTION = "download_lora"
@@ -124,62 +177,70 @@ class OnDemandCivitaiLikedLoraLoader:
     CATEGORY = "loaders"
 
     def download_lora(self, model, lora_name, strength_model, strength_clip, clip=None, api_key=None, download_chunks=None):
-        self.lora_loader = LoraLoader()
-
-        global LORA_CONFIG
-        LORA_CONFIG = _get_lora_config()
-        if not LORA_CONFIG:
+        if not _get_lora_config(wait=True):
             return model, clip # Return original model/clip if civitai api call fails
 
         destination_dir = os.path.join(folder_paths.models_dir, "loras")
 
-        lora_url = None
-        for lora_model in LORA_CONFIG.get("loras", []):
-            if lora_model["name"] == lora_name:
-                lora_url = lora_model["url"]
-                break
-
+        lora_model = _find_lora(lora_name)
+        lora_url = lora_model["url"] if lora_model else None
         if not lora_url:
             logger.error(f"Model URL not found for name: {lora_name} in 'loras'")
             return model, clip # Return original model/clip if URL not found
 
         api_key = os.environ.get('CIVITAI_TOKEN')
 
-        lora_filepath = _download_model(lora_url, lora_name, destination_dir, api_key, download_chunks)
+        lora_filepath = _download_model(lora_url, lora_name, destination_dir, api_key, download_chunks, lora_model.get("sha256"))
         if not lora_filepath:
             return model, clip # Return original model/clip if download fails
 
-        lora_filename = os.path.basename(lora_filepath)
+        with _timed_load(self), _pin_model(lora_filepath):
+            return _load_lora(model, clip, lora_filepath, strength_model, strength_clip)
+
 
-        # Load the LORA using the existing LoraLoader
-        model_lora, clip_lora = self.lora_loader.load_lora(model, clip, lora_filename, strength_model, strength_clip)
-        return model_lora, clip_lora
+def _json_response(data, status=200):
+    return web.Response(status=status, text=json.dumps(data, indent=4), content_type='application/json')
 
+@server.PromptServer.instance.routes.post("/on_demand_loader/lora_info")
+async def lora_info_handler(request):
+    """
+    Stateless batch lookup of liked LoRA metadata (author, trigger words, base model...), so that
+    every node of a workflow is hydrated with a single request.
+    Body: {"loras": {"<node id>": "<lora name>", ...}, "models": {"<key>": <civitai model id>, ...}},
+    answer: {"loras": {"<node id>": <entry or null>, ...}, "models": {"<key>": [<entry of each liked version>], ...}}.
+    """
+    data = await request.json()
+    requested = data.get("loras") or {}
+    requested_models = data.get("models") or {}
+    if not isinstance(requested, dict) or not isinstance(requested_models, dict):
+        return _json_response({"error": "Expected 'loras' and 'models' objects keyed by node id."}, status=400)
+
+    if not _get_lora_config():
+        return _json_response({"error": "Civitai liked loras are not loaded yet."}, status=503)
+    return _json_response({
+        "loras": {key: _get_lora(lora_name) for key, lora_name in requested.items()},
+        "models": {key: _get_loras_by_model_id(model_id) for key, model_id in requested_models.items()},
+    })
 
 @server.PromptServer.instance.routes.post("/on_demand_loader/lora_changed")
 async def lora_changed_handler(request):
-    global SELECTED_LORA, LORA_CONFIG
     data = await request.json()
     lora_name = data.get("lora_name")
+    if not _get_lora_config():
+        logger.error("LORA_CONFIG is not loaded.")
+    found_lora = _get_lora(lora_name) if lora_name else None
+    if found_lora:
+        return _json_response(found_lora)
     if lora_name:
-        if LORA_CONFIG:
-            found_lora = next((lora for lora in LORA_CONFIG.get("loras", []) if lora["name"] == lora_name), None)
-
-            if found_lora:
-                SELECTED_LORA = found_lora
-            else:
-                logger.error(f"Lora '{lora_name}' not found in LORA_CONFIG.")
-        else:
-            logger.error("LORA_CONFIG is not loaded.")
-    if SELECTED_LORA:
-        return web.Response(status=200, text=json.dumps(SELECTED_LORA, indent=4), content_type='application/json')
-    else:
-        return web.Response(status=404, text=json.dumps({"error": "No LoRA selected yet."}), content_type='application/json')
+        logger.error(f"Lora '{lora_name}' not found in LORA_CONFIG.")
+    return _json_response({"error": "No LoRA selected yet."}, status=404)
 
 @server.PromptServer.instance.routes.get("/on_demand_loader/get_selected_lora_info")
 async def get_selected_lora_info_handler(request):
-    global SELECTED_LORA
-    if SELECTED_LORA:
-        return web.Response(status=200, text=json.dumps(SELECTED_LORA, indent=4), content_type='application/json')
-    else:
-        return web.Response(status=404, text=json.dumps({"error": "No LoRA selected yet."}), content_type='application/json')
+    # Selections are per node, the lora name has to be given
+    lora_name = request.query.get("lora_name")
+    _get_lora_config()
+    found_lora = _get_lora(lora_name) if lora_name else None
+    if found_lora:
+        return _json_response(found_lora)
+    return _json_response({"error": "No LoRA selected yet."}, status=404)
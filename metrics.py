@@ -0,0 +1,205 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the duration histograms, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Delay between two updates of the byte counters by a running transfer, in seconds
+METER_FLUSH_INTERVAL = 1.0
+
+_metrics = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    A metric of the /on_demand_loader/metrics endpoint, in the Prometheus text format.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name) or "") for name in self.labelnames)
+
+    def _samples(self):
+        with self.lock:
+            return [(self.name, key, None, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A gauge set explicitly, or read from `callback` returning {label values tuple: value} at every scrape.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.callback is None:
+            return super()._samples()
+        return [(self.name, tuple(map(str, key)), None, value) for key, value in sorted(self.callback().items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", key, [("le", _format_value(bound))], count))
+                samples.append((self.name + "_count", key, None, counts[-1]))
+                samples.append((self.name + "_sum", key, None, total))
+        return samples
+
+
+def _render_metrics():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+CACHE_REQUESTS = Counter(
+    "ondemand_loaders_cache_requests_total",
+    "Models requested from the loaders, by result: hit (already on disk), linked (identical file already downloaded) or miss (downloaded).",
+    ("model_type", "result"))
+RESOLVE_SECONDS = Histogram(
+    "ondemand_loaders_resolve_seconds",
+    "Time to find a model on disk or start its download, including the first request.",
+    ("model_type",))
+TIME_TO_FIRST_BYTE = Histogram(
+    "ondemand_loaders_time_to_first_byte_seconds",
+    "Time until the response headers of a download request are received.",
+    ("host",))
+DOWNLOAD_SECONDS = Histogram(
+    "ondemand_loaders_download_duration_seconds",
+    "Duration of the model transfers, by outcome (completed, failed, corrupted, cancelled).",
+    ("model_type", "outcome"))
+DOWNLOADED_BYTES = Counter(
+    "ondemand_loaders_downloaded_bytes_total",
+    "Bytes received, by host serving them. rate() of this counter is the throughput of each host.",
+    ("host",))
+DISK_WRITE_SECONDS = Counter(
+    "ondemand_loaders_disk_write_seconds_total",
+    "Time spent writing received bytes to disk, by host serving them.",
+    ("host",))
+RETRIES = Counter(
+    "ondemand_loaders_retries_total",
+    "Retried requests, by reason: http (connection errors, 429 and 5xx), reconnect (dropped or stalled transfer), failover (moved to another mirror) or corrupted (SHA-256 mismatch).",
+    ("host", "reason"))
+MIRROR_PROBE_SECONDS = Gauge(
+    "ondemand_loaders_mirror_probe_seconds",
+    "Time to first byte of the mirrors at their last probe, by host (the fastest one of a host). Mirrors that failed are left out.",
+    ("host",))
+LOAD_SECONDS = Histogram(
+    "ondemand_loaders_load_seconds",
+    "Wall time of the underlying ComfyUI loaders, by node.",
+    ("node",))
+DOWNLOAD_JOBS = Gauge(
+    "ondemand_loaders_downloads",
+    "Download jobs known to the download manager, by state.",
+    ("state",))
+LORA_CACHE_REQUESTS = Counter(
+    "ondemand_loaders_lora_cache_requests_total",
+    "LoRA weights requested from the in-memory LoRA cache, by result: hit or miss (read from disk).",
+    ("result",))
+LORA_CACHE_BYTES = Gauge(
+    "ondemand_loaders_lora_cache_bytes",
+    "Memory held by the LoRA weights in the in-memory LoRA cache.")
+STARTUP_SECONDS = Gauge(
+    "ondemand_loaders_startup_seconds",
+    "Time spent importing the plugin at server startup.")
+
+
+class _TransferMeter:
+    """
+    Counts the bytes and disk write time of one transfer, publishing them at most once per
+    METER_FLUSH_INTERVAL so that the block loop does not contend on the counter locks.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.bytes = 0
+        self.write_seconds = 0.0
+        self.flushed = time.monotonic()
+
+    def add(self, count, write_seconds):
+        self.bytes += count
+        self.write_seconds += write_seconds
+        now = time.monotonic()
+        if now - self.flushed >= METER_FLUSH_INTERVAL:
+            self.flush()
+            self.flushed = now
+
+    def flush(self):
+        if self.bytes:
+            DOWNLOADED_BYTES.inc(self.bytes, host=self.host)
+            DISK_WRITE_SECONDS.inc(self.write_seconds, host=self.host)
+        self.bytes = 0
+        self.write_seconds = 0.0
@@ -0,0 +1,134 @@
+"""
+Config entries whose url is a list of mirrors of the same file, e.g. HuggingFace, an internal
+S3-compatible or plain HTTP mirror and a LAN cache. The mirrors are probed for their time to
+first byte, the download starts on the fastest healthy one and its segments move to another
+mirror when it fails.
+"""
+import time
+import threading
+import requests
+from collections import namedtuple
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import logger, _env_int, _env_float
+from .http_client import _mirror_urls, _headers_for_url, CONNECT_TIMEOUT
+from .metrics import MIRROR_PROBE_SECONDS
+
+# Seconds a probe result is reused, a mirror that failed is also tried last for that long
+MIRROR_PROBE_TTL = _env_int('ONDEMAND_LOADERS_MIRROR_PROBE_TTL', 300)
+# Seconds a mirror has to answer a probe before it is considered down
+MIRROR_PROBE_TIMEOUT = _env_float('ONDEMAND_LOADERS_MIRROR_PROBE_TIMEOUT', 5)
+# Spread the segments of a download over every healthy mirror instead of only the fastest one
+MIRROR_SPREAD = _env_int('ONDEMAND_LOADERS_MIRROR_SPREAD', 0) != 0
+
+# A source of a download: the authorization headers are only those of its host,
+# seconds is the probed time to first byte (None if down or not probed), size the probed file size
+_Mirror = namedtuple("_Mirror", ("url", "headers", "seconds", "size"))
+
+
+def _content_size(response):
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        return int(content_range.rsplit('/', 1)[1])
+    if response.status_code == 200 and response.headers.get('Content-Length', '').isdigit():
+        return int(response.headers['Content-Length'])
+    return None
+
+
+def _probe_mirror(url, headers):
+    """
+    Measures the time to first byte of a mirror, redirects included.
+    A one-byte ranged GET is used instead of HEAD, which presigned S3 URLs do not accept, and without
+    the retries of the shared sessions so that a failing mirror is reported at once.
+
+    Returns:
+        (float, int): The seconds until the response headers and the size of the file, if known.
+    """
+    start = time.perf_counter()
+    with requests.get(url, headers=dict(headers, Range="bytes=0-0"), stream=True,
+                      timeout=(min(CONNECT_TIMEOUT, MIRROR_PROBE_TIMEOUT), MIRROR_PROBE_TIMEOUT)) as response:
+        response.raise_for_status()
+        return time.perf_counter() - start, _content_size(response)
+
+
+class _MirrorProbes:
+    """
+    Probe results of the mirrors, shared by the downloads of the process and reused for MIRROR_PROBE_TTL seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers):
+        """
+        Returns the (seconds, size) of a mirror, seconds being None if it is down.
+        """
+        with self.lock:
+            result = self.results.get(url)
+        if result is not None and time.monotonic() - result[0] < self.ttl:
+            return result[1:]
+
+        try:
+            seconds, size = _probe_mirror(url, headers)
+            logger.debug(f"Mirror '{url}' answered in {seconds * 1000:.0f} ms")
+        except requests.exceptions.RequestException as e:
+            seconds, size = None, None
+            logger.warning(f"Mirror '{url}' is unavailable: {e}")
+        with self.lock:
+            self.results[url] = (time.monotonic(), seconds, size)
+        return seconds, size
+
+    def mark_down(self, url, error):
+        """
+        Records that a mirror failed during a download, so that the next ones try it last.
+        """
+        logger.debug(f"Mirror '{url}' marked as down: {error}")
+        with self.lock:
+            self.results[url] = (time.monotonic(), None, None)
+
+    def latencies(self):
+        """
+        Returns the last probed time to first byte of the healthy mirrors, by host. Mirrors sharing a host
+        (other ports or paths) report the fastest of them; their URLs are not used as labels as they may be presigned.
+        """
+        latencies = {}
+        with self.lock:
+            for url, (_, seconds, _) in self.results.items():
+                host = (urlparse(url).hostname,)
+                if seconds is not None and (host not in latencies or seconds < latencies[host]):
+                    latencies[host] = seconds
+        return latencies
+
+
+_mirror_probes = _MirrorProbes(MIRROR_PROBE_TTL)
+MIRROR_PROBE_SECONDS.callback = _mirror_probes.latencies
+
+
+def _rank_mirrors(model_url, headers):
+    """
+    Orders the sources of a config entry for a download. A single URL is returned as is,
+    the mirrors of a list are probed concurrently.
+
+    Args:
+        model_url (str or list): The url of the config entry.
+        headers (dict): The authorization headers of the first URL, only sent to the mirrors on the same host.
+
+    Returns:
+        list: _Mirror tuples, the healthy mirrors by time to first byte, then those that are down
+        in config order, as a last resort.
+    """
+    urls = _mirror_urls(model_url)
+    sources = [(url, _headers_for_url(url, urls[0], headers)) for url in urls]
+    if len(sources) == 1:
+        return [_Mirror(*sources[0], None, None)]
+
+    with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="ondemand-probe") as executor:
+        probes = list(executor.map(lambda source: _mirror_probes.get(*source), sources))
+    mirrors = [_Mirror(url, mirror_headers, seconds, size) for (url, mirror_headers), (seconds, size) in zip(sources, probes)]
+    healthy = sorted((mirror for mirror in mirrors if mirror.seconds is not None), key=lambda mirror: mirror.seconds)
+    if healthy:
+        logger.info(f"Using mirror '{healthy[0].url}' ({healthy[0].seconds * 1000:.0f} ms to first byte)")
+    return healthy + [mirror for mirror in mirrors if mirror.seconds is None]
@@ -0,0 +1,184 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from .utils import logger, _env_float
+from .model_index import _connect, _get_index_path
+from .blob_store import _gc_blobs
+from .integrity import _remove_cached_digest
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+# Files accessed more recently than this (in any process) are never evicted, in seconds
+EVICTION_GRACE_PERIOD = _env_float('ONDEMAND_LOADERS_CACHE_GRACE_MINUTES', 10) * 60
+
+# Files currently being loaded by this process, with a reference count
+_pinned_paths = Counter()
+_pinned_lock = threading.Lock()
+
+
+def _get_quota(model_type=None):
+    """
+    Byte quota of the downloaded models, overall or for one model type (e.g. 'loras'), None if unlimited.
+    """
+    name = 'ONDEMAND_LOADERS_CACHE_QUOTA_GB'
+    if model_type:
+        name += '_' + model_type.upper()
+    quota = _env_float(name, 0)
+    return int(quota * GB) if quota > 0 else None
+
+
+def _connect_cache(destination_dir):
+    conn = _connect(_get_index_path(destination_dir))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS managed_files ("
+        " path TEXT PRIMARY KEY,"
+        " model_type TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " last_access REAL NOT NULL)"
+    )
+    return conn
+
+
+def _register_model(model_filepath):
+    """
+    Marks a file downloaded by the loaders as managed, i.e. eligible for eviction.
+    """
+    model_filepath = os.path.abspath(model_filepath)
+    destination_dir = os.path.dirname(model_filepath)
+    try:
+        with _connect_cache(destination_dir) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO managed_files (path, model_type, size, last_access) VALUES (?, ?, ?, ?)",
+                (model_filepath, os.path.basename(destination_dir), os.path.getsize(model_filepath), time.time()),
+            )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to register '{model_filepath}' in the model cache: {e}")
+
+
+def _touch_model(model_filepath):
+    """
+    Records an access to a managed file, files not downloaded by the loaders are ignored.
+    """
+    model_filepath = os.path.abspath(model_filepath)
+    try:
+        with _connect_cache(os.path.dirname(model_filepath)) as conn:
+            conn.execute("UPDATE managed_files SET last_access = ? WHERE path = ?", (time.time(), model_filepath))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to update the access time of '{model_filepath}': {e}")
+
+
+@contextmanager
+def _pin_model(model_filepath):
+    """
+    Protects a file from eviction while a loader is reading it.
+    """
+    model_filepath = os.path.abspath(model_filepath)
+    with _pinned_lock:
+        _pinned_paths[model_filepath] += 1
+    try:
+        yield model_filepath
+    finally:
+        with _pinned_lock:
+            _pinned_paths[model_filepath] -= 1
+            if _pinned_paths[model_filepath] <= 0:
+                del _pinned_paths[model_filepath]
+
+
+def _managed_blobs(conn):
+    """
+    Groups the managed files by inode: the blob store hardlinks identical downloads to several names,
+    their bytes are on disk once. Files deleted by hand are forgotten.
+
+    Returns:
+        list: (size, last_access, links) tuples, the least recently used blob first. last_access is
+        that of its most recently used link, links the (path, model_type, last_access) of the blob.
+    """
+    blobs = {}
+    for path, entry_type, size, last_access in conn.execute("SELECT path, model_type, size, last_access FROM managed_files").fetchall():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            conn.execute("DELETE FROM managed_files WHERE path = ?", (path,))
+            continue
+        except OSError as e:
+            logger.warning(f"Unable to check the managed model '{path}': {e}")
+            continue
+        blob = blobs.setdefault((stat.st_dev, stat.st_ino), [size, 0.0, []])
+        blob[1] = max(blob[1], last_access)
+        blob[2].append((path, entry_type, last_access))
+    return sorted((tuple(blob) for blob in blobs.values()), key=lambda blob: blob[1])
+
+
+def _evictable(links, now):
+    with _pinned_lock:
+        if any(path in _pinned_paths for path, _, _ in links):
+            return False
+    return all(now - last_access >= EVICTION_GRACE_PERIOD for _, _, last_access in links)
+
+
+def _ensure_cache_space(destination_dir, needed_bytes):
+    """
+    Evicts the least recently used managed files until a download of needed_bytes fits in the
+    overall and per-type quotas. Pinned, recently used and unmanaged files are never removed.
+    Hardlinked files count once, and are only removed together to free the overall quota.
+    """
+    model_type = os.path.basename(os.path.abspath(destination_dir))
+    quota = _get_quota()
+    type_quota = _get_quota(model_type)
+    if quota is None and type_quota is None:
+        return
+
+    try:
+        with _connect_cache(destination_dir) as conn:
+            blobs = _managed_blobs(conn)
+            total = sum(size for size, _, _ in blobs)
+            type_total = sum(size for size, _, links in blobs if any(entry_type == model_type for _, entry_type, _ in links))
+            now = time.time()
+
+            evicted = False
+            for size, _, links in blobs:
+                over_quota = quota is not None and total + needed_bytes > quota
+                over_type_quota = type_quota is not None and type_total + needed_bytes > type_quota
+                if not over_quota and not over_type_quota:
+                    break
+                # Evicting another type does not help with the quota of this one, and the links of the
+                # other types can stay; the disk is only freed once every link of the blob is gone
+                evict = links if over_quota else [link for link in links if link[1] == model_type]
+                if not evict or not _evictable(evict, now):
+                    continue
+
+                removed = []
+                for path, entry_type, _ in evict:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"Unable to evict '{path}': {e}")
+                        continue
+                    _remove_cached_digest(path)
+                    conn.execute("DELETE FROM managed_files WHERE path = ?", (path,))
+                    removed.append(path)
+                    logger.info(f"Evicted least recently used model '{path}' ({size / MB:.1f} MB) to stay within the cache quota")
+                if not removed:
+                    continue
+                evicted = True
+                remaining = [link for link in links if link[0] not in removed]
+                if not remaining:
+                    total -= size
+                if not any(entry_type == model_type for _, entry_type, _ in remaining):
+                    type_total -= size
+
+            if evicted:
+                # The store keeps a link to every download, drop the ones no model folder uses anymore
+                _gc_blobs(destination_dir)
+
+            if (quota is not None and total + needed_bytes > quota) or (type_quota is not None and type_total + needed_bytes > type_quota):
+                logger.warning(f"Cache quota exceeded and nothing else can be evicted, downloading {needed_bytes / MB:.1f} MB anyway")
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to enforce the model cache quota: {e}")
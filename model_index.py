@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import threading
+
+from .utils import logger, _get_state_dir
+
+INDEX_FILENAME = "index.db"
+
+# In-process copy of the index rows, keyed by (index_path, url, destination_dir)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def _get_index_path(destination_dir):
+    """
+    The index lives in the state directory of the models folder that contains destination_dir.
+    """
+    models_dir = os.path.dirname(os.path.abspath(destination_dir))
+    return os.path.join(_get_state_dir(models_dir), INDEX_FILENAME)
+
+
+def _connect(index_path):
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS resolved ("
+        " url TEXT NOT NULL,"
+        " destination_dir TEXT NOT NULL,"
+        " filename TEXT NOT NULL,"
+        " size INTEGER,"
+        " etag TEXT,"
+        " updated_at REAL,"
+        " PRIMARY KEY (url, destination_dir))"
+    )
+    return conn
+
+
+def _index_lookup(url, destination_dir):
+    """
+    Returns the {filename, size, etag} entry previously resolved for url in destination_dir, or None.
+    """
+    destination_dir = os.path.abspath(destination_dir)
+    try:
+        index_path = _get_index_path(destination_dir)
+        key = (index_path, url, destination_dir)
+        with _index_lock:
+            if key in _index_cache:
+                return _index_cache[key]
+
+        with _connect(index_path) as conn:
+            row = conn.execute(
+                "SELECT filename, size, etag FROM resolved WHERE url = ? AND destination_dir = ?",
+                (url, destination_dir),
+            ).fetchone()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to read the download index: {e}")
+        return None
+
+    if row is None:
+        return None
+    entry = {"filename": row[0], "size": row[1], "etag": row[2]}
+    with _index_lock:
+        _index_cache[key] = entry
+    return entry
+
+
+def _index_record(url, destination_dir, filename, size, etag=None):
+    """
+    Stores the file a URL resolved to, so later runs can skip the network entirely.
+    """
+    destination_dir = os.path.abspath(destination_dir)
+    try:
+        index_path = _get_index_path(destination_dir)
+        with _connect(index_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO resolved (url, destination_dir, filename, size, etag, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, destination_dir, filename, size, etag, time.time()),
+            )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to update the download index: {e}")
+        return
+
+    with _index_lock:
+        _index_cache[(index_path, url, destination_dir)] = {"filename": filename, "size": size, "etag": etag}
+
+
+def _index_forget(url, destination_dir):
+    """
+    Drops a stale entry, e.g. when the indexed file was deleted or replaced.
+    """
+    destination_dir = os.path.abspath(destination_dir)
+    try:
+        index_path = _get_index_path(destination_dir)
+        with _index_lock:
+            _index_cache.pop((index_path, url, destination_dir), None)
+        with _connect(index_path) as conn:
+            conn.execute("DELETE FROM resolved WHERE url = ? AND destination_dir = ?", (url, destination_dir))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Unable to update the download index: {e}")
+
+
+def _resolve_from_index(url, destination_dir):
+    """
+    Returns the local path of an already downloaded model without any network access,
+    or None if the URL was never resolved or the file no longer matches the index.
+    """
+    entry = _index_lookup(url, destination_dir)
+    if entry is None:
+        return None
+
+    model_filepath = os.path.join(destination_dir, entry["filename"])
+    try:
+        size = os.stat(model_filepath).st_size
+    except OSError:
+        size = None
+
+    if size is None or (entry["size"] and size != entry["size"]):
+        logger.info(f"Indexed file '{model_filepath}' is missing or changed, resolving '{url}' again")
+        _index_forget(url, destination_dir)
+        return None
+    return model_filepath
@@ -1,219 +1,348 @@
-import json
 import os
-import requests
 import sys
-import logging
-from tqdm import tqdm
-import re
+import time
+import uuid
+import functools
+import threading
 import folder_paths
+import server
+import comfy.model_management
+import comfy.utils
+import comfy.sd
+import comfy.lora
 from pathlib import Path
 import importlib.util
-from nodes import LoraLoader, UNETLoader, CheckpointLoaderSimple, VAELoader, CLIPLoader,  ControlNetLoader, DualCLIPLoader, CLIPVisionLoader
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # Converts the LoRA formats of other trainers, in recent ComfyUI versions
+    from comfy.lora_convert import convert_lora
+except ImportError:
+    convert_lora = None
+from nodes import UNETLoader, CheckpointLoaderSimple, VAELoader, CLIPLoader,  ControlNetLoader, DualCLIPLoader, CLIPVisionLoader
+
+from .utils import logger, _env_int
+from .downloader import _download_model, _download_models, _prefetch_model, _download_manager, DEFAULT_DOWNLOAD_CHUNKS, LEGACY_DOWNLOAD_CHUNKS
+from .download_manager import DownloadCancelled
+from .http_client import _get_api_key_for_url
+from .config import _get_model_names, _get_config_entry, _get_config_sha256, _get_config_version, _get_config_entries
+from .model_cache import _pin_model
+from .lora_cache import _lora_cache
+from .metrics import LOAD_SECONDS
+from .search_index import _register_search_source, _inline_names
+
+# Advanced override of the read block size, the automatic size follows the measured throughput
+DOWNLOAD_CHUNKS_TOOLTIP = (f"Read block size of the download in KB. 0 (recommended) sizes the blocks from the measured throughput, "
+                           f"as do the values up to {LEGACY_DOWNLOAD_CHUNKS} of previous versions.")
+GGUF_MODULE_NAME = "ComfyUI-GGUF"
+_gguf_module = None
+_gguf_lock = threading.Lock()
+
+
+def _get_gguf_module():
+    """
+    Imports ComfyUI-GGUF on first use of the GGUF loader, so that its import does not slow down the server startup.
+    Reuses the module when ComfyUI already loaded it under the same name.
 
-LOG_PREFIX = "[ComfyUI-OnDemand-Loaders]"
+    Returns:
+        module: The ComfyUI-GGUF package, or None if it is not installed or fails to import.
+    """
+    global _gguf_module
+    with _gguf_lock:
+        if _gguf_module is not None:
+            return _gguf_module
+
+        if GGUF_MODULE_NAME in sys.modules:
+            _gguf_module = sys.modules[GGUF_MODULE_NAME]
+            return _gguf_module
+
+        parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        module_path = Path(parent_dir) / GGUF_MODULE_NAME / '__init__.py'
+        if not module_path.exists():
+            logger.warning(f"ComfyUI-GGUF installation not found! Expected location: {module_path.parent.as_posix()}")
+            return None
 
+        logger.info(f"Starting dynamic import of nodes.py from ComfyUI-GGUF...")
+        try:
+            spec = importlib.util.spec_from_file_location(GGUF_MODULE_NAME, str(module_path))
+            module_gguf = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module_gguf
+            spec.loader.exec_module(module_gguf)
+            logger.info(f"Successfully found and imported UnetLoaderGGUF dynamically.")
+        except Exception as e:
+            sys.modules.pop(GGUF_MODULE_NAME, None)
+            logger.error(f"Error during module execution (nodes.py content error): {e}")
+            return None
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-logger.handlers = []
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter(f"{LOG_PREFIX} %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+        _gguf_module = module_gguf
+        return _gguf_module
 
-logger.info(f"Starting dynamic import of nodes.py from ComfyUI-GGUF...")
 
-parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-module_path = Path(parent_dir) / 'ComfyUI-GGUF' / '__init__.py'
-module_name = "ComfyUI-GGUF"
-module_gguf = None
-if module_path.exists():
-    try:
-        spec = importlib.util.spec_from_file_location(module_name, str(module_path))
-        module_gguf = importlib.util.module_from_spec(spec)
-        sys.modules[spec.name] = module_gguf 
-        spec.loader.exec_module(module_gguf)
-
-        logger.info(f"Successfully found and imported UnetLoaderGGUF dynamically.")
-    except AttributeError as ae:
-        logger.error(f"'UnetLoaderGGUF' not found. Check the class name: {ae}")
-        module_gguf = None
-    except Exception as e:
-        logger.error(f"Error during module execution (nodes.py content error): {e}")
-        module_gguf = None
+def _timed_load(node):
+    """
+    Measures the wall time of the ComfyUI loader wrapped by an on-demand node.
+    """
+    return LOAD_SECONDS.time(node=type(node).__name__)
 
-else:
-    # Handle the missing file case gracefully
-    logger.warning(f"ComfyUI-GGUF installation not found! Expected location: {module_path.as_posix().parent}")
-    logger.warning(f"OnDemand GGUF Loaders will not be available")
 
+def _load_lora(model, clip, lora_filepath, strength_model, strength_clip):
+    """
+    Applies a LoRA like LoraLoader.load_lora, reading its weights from the process-wide LoRA cache.
+    """
+    if strength_model == 0 and strength_clip == 0:
+        return model, clip
+    lora = _lora_cache.get(lora_filepath, functools.partial(comfy.utils.load_torch_file, safe_load=True))
+    return comfy.sd.load_lora_for_models(model, clip, lora, strength_model, strength_clip)
 
-# Function to load configuration 
-def load_config(config_filename="config.json"):
-    
-    config_path_env = os.environ.get('ONDEMAND_LOADERS_CONFIG_PATH')
-    if config_path_env and os.path.exists(config_path_env):
-        config_path = config_path_env
-        config_filename = os.path.basename(config_path)
-    else:
-        current_dir = os.path.dirname(__file__)
-        config_path = os.path.join(current_dir, config_filename)
-    
-    default_config = { 
-        "loras": [
-            {
-                "name": "Lora n1",
-                "url": "not_valid_url",
-            },
-            {
-                "name": "Lora n2",
-                "url": "not_valid_url"
-            }
-        ]
-    }
 
-    try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-        logger.info(f"Successfully loaded configuration from {config_filename}")
-
-        # add None to all lists
-        for key in config:
-            if isinstance(config[key], list):
-                none_entry = {"name": "None", "url": None}
-                if none_entry not in config[key]:
-                    config[key].insert(0, none_entry)
-
-        return config
-    except FileNotFoundError:
-        logger.warning(f"Configuration file '{config_path}' not found. Using default fallback configuration.")
-        return default_config
-    except json.JSONDecodeError:
-        logger.error(f"Error decoding JSON from '{config_path}'. Using default fallback configuration.")
-        return default_config
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while loading '{config_path}': {e}. Using default fallback.")
-        return default_config
+# LoRA files of a stack parsed at the same time
+LORA_LOAD_WORKERS = 4
 
-def _get_api_key_for_url(model_url, api_key_param):
+
+def _parse_lora_stack(text):
+    """
+    Parses the text spec of OnDemandLoraStack: one LoRA per line, as `name`, `name:strength`
+    or `name:strength_model:strength_clip` (also inside `<lora:...>` tags). Lines starting with # are ignored.
+
+    Returns:
+        list: (lora name, strength_model, strength_clip) tuples.
     """
-    Determines the API key to use based on the model_url.
-    It checks for a provided api_key_param first, then environment variables.
+    entries = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if line.startswith("<lora:") and line.endswith(">"):
+            line = line[len("<lora:"):-1]
+        if not line or line.startswith("#"):
+            continue
+        # Names may contain colons, strengths are the numbers at the end
+        parts = line.split(":")
+        strengths = []
+        while len(parts) > 1 and len(strengths) < 2:
+            try:
+                strengths.insert(0, float(parts[-1]))
+            except ValueError:
+                break
+            parts.pop()
+        strength_model = strengths[0] if strengths else 1.0
+        strength_clip = strengths[1] if len(strengths) > 1 else strength_model
+        entries.append((":".join(parts).strip(), strength_model, strength_clip))
+    return entries
+
+
+def _apply_loras(model, clip, loras):
     """
-    if model_url.startswith("https://civitai.com"):
-        return api_key_param or os.environ.get('CIVITAI_TOKEN')
-    elif model_url.startswith("https://huggingface.co"):
-        return api_key_param or os.environ.get('HUGGINGFACE_TOKEN')
-    else:
-        return api_key_param # Return provided key if URL doesn't match known platforms
+    Applies (state dict, strength_model, strength_clip) LoRAs like comfy.sd.load_lora_for_models,
+    but to a single clone of the model and clip, with the LoRA key map computed once.
+    """
+    key_map = {}
+    if model is not None:
+        key_map = comfy.lora.model_lora_keys_unet(model.model, key_map)
+    if clip is not None:
+        key_map = comfy.lora.model_lora_keys_clip(clip.cond_stage_model, key_map)
+
+    new_model = model.clone() if model is not None else None
+    new_clip = clip.clone() if clip is not None else None
+    for lora, strength_model, strength_clip in loras:
+        if convert_lora is not None:
+            lora = convert_lora(lora)
+        loaded = comfy.lora.load_lora(lora, key_map)
+        patched = set()
+        if new_model is not None:
+            patched.update(new_model.add_patches(loaded, strength_model))
+        if new_clip is not None:
+            patched.update(new_clip.add_patches(loaded, strength_clip))
+        for key in loaded:
+            if key not in patched:
+                logger.warning(f"LoRA key not loaded: {key}")
+    return new_model, new_clip
+
+
+# Delay between two checks of the ComfyUI interrupt flag while downloads are running, in seconds
+INTERRUPT_POLL_INTERVAL = 0.25
+
+
+def _get_execution_context():
+    """
+    Attributes the downloads requested by a loader to the prompt and node being executed.
+    """
+    prompt_server = server.PromptServer.instance
+    return getattr(prompt_server, "last_prompt_id", None), getattr(prompt_server, "last_node_id", None)
 
 
-def _download_model(model_url, model_name, destination_dir, api_key, download_chunks):
+def _cancel_interrupted_downloads():
     """
-    Handles the download of a model from a given URL to a specified directory.
-    
-    Args:
-        model_url (str): The URL of the model to download.
-        model_name (str): The name of the model (for logging purposes).
-        destination_dir (str): The directory where the model should be saved.
-        api_key (str): API key for authentication, if required.
-        download_chunks (int): The size of download chunks in KB.
-        
-    Returns:
-        str: The full path to the downloaded model file, or None if an error occurred.
+    Cancels the downloads of the running prompt as soon as the user interrupts it, including
+    the prefetched models its remaining nodes would have waited for.
     """
-    if model_url == 'offline':
-        logger.info(f"'{model_name}' is marked as offline. Assuming local file exists and skipping download.")
-        # The user expects the model to exist, so we return the assumed path.
-        return os.path.join(destination_dir, model_name)
-
-    os.makedirs(destination_dir, exist_ok=True)
-
-    headers = None
-    if api_key:
-        logger.info(f"Using provided API key")
-        headers = {
-            "Authorization": f"Bearer {api_key}"
-        }
-
-    try:
-        response = requests.get(model_url, stream=True, allow_redirects=True, headers=headers)
-        response.raise_for_status()  # Raise an exception for bad status codes
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error making request for '{model_name}' from '{model_url}': {e}")
-        return None
-
-    model_filename = None
-    content_disposition = response.headers.get('Content-Disposition')
-    if content_disposition:
-        filename_match = re.search(r'filename="?([^"]+)"?', content_disposition)
-        if filename_match:
-            model_filename = filename_match.group(1).strip()
-    
-    if not model_filename:
-        # Fallback to extracting filename from URL if Content-Disposition is missing or malformed
-        model_filename = os.path.basename(model_url)
+    while True:
+        _download_manager.busy.wait()
+        if comfy.model_management.processing_interrupted():
+            prompt_id = getattr(server.PromptServer.instance, "last_prompt_id", None)
+            cancelled = _download_manager.cancel_prompt(prompt_id)
+            if cancelled:
+                logger.info(f"Prompt interrupted, cancelled {cancelled} download(s)")
+        time.sleep(INTERRUPT_POLL_INTERVAL)
 
-    model_filepath = os.path.join(destination_dir, model_filename)
 
-    if os.path.exists(model_filepath):
-        logger.info(f"File '{model_filename}' already exists at '{model_filepath}'. Skipping download.")
-        return model_filepath
-    else:
-        logger.info(f"Downloading '{model_name}' from '{model_url}' to '{model_filepath}'")
+def _interruptible(download):
+    """
+    Turns the cancellation of a download into a ComfyUI interrupt when the prompt was interrupted,
+    and into a failed download (None) when it was cancelled from the downloads list.
+    """
+    @functools.wraps(download)
+    def wrapper(*args, **kwargs):
         try:
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = download_chunks * 1024
-            with tqdm(total=total_size, unit='iB', unit_scale=True, desc=f"{LOG_PREFIX} Downloading {model_name}") as progress_bar:
-                with open(model_filepath, 'wb') as f:
-                    for data in response.iter_content(block_size):
-                        progress_bar.update(len(data))
-                        f.write(data)
-            logger.info(f"Successfully downloaded '{model_name}' filename {model_filename}.")
-            return model_filepath
-        except Exception as e:
-            logger.error(f"An unexpected error occurred during download of '{model_name}': {e}")
+            return download(*args, **kwargs)
+        except DownloadCancelled as e:
+            comfy.model_management.throw_exception_if_processing_interrupted()
+            logger.warning(str(e))
             return None
+    return wrapper
+
+
+_download_manager.set_context_provider(_get_execution_context)
+threading.Thread(target=_cancel_interrupted_downloads, name="ondemand-interrupts", daemon=True).start()
+# The loaders below (and the Civitai one) go through these wrappers
+_download_model = _interruptible(_download_model)
+_download_models = _interruptible(_download_models)
+
 
 def _get_model_url_from_config(model_name, model_type_key):
     """
-    Retrieves the URL for a given model name from the NODE_CONFIG.
+    Retrieves the URL for a given model name from the configuration.
     """
-    model_url = None
-    for model in NODE_CONFIG.get(model_type_key, []):
-        if model["name"] == model_name:
-            model_url = model["url"]
-            break
+    model = _get_config_entry(model_name, model_type_key)
+    model_url = model.get("url") if model else None
     if not model_url:
         logger.error(f"Model URL not found for name: {model_name} in {model_type_key}")
     return model_url
 
-NODE_CONFIG = load_config()
+def _get_model_sha256_from_config(model_name, model_type_key):
+    """
+    Retrieves the expected SHA-256 of a model from the configuration, if any.
+    """
+    return _get_config_sha256(_get_config_entry(model_name, model_type_key))
+
+def _config_url_resolver(model_type_key):
+    """
+    Returns a function mapping a model name of the given config section to its (URL, SHA-256).
+    """
+    def resolve(model_name):
+        model = _get_config_entry(model_name, model_type_key)
+        return (model.get("url"), _get_config_sha256(model)) if model else (None, None)
+    return resolve
+
+def _validate_model_name(model_name, model_type_key):
+    """
+    Checks a selected model against the whole config section, as the node definitions
+    only list the first names of very large sections.
+    """
+    # Inputs connected to other nodes have no value at validation time
+    if not isinstance(model_name, str) or _get_config_entry(model_name, model_type_key) is not None:
+        return True
+    return f"Model '{model_name}' not found in '{model_type_key}'"
+
+# Config sections searchable with /on_demand_loader/search
+SEARCHABLE_SECTIONS = ("loras", "diffusion_models", "checkpoints", "vae_models", "clip_models", "clip_vision", "gguf_models", "controlnet_models")
+for _section in SEARCHABLE_SECTIONS:
+    _register_search_source(_section, _get_config_version, lambda section=_section: _get_config_entries(section))
+
+# Start the downloads of a workflow as soon as it is queued, set to 0 to disable
+PREFETCH_ENABLED = _env_int('ONDEMAND_LOADERS_PREFETCH', 1) != 0
+
+# Model selection inputs of each on-demand node: (input name, (url, sha256) resolver, models subfolder),
+# optionally followed by a function returning the model names of an input selecting several models
+PREFETCH_INPUTS = {
+    "OnDemandLoraLoader": [("lora_name", _config_url_resolver("loras"), "loras")],
+    "OnDemandLoraStack": [("loras", _config_url_resolver("loras"), "loras", lambda text: [name for name, _, _ in _parse_lora_stack(text)])],
+    "OnDemandUNETLoader": [("unet_name", _config_url_resolver("diffusion_models"), "diffusion_models")],
+    "OnDemandCheckpointLoader": [("ckpt_name", _config_url_resolver("checkpoints"), "checkpoints")],
+    "OnDemandVAELoader": [("vae_name", _config_url_resolver("vae_models"), "vae")],
+    "OnDemandCLIPLoader": [("clip_name", _config_url_resolver("clip_models"), "text_encoders")],
+    "OnDemandDualCLIPLoader": [
+        ("clip_name1", _config_url_resolver("clip_models"), "text_encoders"),
+        ("clip_name2", _config_url_resolver("clip_models"), "text_encoders"),
+    ],
+    "OnDemandCLIPVisionLoader": [("clip_name", _config_url_resolver("clip_vision"), "clip_vision")],
+    "OnDemandGGUFLoader": [("unet_name", _config_url_resolver("gguf_models"), "unet")],
+    "OnDemandControlNetLoader": [("control_net_name", _config_url_resolver("controlnet_models"), "controlnet")],
+}
+
+
+def _prefetch_prompt_handler(json_data):
+    """
+    Called by ComfyUI when a prompt is queued. Starts the background download of every
+    on-demand model selected in the graph, so they all transfer concurrently while the
+    loaders only wait for them when execution reaches them.
+    """
+    if not PREFETCH_ENABLED:
+        return json_data
+
+    try:
+        # ComfyUI keeps the prompt_id of the request, so that an interrupt also cancels the prefetched downloads
+        prompt_id = json_data.setdefault("prompt_id", str(uuid.uuid4()))
+        for node_id, node in json_data.get("prompt", {}).items():
+            inputs = node.get("inputs", {})
+            for input_name, resolve_url, subfolder, *parse_names in PREFETCH_INPUTS.get(node.get("class_type"), []):
+                value = inputs.get(input_name)
+                # Inputs connected to other nodes are [node_id, output] links, not model names
+                if not isinstance(value, str):
+                    continue
+                for model_name in parse_names[0](value) if parse_names else [value]:
+                    _prefetch_input(inputs, model_name, resolve_url, subfolder, prompt_id, node_id)
+    except Exception as e:
+        logger.error(f"Unable to prefetch the models of the queued prompt: {e}")
+
+    return json_data
+
+
+def _prefetch_input(inputs, model_name, resolve_url, subfolder, prompt_id, node_id):
+    """
+    Starts the background download of a model selected by a node of a queued prompt.
+    """
+    if model_name == "None":
+        return
+    model_url, sha256 = resolve_url(model_name)
+    if not model_url:
+        return
+
+    api_key = inputs.get("api_key") if isinstance(inputs.get("api_key"), str) else None
+    api_key = _get_api_key_for_url(model_url, api_key or None)
+    download_chunks = inputs.get("download_chunks")
+    if not isinstance(download_chunks, int):
+        download_chunks = DEFAULT_DOWNLOAD_CHUNKS
+
+    destination_dir = os.path.join(folder_paths.models_dir, subfolder)
+    _prefetch_model(model_url, model_name, destination_dir, api_key, download_chunks, sha256, prompt_id, node_id)
+
+server.PromptServer.instance.add_on_prompt_handler(_prefetch_prompt_handler)
+
 
 class OnDemandLoraLoader:
 
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        loras = [lora["name"] for lora in NODE_CONFIG.get("loras", []) ]
+        loras = _get_model_names("loras")
        
         return {
             "required": {
                 "model": ("MODEL",),
-                "lora_name": (loras,),
+                "lora_name": (_inline_names(loras), {"search_source": "loras"}),
                 "strength_model": ("FLOAT", {"default": 1.0, "min": -10.0, "max": 10.0, "step": 0.01}),
                 "strength_clip": ("FLOAT", {"default": 1.0, "min": -10.0, "max": 10.0, "step": 0.01}),
             },
             "optional": {
                 "clip": ("CLIP", ),
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, lora_name=None):
+        return _validate_model_name(lora_name, "loras")
+
     RETURN_TYPES = ("MODEL", "CLIP")
     RETURN_NAMES = ("model", "clip")
     FUNCTION = "download_lora"
@@ -222,8 +351,6 @@ class OnDemandLoraLoader:
     CATEGORY = "loaders"
 
     def download_lora(self, model, lora_name, strength_model, strength_clip, clip=None, api_key=None, download_chunks=None):
-        self.lora_loader = LoraLoader()
-
         destination_dir = os.path.join(folder_paths.models_dir, "loras")
 
         lora_url = _get_model_url_from_config(lora_name, "loras")
@@ -232,15 +359,82 @@ class OnDemandLoraLoader:
 
         api_key = _get_api_key_for_url(lora_url, api_key)
 
-        lora_filepath = _download_model(lora_url, lora_name, destination_dir, api_key, download_chunks)
+        lora_filepath = _download_model(lora_url, lora_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(lora_name, "loras"))
         if not lora_filepath:
             return model, clip # Return original model/clip if download fails
 
-        lora_filename = os.path.basename(lora_filepath)
+        with _timed_load(self), _pin_model(lora_filepath):
+            return _load_lora(model, clip, lora_filepath, strength_model, strength_clip)
+
+
+class OnDemandLoraStack:
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "loras": ("STRING", {"default": "", "multiline": True,
+                                     "tooltip": "One LoRA of config.json per line: name, name:strength or name:strength_model:strength_clip. Lines starting with # are ignored."}),
+            },
+            "optional": {
+                "clip": ("CLIP", ),
+                "lora_stack": ("LORA_STACK", {"tooltip": "(lora name, strength_model, strength_clip) entries applied before the ones of the text."}),
+                "api_key": ("STRING", {"default": None, "multiline": False}),
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
+            }
+        }
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, loras=None):
+        missing = [name for name, _, _ in _parse_lora_stack(loras) if _get_config_entry(name, "loras") is None] if isinstance(loras, str) else []
+        if missing:
+            return f"Loras not found in 'loras': {', '.join(missing)}"
+        return True
 
-        # Load the LORA using the existing LoraLoader
-        model_lora, clip_lora = self.lora_loader.load_lora(model, clip, lora_filename, strength_model, strength_clip)
-        return model_lora, clip_lora
+    RETURN_TYPES = ("MODEL", "CLIP")
+    RETURN_NAMES = ("model", "clip")
+    FUNCTION = "load_loras"
+    DESCRIPTION = "Apply several loras of config.json at once: missing files are downloaded in parallel and all the loras are patched into a single copy of the model.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
+
+    CATEGORY = "loaders"
+
+    def load_loras(self, model, loras, clip=None, lora_stack=None, api_key=None, download_chunks=None):
+        entries = [tuple(entry) for entry in lora_stack or []] + _parse_lora_stack(loras)
+        entries = [(name, strength_model, strength_clip) for name, strength_model, strength_clip in entries
+                   if name and name != "None" and (strength_model != 0 or strength_clip != 0)]
+        if not entries:
+            return model, clip
+
+        destination_dir = os.path.join(folder_paths.models_dir, "loras")
+        downloads = []
+        for lora_name, strength_model, strength_clip in entries:
+            # An unknown or failed lora is logged and skipped like in the other loaders, the rest of the stack is still applied
+            lora_url = _get_model_url_from_config(lora_name, "loras")
+            if lora_url:
+                downloads.append(((lora_name, strength_model, strength_clip),
+                                  (lora_url, lora_name, destination_dir, _get_api_key_for_url(lora_url, api_key), download_chunks,
+                                   _get_model_sha256_from_config(lora_name, "loras"))))
+
+        # Every file of the stack downloads at the same time
+        entries, lora_filepaths = [], []
+        for entry, lora_filepath in zip([entry for entry, _ in downloads], _download_models([download for _, download in downloads])):
+            if lora_filepath:
+                entries.append(entry)
+                lora_filepaths.append(lora_filepath)
+            else:
+                logger.error(f"Unable to download lora '{entry[0]}', it is not applied")
+        if not entries:
+            return model, clip
+
+        with _timed_load(self), ExitStack() as pins:
+            for lora_filepath in lora_filepaths:
+                pins.enter_context(_pin_model(lora_filepath))
+            load = functools.partial(comfy.utils.load_torch_file, safe_load=True)
+            with ThreadPoolExecutor(max_workers=min(LORA_LOAD_WORKERS, len(lora_filepaths)), thread_name_prefix="ondemand-lora") as executor:
+                state_dicts = list(executor.map(lambda lora_filepath: _lora_cache.get(lora_filepath, load), lora_filepaths))
+            return _apply_loras(model, clip, [(state_dict, strength_model, strength_clip)
+                                              for state_dict, (_, strength_model, strength_clip) in zip(state_dicts, entries)])
 
 
 class OnDemandUNETLoader:
@@ -248,20 +442,23 @@ class OnDemandUNETLoader:
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("diffusion_models", []) ]
+        models = _get_model_names("diffusion_models")
        
         return {
             "required": {
-                "unet_name": (models,),
+                "unet_name": (_inline_names(models), {"search_source": "diffusion_models"}),
                 "weight_dtype": (["default", "fp8_e4m3fn", "fp8_e4m3fn_fast", "fp8_e5m2"],)
             },
             "optional": {
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, unet_name=None):
+        return _validate_model_name(unet_name, "diffusion_models")
+
     RETURN_TYPES = ("MODEL",)
     FUNCTION = "download_unet"
     DESCRIPTION = "Load diffusion models from CivitAI/HuggingFace, they will be downloaded automatically if not found.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
@@ -279,14 +476,15 @@ class OnDemandUNETLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, unet_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, unet_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(unet_name, "diffusion_models"))
         if not model_filepath:
             return None
 
         model_filename = os.path.basename(model_filepath)
 
         # Load the Model using the existing UNETLoader
-        model_output = self.unet_loader.load_unet(model_filename, weight_dtype)
+        with _timed_load(self), _pin_model(model_filepath):
+            model_output = self.unet_loader.load_unet(model_filename, weight_dtype)
         return model_output
 
 
@@ -295,19 +493,22 @@ class OnDemandCheckpointLoader:
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("checkpoints", []) ]
+        models = _get_model_names("checkpoints")
        
         return {
             "required": {
-                "ckpt_name": (models,)
+                "ckpt_name": (_inline_names(models), {"search_source": "checkpoints"})
             },
             "optional": {
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, ckpt_name=None):
+        return _validate_model_name(ckpt_name, "checkpoints")
+
     RETURN_TYPES = ("MODEL", "CLIP", "VAE")
     OUTPUT_TOOLTIPS = ("The model used for denoising latents.",
                        "The CLIP model used for encoding text prompts.",
@@ -327,33 +528,37 @@ class OnDemandCheckpointLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, ckpt_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, ckpt_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(ckpt_name, "checkpoints"))
         if not model_filepath:
             return None, None, None # Return None for all outputs if download fails
 
         model_filename = os.path.basename(model_filepath)
 
         # Load the checkpoint using the existing CheckpointLoaderSimple
-        return self.checkpoint_loader.load_checkpoint(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.checkpoint_loader.load_checkpoint(model_filename)
 
 class OnDemandVAELoader:
     
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("vae_models", []) ]
+        models = _get_model_names("vae_models")
        
         return {
             "required": {
-                "vae_name": (models,)
+                "vae_name": (_inline_names(models), {"search_source": "vae_models"})
             },
             "optional": {
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, vae_name=None):
+        return _validate_model_name(vae_name, "vae_models")
+
     RETURN_TYPES = ("VAE",)
     FUNCTION = "download_vae"
     DESCRIPTION = "Load vae models from CivitAI/HuggingFace, they will be downloaded automatically if not found.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
@@ -370,32 +575,37 @@ class OnDemandVAELoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, vae_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, vae_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(vae_name, "vae_models"))
         if not model_filepath:
             return None, None, None # Return None for all outputs if download fails
 
         model_filename = os.path.basename(model_filepath)
 
         # Load vae using the existing VAELoader
-        return self.vae_loader.load_vae(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.vae_loader.load_vae(model_filename)
 
 class OnDemandCLIPLoader:
 
     @classmethod
     def INPUT_TYPES(s):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("clip_models", []) ]
+        models = _get_model_names("clip_models")
 
         return {"required": { 
-                                "clip_name": (models,),
+                                "clip_name": (_inline_names(models), {"search_source": "clip_models"}),
                                 "type": (["stable_diffusion", "stable_cascade", "sd3", "stable_audio", "mochi", "ltxv", "pixart", "cosmos", "lumina2", "wan", "hidream", "chroma", "ace", "omnigen2", "qwen_image", "hunyuan_image"], ),
                               },
                 "optional": {
                                 "device": (["default", "cpu"], {"advanced": True}),
                                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
                              }}
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, clip_name=None):
+        return _validate_model_name(clip_name, "clip_models")
+
     RETURN_TYPES = ("CLIP",)
     FUNCTION = "download_clip"
     CATEGORY = "loaders"
@@ -412,14 +622,15 @@ class OnDemandCLIPLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, clip_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, clip_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(clip_name, "clip_models"))
         if not model_filepath:
             return None
 
         model_filename = os.path.basename(model_filepath)
 
         # Load the checkpoint using the existing CheckpointLoaderSimple
-        return self.clip_loader.load_clip(model_filename, type, device)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.clip_loader.load_clip(model_filename, type, device)
 
 
 class OnDemandDualCLIPLoader:
@@ -427,19 +638,27 @@ class OnDemandDualCLIPLoader:
     @classmethod
     def INPUT_TYPES(s):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("clip_models", []) ]
+        models = _get_model_names("clip_models")
 
         return {"required": { 
-                                "clip_name1": (models,),
-                                "clip_name2": (models,),
+                                "clip_name1": (_inline_names(models), {"search_source": "clip_models"}),
+                                "clip_name2": (_inline_names(models), {"search_source": "clip_models"}),
                                 "type": (["sdxl", "sd3", "flux", "hunyuan_video", "hidream", "hunyuan_image", "hunyuan_video_15"], ),
                               },
                 "optional": {
                                 "device": (["default", "cpu"], {"advanced": True}),
                                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
                              }}
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, clip_name1=None, clip_name2=None):
+        for clip_name in (clip_name1, clip_name2):
+            result = _validate_model_name(clip_name, "clip_models")
+            if result is not True:
+                return result
+        return True
+
     RETURN_TYPES = ("CLIP",)
     FUNCTION = "download_clip"
     CATEGORY = "loaders"
@@ -450,49 +669,46 @@ class OnDemandDualCLIPLoader:
 
         destination_dir = os.path.join(folder_paths.models_dir, "text_encoders")
 
-        # clip_name1
         model_url1 = _get_model_url_from_config(clip_name1, "clip_models")
-        if not model_url1:
-            return None
-
-        api_key = _get_api_key_for_url(model_url1, api_key)
-
-        model_filepath1 = _download_model(model_url1, clip_name1, destination_dir, api_key, download_chunks)
-        if not model_filepath1:
-            return None
-
-        model_filename1 = os.path.basename(model_filepath1)
-
-        # clip_name2
         model_url2 = _get_model_url_from_config(clip_name2, "clip_models")
-        if not model_url2:
+        if not model_url1 or not model_url2:
             return None
 
-        api_key = _get_api_key_for_url(model_url2, api_key)
-
-        model_filepath2 = _download_model(model_url2, clip_name2, destination_dir, api_key, download_chunks)
-        if not model_filepath2:
+        # Both encoders are resolved and downloaded concurrently
+        model_filepath1, model_filepath2 = _download_models([
+            (model_url1, clip_name1, destination_dir, _get_api_key_for_url(model_url1, api_key), download_chunks,
+             _get_model_sha256_from_config(clip_name1, "clip_models")),
+            (model_url2, clip_name2, destination_dir, _get_api_key_for_url(model_url2, api_key), download_chunks,
+             _get_model_sha256_from_config(clip_name2, "clip_models")),
+        ])
+        if not model_filepath1 or not model_filepath2:
             return None
 
+        model_filename1 = os.path.basename(model_filepath1)
         model_filename2 = os.path.basename(model_filepath2)
 
-        return self.clip_loader.load_clip(model_filename1, model_filename2, type, device)
+        with _timed_load(self), _pin_model(model_filepath1), _pin_model(model_filepath2):
+            return self.clip_loader.load_clip(model_filename1, model_filename2, type, device)
 
 class OnDemandCLIPVisionLoader:
 
     @classmethod
     def INPUT_TYPES(s):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("clip_vision", []) ]
+        models = _get_model_names("clip_vision")
 
         return {"required": { 
-                                "clip_name": (models,),
+                                "clip_name": (_inline_names(models), {"search_source": "clip_vision"}),
                               },
                 "optional": {
                                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
                              }}
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, clip_name=None):
+        return _validate_model_name(clip_name, "clip_vision")
+
     RETURN_TYPES = ("CLIP_VISION",)
     FUNCTION = "download_clip"
     CATEGORY = "loaders"
@@ -509,13 +725,14 @@ class OnDemandCLIPVisionLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, clip_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, clip_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(clip_name, "clip_vision"))
         if not model_filepath:
             return None
 
         model_filename = os.path.basename(model_filepath)
 
-        return self.clip_loader.load_clip(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.clip_loader.load_clip(model_filename)
 
 
 class OnDemandGGUFLoader:
@@ -523,26 +740,31 @@ class OnDemandGGUFLoader:
     @classmethod
     def INPUT_TYPES(s):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("gguf_models", []) ]
+        models = _get_model_names("gguf_models")
 
         return {"required": { 
-                                "unet_name": (models,)                        
+                                "unet_name": (_inline_names(models), {"search_source": "gguf_models"})                        
                               },
                 "optional": {
                                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
                              }}
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, unet_name=None):
+        return _validate_model_name(unet_name, "gguf_models")
+
     RETURN_TYPES = ("MODEL",)
     FUNCTION = "download_unet"
     CATEGORY = "loaders"
     DESCRIPTION = "Load gguf models from CivitAI/HuggingFace, they will be downloaded automatically if not found.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
 
     def download_unet(self, unet_name, api_key=None, download_chunks=None):
-        if module_gguf is None:
+        module_gguf = _get_gguf_module()
+        if module_gguf is None or not hasattr(getattr(module_gguf, "nodes", None), "UnetLoaderGGUF"):
             logger.error(f"UnetLoaderGGUF class not available. Ensure ComfyUI-GGUF is installed correctly.")
             return None
-        
+
         self.gguf_loader = module_gguf.nodes.UnetLoaderGGUF()
 
         destination_dir = os.path.join(folder_paths.models_dir, "unet")
@@ -553,33 +775,37 @@ class OnDemandGGUFLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, unet_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, unet_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(unet_name, "gguf_models"))
         if not model_filepath:
             return None
 
         model_filename = os.path.basename(model_filepath)
 
         # Load the gguf using the existing UnetLoaderGGUF
-        return self.gguf_loader.load_unet(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.gguf_loader.load_unet(model_filename)
 
 class OnDemandControlNetLoader:
     
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("controlnet_models", []) ]
+        models = _get_model_names("controlnet_models")
        
         return {
             "required": {
-                "control_net_name": (models,)
+                "control_net_name": (_inline_names(models), {"search_source": "controlnet_models"})
             },
             "optional": {
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, control_net_name=None):
+        return _validate_model_name(control_net_name, "controlnet_models")
+
     RETURN_TYPES = ("CONTROL_NET",)
     FUNCTION = "download_controlnet"
     DESCRIPTION = "Load control_net models from CivitAI/HuggingFace, they will be downloaded automatically if not found.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
@@ -596,14 +822,15 @@ class OnDemandControlNetLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, control_net_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, control_net_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(control_net_name, "controlnet_models"))
         if not model_filepath:
             return None # Return None for all outputs if download fails
 
         model_filename = os.path.basename(model_filepath)
 
         # Load vae using the existing VAELoader
-        return self.controlnet_loader.load_controlnet(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.controlnet_loader.load_controlnet(model_filename)
 
 
 class OnDemandControlNetLoader:
@@ -611,19 +838,22 @@ class OnDemandControlNetLoader:
     @classmethod
     def INPUT_TYPES(cls):
 
-        NODE_CONFIG = load_config()
-        models = [model["name"] for model in NODE_CONFIG.get("controlnet_models", []) ]
+        models = _get_model_names("controlnet_models")
        
         return {
             "required": {
-                "control_net_name": (models,)
+                "control_net_name": (_inline_names(models), {"search_source": "controlnet_models"})
             },
             "optional": {
                 "api_key": ("STRING", {"default": None, "multiline": False}),
-                "download_chunks": ("INT", {"default": 4, "min": 1, "max": 12, "step": 1})
+                "download_chunks": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 1, "advanced": True, "tooltip": DOWNLOAD_CHUNKS_TOOLTIP})
             }
         }
 
+    @classmethod
+    def VALIDATE_INPUTS(cls, control_net_name=None):
+        return _validate_model_name(control_net_name, "controlnet_models")
+
     RETURN_TYPES = ("CONTROL_NET",)
     FUNCTION = "download_controlnet"
     DESCRIPTION = "Load control_net models from CivitAI/HuggingFace, they will be downloaded automatically if not found.\nPut a valid CivitAI/HuggingFace API key in form field 'api_key' or in CIVITAI_TOKEN/HUGGINGFACE_TOKEN environment variable to access private models"
@@ -640,11 +870,12 @@ class OnDemandControlNetLoader:
 
         api_key = _get_api_key_for_url(model_url, api_key)
 
-        model_filepath = _download_model(model_url, control_net_name, destination_dir, api_key, download_chunks)
+        model_filepath = _download_model(model_url, control_net_name, destination_dir, api_key, download_chunks, _get_model_sha256_from_config(control_net_name, "controlnet_models"))
         if not model_filepath:
             return None # Return None for all outputs if download fails
 
         model_filename = os.path.basename(model_filepath)
 
         # Load vae using the existing VAELoader
-        return self.controlnet_loader.load_controlnet(model_filename)
+        with _timed_load(self), _pin_model(model_filepath):
+            return self.controlnet_loader.load_controlnet(model_filename)
@@ -0,0 +1,101 @@
+import json
+import asyncio
+import server
+from aiohttp import web
+
+from .search_index import _search, SEARCH_PAGE_SIZE
+from .downloader import _download_manager
+from .metrics import _render_metrics
+
+# Websocket event carrying the state and progress of a download job
+DOWNLOAD_EVENT = "on_demand_loader.download"
+
+
+def _int_param(request, name, default):
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+@server.PromptServer.instance.routes.get("/on_demand_loader/search")
+async def search_handler(request):
+    """
+    Ranked, paginated search of a model list, used by the node dropdowns instead of the full list.
+    Query parameters: source (config section or civitai_liked_loras), q, offset, limit.
+    """
+    source = request.query.get("source")
+    query = request.query.get("q", "")
+    offset = _int_param(request, "offset", 0)
+    limit = _int_param(request, "limit", SEARCH_PAGE_SIZE)
+
+    # Building the index of a large list takes a while, keep the event loop responsive
+    result = await asyncio.get_running_loop().run_in_executor(None, _search, source, query, offset, limit)
+    if result is None:
+        return web.Response(status=404, text=json.dumps({"error": f"Unknown or not loaded source '{source}'."}), content_type='application/json')
+
+    items, total = result
+    return web.Response(status=200, text=json.dumps({"items": items, "total": total, "offset": offset}), content_type='application/json')
+
+
+def _send_download_event(job):
+    # Called from the downloading threads, send_sync hands the message over to the event loop
+    server.PromptServer.instance.send_sync(DOWNLOAD_EVENT, job)
+
+
+_download_manager.add_listener(_send_download_event)
+
+
+def _job_response(applied, job_id, action):
+    if _download_manager.get(job_id) is None:
+        return web.Response(status=404, text=json.dumps({"error": f"Unknown download '{job_id}'."}), content_type='application/json')
+    if not applied:
+        return web.Response(status=409, text=json.dumps({"error": f"Download '{job_id}' cannot be {action}."}), content_type='application/json')
+    return web.Response(status=200, text=json.dumps(_download_manager.get(job_id).to_dict()), content_type='application/json')
+
+
+@server.PromptServer.instance.routes.get("/on_demand_loader/downloads")
+async def list_downloads_handler(request):
+    """
+    Lists the queued, running, paused and recently finished downloads.
+    """
+    return web.Response(status=200, text=json.dumps({"jobs": _download_manager.list()}), content_type='application/json')
+
+
+@server.PromptServer.instance.routes.post("/on_demand_loader/downloads/{job_id}/pause")
+async def pause_download_handler(request):
+    job_id = request.match_info["job_id"]
+    return _job_response(_download_manager.pause(job_id), job_id, "paused")
+
+
+@server.PromptServer.instance.routes.post("/on_demand_loader/downloads/{job_id}/resume")
+async def resume_download_handler(request):
+    job_id = request.match_info["job_id"]
+    return _job_response(_download_manager.resume(job_id), job_id, "resumed")
+
+
+@server.PromptServer.instance.routes.post("/on_demand_loader/downloads/{job_id}/cancel")
+async def cancel_download_handler(request):
+    job_id = request.match_info["job_id"]
+    return _job_response(_download_manager.cancel(job_id), job_id, "cancelled")
+
+
+@server.PromptServer.instance.routes.post("/on_demand_loader/downloads/{job_id}/priority")
+async def prioritize_download_handler(request):
+    """
+    Body: {"priority": <int>}, queued downloads with a higher priority start first.
+    """
+    job_id = request.match_info["job_id"]
+    try:
+        priority = int((await request.json())["priority"])
+    except (ValueError, KeyError, TypeError):
+        return web.Response(status=400, text=json.dumps({"error": "Expected an integer 'priority'."}), content_type='application/json')
+    return _job_response(_download_manager.set_priority(job_id, priority), job_id, "reprioritized")
+
+
+@server.PromptServer.instance.routes.get("/on_demand_loader/metrics")
+async def metrics_handler(request):
+    """
+    Download, cache and load metrics in the Prometheus text format.
+    """
+    return web.Response(status=200, text=_render_metrics(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
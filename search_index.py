@@ -0,0 +1,176 @@
+import re
+import bisect
+import threading
+
+from .utils import _env_int
+
+# Longest model list sent in the node definitions, larger lists are searched through /on_demand_loader/search
+INLINE_NAMES_LIMIT = _env_int('ONDEMAND_LOADERS_INLINE_NAMES_LIMIT', 1000)
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 500
+
+# Entry fields searched besides the name
+SEARCH_FIELDS = ("author", "base_model", "trigger_words")
+WORD_SEPARATORS = " -_./()[]"
+WORD_PATTERN = re.compile(r"[^ \-_./()\[\]]+")
+
+# Searchable model lists: source name -> (version getter, entries getter)
+_search_sources = {}
+# Built indexes: source name -> (version, SearchIndex)
+_search_indexes = {}
+_search_lock = threading.Lock()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _entry_texts(entry):
+    """
+    Returns the lowercase searchable texts of a config or catalog entry, besides its name.
+    """
+    texts = []
+    for field in SEARCH_FIELDS:
+        value = entry.get(field)
+        if isinstance(value, list):
+            texts.extend(str(v) for v in value if v)
+        elif value:
+            texts.append(str(value))
+    return " ".join(texts).lower()
+
+
+class SearchIndex:
+    """
+    In-memory trigram index over the names and metadata of a model list. A query only
+    checks the entries containing every trigram of its words, then ranks them: exact name,
+    name prefix, word prefix, name substring, words in the name, words in the metadata.
+    Queries shorter than a trigram match the beginning of the words of the names.
+    """
+
+    def __init__(self, entries):
+        self.names = []
+        self.name_texts = []
+        self.field_texts = []
+        self.trigrams = {}
+        self.words = []
+        for doc_id, entry in enumerate(entries):
+            name = str(entry.get("name"))
+            name_text = name.lower()
+            field_text = _entry_texts(entry)
+            self.names.append(name)
+            self.name_texts.append(name_text)
+            self.field_texts.append(field_text)
+            for trigram in _trigrams(name_text) | _trigrams(field_text):
+                self.trigrams.setdefault(trigram, []).append(doc_id)
+            self.words.extend((word, doc_id) for word in set(WORD_PATTERN.findall(name_text)))
+        self.words.sort()
+
+    def _prefix_candidates(self, prefix):
+        start = bisect.bisect_left(self.words, (prefix,))
+        candidates = set()
+        for word, doc_id in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            candidates.add(doc_id)
+        return candidates
+
+    def _candidates(self, words):
+        postings = [self.trigrams.get(trigram, ()) for word in words for trigram in _trigrams(word)]
+        if not postings:
+            # Words shorter than a trigram only match the beginning of a word of the name
+            candidates = None
+            for word in words:
+                prefix_candidates = self._prefix_candidates(word)
+                candidates = prefix_candidates if candidates is None else candidates & prefix_candidates
+            return candidates
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return candidates
+
+    def _rank(self, doc_id, query, words):
+        name = self.name_texts[doc_id]
+        if name == query:
+            return 0
+        if name.startswith(query):
+            return 1
+        position = name.find(query)
+        if position > 0:
+            return 2 if name[position - 1] in WORD_SEPARATORS else 3
+        if all(word in name for word in words):
+            return 4
+        fields = self.field_texts[doc_id]
+        if all(word in name or word in fields for word in words):
+            return 5
+        return None
+
+    def search(self, query, offset=0, limit=SEARCH_PAGE_SIZE):
+        """
+        Returns:
+            (list, int): The names of the requested page of results, and the total number of results.
+        """
+        query = " ".join(query.lower().split())
+        if not query:
+            return self.names[offset:offset + limit], len(self.names)
+
+        words = query.split()
+        ranked = []
+        for doc_id in self._candidates(words):
+            rank = self._rank(doc_id, query, words)
+            if rank is not None:
+                ranked.append((rank, len(self.name_texts[doc_id]), self.name_texts[doc_id], doc_id))
+        ranked.sort()
+        return [self.names[r[-1]] for r in ranked[offset:offset + limit]], len(ranked)
+
+
+def _register_search_source(source, get_version, get_entries):
+    """
+    Makes a model list searchable. get_version must return the same object as long as
+    the list is unchanged, the index is rebuilt when it changes.
+    """
+    _search_sources[source] = (get_version, get_entries)
+
+
+def _get_search_index(source):
+    """
+    Returns the up to date index of a source, or None if the source is unknown or not loaded yet.
+    """
+    if source not in _search_sources:
+        return None
+    get_version, get_entries = _search_sources[source]
+    version = get_version()
+    with _search_lock:
+        cached = _search_indexes.get(source)
+        if cached is not None and cached[0] is version:
+            return cached[1]
+        entries = get_entries()
+        if entries is None:
+            return None
+        index = SearchIndex(entries)
+        _search_indexes[source] = (version, index)
+        return index
+
+
+def _search(source, query, offset=0, limit=SEARCH_PAGE_SIZE):
+    """
+    Searches a registered model list.
+
+    Returns:
+        (list, int): A page of matching names and the total number of matches, or None if the source is unknown.
+    """
+    index = _get_search_index(source)
+    if index is None:
+        return None
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    return index.search(query, max(0, offset), limit)
+
+
+def _inline_names(names):
+    """
+    Returns the model names to embed in a node definition, truncated for very large lists
+    whose dropdown searches the server instead.
+    """
+    return names if len(names) <= INLINE_NAMES_LIMIT else names[:INLINE_NAMES_LIMIT]
@@ -0,0 +1,273 @@
+"""
+Models published as several files: sharded safetensors listed by a `.safetensors.index.json`,
+and `-00001-of-00003` splits of safetensors or GGUF files. The ComfyUI loaders take a
+single file, so the shards are merged once downloaded.
+"""
+import os
+import re
+import json
+import struct
+import hashlib
+from urllib.parse import urlparse, urljoin, quote
+
+INDEX_SUFFIX = ".safetensors.index.json"
+# e.g. model-00001-of-00003.gguf, the numbers keep their width
+SPLIT_PATTERN = re.compile(r'-(\d+)-of-(\d+)(\.safetensors|\.gguf)$')
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+GGUF_MAGIC = b"GGUF"
+GGUF_DEFAULT_ALIGNMENT = 32
+# Byte size of the fixed-size GGUF value types, by type id
+GGUF_SCALAR_SIZES = {0: 1, 1: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4, 7: 1, 10: 8, 11: 8, 12: 8}
+GGUF_STRING = 8
+GGUF_ARRAY = 9
+GGUF_UINT32 = 4
+# Metadata keys describing the split, dropped from the merged file
+GGUF_SPLIT_KEY_PREFIX = "split."
+
+
+def _is_sharded_url(model_url):
+    """
+    Returns True if model_url points at a shard index or at one split of a model.
+    """
+    path = urlparse(model_url).path
+    return path.endswith(INDEX_SUFFIX) or SPLIT_PATTERN.search(path) is not None
+
+
+def _split_urls(model_url):
+    """
+    Returns the URLs of every split of a model, from the URL of any of them.
+    """
+    parsed = urlparse(model_url)
+    match = SPLIT_PATTERN.search(parsed.path)
+    width, count = len(match.group(1)), int(match.group(2))
+    prefix = parsed.path[:match.start()]
+    return [
+        parsed._replace(path=f"{prefix}-{number:0{width}d}-of-{match.group(2)}{match.group(3)}").geturl()
+        for number in range(1, count + 1)
+    ]
+
+
+def _index_shard_urls(model_url, index):
+    """
+    Returns the URLs of the shards listed by the weight_map of a parsed `.safetensors.index.json`,
+    relative to the URL of the index.
+    """
+    filenames = sorted(set((index.get("weight_map") or {}).values()))
+    if not filenames:
+        raise ValueError("the index does not list any shard")
+    query = urlparse(model_url).query
+    return [urljoin(model_url, quote(filename)) + (f"?{query}" if query else "") for filename in filenames]
+
+
+def _merged_extension(model_url):
+    path = urlparse(model_url).path
+    if path.endswith(INDEX_SUFFIX):
+        return ".safetensors"
+    return SPLIT_PATTERN.search(path).group(3)
+
+
+class _HashingWriter:
+    """
+    Writes a file sequentially while computing its SHA-256.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def pad_to(self, position):
+        if position > self.size:
+            self.write(b"\0" * (position - self.size))
+
+
+def _copy_range(f, start, size, writer):
+    f.seek(start)
+    while size > 0:
+        block = f.read(min(COPY_BLOCK_SIZE, size))
+        if not block:
+            raise ValueError(f"'{f.name}' is truncated")
+        writer.write(block)
+        size -= len(block)
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError(f"'{f.name}' is truncated")
+    return data
+
+
+def _read_safetensors_header(f):
+    header_size = struct.unpack("<Q", _read_exact(f, 8))[0]
+    return json.loads(_read_exact(f, header_size)), 8 + header_size
+
+
+def _merge_safetensors(shard_paths, writer):
+    """
+    Writes a single safetensors file holding the tensors of every shard.
+    """
+    header = {}
+    metadata = {}
+    copies = []
+    offset = 0
+    for shard_path in shard_paths:
+        with open(shard_path, 'rb') as f:
+            shard_header, data_start = _read_safetensors_header(f)
+        metadata.update(shard_header.pop("__metadata__", None) or {})
+        for name, info in sorted(shard_header.items(), key=lambda item: item[1]["data_offsets"][0]):
+            if name in header:
+                raise ValueError(f"tensor '{name}' found in several shards")
+            begin, end = info["data_offsets"]
+            header[name] = dict(info, data_offsets=[offset, offset + end - begin])
+            copies.append((shard_path, data_start + begin, end - begin, None))
+            offset += end - begin
+
+    if metadata:
+        header = {"__metadata__": metadata, **header}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # The data section starts 8-byte aligned, the header is padded with spaces
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    writer.write(struct.pack("<Q", len(header_bytes)) + header_bytes)
+    _copy_all(copies, writer)
+
+
+def _copy_all(copies, writer):
+    """
+    Copies (source path, start, size, destination) ranges in order, opening each source once.
+    The output is zero-padded up to the destination offset, if any.
+    """
+    current_path, f = None, None
+    try:
+        for source_path, start, size, destination in copies:
+            if source_path != current_path:
+                if f:
+                    f.close()
+                current_path, f = source_path, open(source_path, 'rb')
+            if destination is not None:
+                writer.pad_to(destination)
+            _copy_range(f, start, size, writer)
+    finally:
+        if f:
+            f.close()
+
+
+def _read_gguf_value(f, value_type):
+    """
+    Returns the raw bytes of a GGUF metadata value.
+    """
+    if value_type in GGUF_SCALAR_SIZES:
+        return _read_exact(f, GGUF_SCALAR_SIZES[value_type])
+    if value_type == GGUF_STRING:
+        raw_length = _read_exact(f, 8)
+        return raw_length + _read_exact(f, struct.unpack("<Q", raw_length)[0])
+    if value_type == GGUF_ARRAY:
+        raw_header = _read_exact(f, 12)
+        item_type, count = struct.unpack("<IQ", raw_header)
+        if item_type in GGUF_SCALAR_SIZES:
+            return raw_header + _read_exact(f, GGUF_SCALAR_SIZES[item_type] * count)
+        return raw_header + b"".join(_read_gguf_value(f, item_type) for _ in range(count))
+    raise ValueError(f"unknown GGUF value type {value_type} in '{f.name}'")
+
+
+def _align(offset, alignment):
+    return offset + (-offset % alignment)
+
+
+def _read_gguf_header(gguf_path):
+    """
+    Parses the header of a GGUF file (version 2 or 3).
+
+    Returns:
+        dict: version, alignment, kvs as (key, raw bytes) pairs, tensors as (raw info without
+        the offset, offset, size) tuples, and data_start.
+    """
+    with open(gguf_path, 'rb') as f:
+        if _read_exact(f, 4) != GGUF_MAGIC:
+            raise ValueError(f"'{gguf_path}' is not a GGUF file")
+        version, tensor_count, kv_count = struct.unpack("<IQQ", _read_exact(f, 20))
+        if version not in (2, 3):
+            raise ValueError(f"unsupported GGUF version {version} in '{gguf_path}'")
+
+        kvs = []
+        alignment = GGUF_DEFAULT_ALIGNMENT
+        for _ in range(kv_count):
+            raw_length = _read_exact(f, 8)
+            key = _read_exact(f, struct.unpack("<Q", raw_length)[0])
+            raw_type = _read_exact(f, 4)
+            value_type = struct.unpack("<I", raw_type)[0]
+            raw_value = _read_gguf_value(f, value_type)
+            if key == b"general.alignment" and value_type == GGUF_UINT32:
+                alignment = struct.unpack("<I", raw_value)[0]
+            kvs.append((key.decode("utf-8"), raw_length + key + raw_type + raw_value))
+
+        infos = []
+        for _ in range(tensor_count):
+            raw_length = _read_exact(f, 8)
+            raw_name = _read_exact(f, struct.unpack("<Q", raw_length)[0])
+            raw_dims_count = _read_exact(f, 4)
+            raw_dims = _read_exact(f, 8 * struct.unpack("<I", raw_dims_count)[0])
+            raw_type = _read_exact(f, 4)
+            offset = struct.unpack("<Q", _read_exact(f, 8))[0]
+            infos.append((raw_length + raw_name + raw_dims_count + raw_dims + raw_type, offset))
+        data_start = _align(f.tell(), alignment)
+        data_size = os.fstat(f.fileno()).st_size - data_start
+
+    # Tensors span up to the next one (alignment padding included) or the end of the file
+    offsets = sorted(offset for _, offset in infos) + [data_size]
+    next_offset = {offset: offsets[i + 1] for i, offset in enumerate(offsets[:-1])}
+    tensors = [(raw_info, offset, next_offset[offset] - offset) for raw_info, offset in infos]
+    return {"version": version, "alignment": alignment, "kvs": kvs, "tensors": tensors, "data_start": data_start}
+
+
+def _merge_gguf(split_paths, writer):
+    """
+    Writes a single GGUF file from the splits of llama.cpp's gguf-split: the metadata of the
+    first split, without the split.* keys, and the tensors of every split.
+    """
+    splits = [_read_gguf_header(split_path) for split_path in split_paths]
+    first = splits[0]
+    alignment = first["alignment"]
+    kvs = [raw for key, raw in first["kvs"] if not key.startswith(GGUF_SPLIT_KEY_PREFIX)]
+
+    infos = []
+    copies = []
+    offset = 0
+    for split_path, split in zip(split_paths, splits):
+        for raw_info, tensor_offset, size in split["tensors"]:
+            offset = _align(offset, alignment)
+            infos.append(raw_info + struct.pack("<Q", offset))
+            copies.append((split_path, split["data_start"] + tensor_offset, size, offset))
+            offset += size
+
+    writer.write(GGUF_MAGIC + struct.pack("<IQQ", first["version"], len(infos), len(kvs)) + b"".join(kvs) + b"".join(infos))
+    data_start = _align(writer.size, alignment)
+    writer.pad_to(data_start)
+    _copy_all([(split_path, start, size, data_start + offset) for split_path, start, size, offset in copies], writer)
+
+
+def _merge_shards(shard_paths, output_path, extension):
+    """
+    Merges downloaded shards, in order, into a single file loadable by ComfyUI.
+
+    Args:
+        shard_paths (list): The downloaded shards.
+        output_path (str): Where to write the merged file.
+        extension (str): The format of the shards, ".safetensors" or ".gguf".
+
+    Returns:
+        (int, str): The size and SHA-256 of the merged file.
+    """
+    with open(output_path, 'wb') as f:
+        writer = _HashingWriter(f)
+        if extension == ".gguf":
+            _merge_gguf(shard_paths, writer)
+        else:
+            _merge_safetensors(shard_paths, writer)
+    return writer.size, writer.sha256.hexdigest()
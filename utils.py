@@ -0,0 +1,54 @@
+import os
+import sys
+import logging
+
+LOG_PREFIX = "[ComfyUI-OnDemand-Loaders]"
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+logger.handlers = []
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter(f"{LOG_PREFIX} %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+def _env_int(name, default):
+    """
+    Reads an integer setting from the environment, falling back to default if unset or invalid.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Invalid value '{value}' for {name}, using default {default}")
+        return default
+
+
+def _get_state_dir(models_dir):
+    """
+    Returns the directory where the loaders keep their bookkeeping files (index, caches, locks).
+    Defaults to a hidden folder inside the ComfyUI models directory, override with ONDEMAND_LOADERS_STATE_DIR.
+    """
+    state_dir = os.environ.get('ONDEMAND_LOADERS_STATE_DIR') or os.path.join(models_dir, ".ondemand_loaders")
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def _env_float(name, default):
+    """
+    Reads a float setting from the environment, falling back to default if unset or invalid.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Invalid value '{value}' for {name}, using default {default}")
+        return default